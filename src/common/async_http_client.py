@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The asyncio HTTP client used between the services
+
+The asyncio counterpart of common.http_client: the connections are pooled and
+kept alive, every call has a timeout and connection errors are retried with
+exponential backoff. The responses are read completely, so they can be used
+as the responses of requests (status_code, text, headers, json()).
+"""
+
+import asyncio
+import json
+import os
+
+import aiohttp
+
+class ServiceResponse:
+    # pylint: disable=too-few-public-methods
+    """A response read completely from a service."""
+
+    def __init__(self, status_code, text, headers=None):
+        """
+        Args:
+            status_code (int): The HTTP status code.
+            text (str): The body.
+            headers (multidict.CIMultiDict, optional): The headers. Defaults
+                                                       to None (no headers).
+        """
+
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers if headers is not None else {}
+
+    def json(self):
+        """
+        Raises:
+            json.decoder.JSONDecodeError: If the body is not JSON.
+        Returns:
+            The decoded body.
+        """
+
+        return json.loads(self.text)
+
+class AsyncServiceClient:
+    """A pooled, keep-alive asyncio HTTP client for one of Math Bot's
+    services. start must be called in the event loop before the first call.
+    """
+
+    def __init__(self, base_url, timeout=5.0, pool_size=100, retries=3,
+                 backoff=0.1):
+        """
+        Args:
+            base_url (str): The service's URL, e.g. "http://math_bot:5001".
+            timeout (float, optional): The timeout (seconds) of every call,
+                                       including the wait for a free
+                                       connection. Defaults to 5.0.
+            pool_size (int, optional): The maximum number of open connections,
+                                       the other calls wait for one of them.
+                                       Defaults to 100.
+            retries (int, optional): How many times to retry a call which
+                                     could not connect. Defaults to 3.
+            backoff (float, optional): The backoff factor (seconds) between
+                                       retries. Defaults to 0.1.
+        """
+
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+
+    async def start(self):
+        """Opens the connection pool."""
+
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+
+    async def close(self):
+        """Closes the connection pool."""
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method, path, **kwargs):
+        """Calls the service.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The path of the route, e.g. "/api/user".
+            **kwargs: Arguments for aiohttp.ClientSession.request.
+        Raises:
+            aiohttp.ClientError: If the call failed.
+            asyncio.TimeoutError: If the call timed out.
+        Returns:
+            ServiceResponse: The response.
+        """
+
+        attempt = 0
+        while True:
+            try:
+                async with self.session.request(method,
+                                                f"{self.base_url}{path}",
+                                                **kwargs) as resp:
+                    return ServiceResponse(resp.status, await resp.text(),
+                                           resp.headers.copy())
+            except aiohttp.ClientConnectorError:
+                # The request was not sent, so retrying is safe for every
+                # method.
+                if attempt >= self.retries:
+                    raise
+
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    async def get(self, path, **kwargs):
+        """Calls the service with GET."""
+
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        """Calls the service with POST."""
+
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        """Calls the service with PUT."""
+
+        return await self.request("PUT", path, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        """Calls the service with DELETE."""
+
+        return await self.request("DELETE", path, **kwargs)
+
+def async_client_from_env(base_url):
+    """Creates a client configured by the environment variables HTTP_TIMEOUT,
+    ASYNC_HTTP_POOL_SIZE, HTTP_RETRIES and HTTP_BACKOFF.
+
+    Args:
+        base_url (str): The service's URL.
+    Returns:
+        AsyncServiceClient: The client.
+    """
+
+    return AsyncServiceClient(
+        base_url,
+        timeout=float(os.getenv("HTTP_TIMEOUT", "5")),
+        pool_size=int(os.getenv("ASYNC_HTTP_POOL_SIZE", "100")),
+        retries=int(os.getenv("HTTP_RETRIES", "3")),
+        backoff=float(os.getenv("HTTP_BACKOFF", "0.1"))
+    )
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - A closed-loop HTTP benchmark
+
+Several clients call the same route, each sending its next request when the
+previous one is answered, and the throughput and latency are reported. E.g.:
+    python -m common.benchmark http://localhost:5000 /api/courses -c 32 -d 10
+"""
+
+import json
+import threading
+
+from argparse import ArgumentParser
+from time import perf_counter
+
+import requests
+
+from common.http_client import ServiceClient
+
+def percentile(values, fraction):
+    """
+    Args:
+        values (list): Sorted latencies (seconds).
+        fraction (float): The wanted percentile, e.g. 0.99.
+    Returns:
+        float: The percentile, in milliseconds.
+    """
+
+    if not values:
+        return 0.0
+
+    return round(values[int(fraction * (len(values) - 1))] * 1000, 2)
+
+def run(url, request, concurrency=16, duration=10.0):
+    """
+    Run the benchmark.
+
+    Args:
+        url (str): The service's URL.
+        request (dict): The request's "method", "path" and optional JSON
+                        "body".
+        concurrency (int, optional): The number of clients. Defaults to 16.
+        duration (float, optional): How long (seconds) to run. Defaults to 10.
+    Returns:
+        dict: The number of requests and errors, the throughput (requests per
+              second) and the latency percentiles (milliseconds).
+    """
+
+    client = ServiceClient(url, pool_size=concurrency, retries=0)
+    latencies = []
+    errors = []
+    deadline = perf_counter() + duration
+
+    def worker():
+        while perf_counter() < deadline:
+            start = perf_counter()
+            try:
+                req = client.request(request["method"], request["path"],
+                                     json=request.get("body"))
+                failed = req.status_code >= 500
+            except requests.exceptions.RequestException:
+                failed = True
+
+            # list.append is atomic, no lock is needed.
+            latencies.append(perf_counter() - start)
+            if failed:
+                errors.append(1)
+
+    start = perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = perf_counter() - start
+
+    latencies.sort()
+
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(latencies, 0.5),
+        "p90_ms": percentile(latencies, 0.9),
+        "p99_ms": percentile(latencies, 0.99)
+    }
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark a route of a service.")
+    parser.add_argument("url", help="the service's URL")
+    parser.add_argument("path", help="the route, e.g. /api/courses")
+    parser.add_argument("-m", "--method", default="GET",
+                        help="the HTTP method (default: GET)")
+    parser.add_argument("-b", "--body", type=json.loads, default=None,
+                        help="the JSON body of the requests")
+    parser.add_argument("-c", "--concurrency", type=int, default=16,
+                        help="the number of clients (default: 16)")
+    parser.add_argument("-d", "--duration", type=float, default=10.0,
+                        help="the duration in seconds (default: 10)")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.url, {"method": args.method, "path": args.path,
+                                    "body": args.body},
+                         args.concurrency, args.duration)))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The HTTP client used between the services
+
+The connections are kept alive and reused, every call has a timeout and
+connection errors are retried with exponential backoff.
+"""
+
+import os
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class ServiceClient:
+    """A pooled, keep-alive HTTP client for one of Math Bot's services."""
+
+    def __init__(self, base_url, timeout=5.0, pool_size=10, retries=3,
+                 backoff=0.1):
+        """
+        Args:
+            base_url (str): The service's URL, e.g. "http://math_bot:5001".
+            timeout (float, optional): The timeout (seconds) of every call.
+                                       Defaults to 5.0.
+            pool_size (int, optional): The maximum number of kept alive
+                                       connections. Defaults to 10.
+            retries (int, optional): How many times to retry a call which
+                                     could not connect. Defaults to 3.
+            backoff (float, optional): The backoff factor (seconds) between
+                                       retries. Defaults to 0.1.
+        """
+
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+        # Only connection errors are retried, the request was not sent then,
+        # so retrying is safe for every method.
+        retry = Retry(total=retries, connect=retries, read=0, status=0,
+                      redirect=0, backoff_factor=backoff)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, path, **kwargs):
+        """Calls the service.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The path of the route, e.g. "/api/user".
+            **kwargs: Arguments for requests.Session.request.
+        Raises:
+            requests.exceptions.RequestException: If the call failed.
+        Returns:
+            requests.Response: The response.
+        """
+
+        kwargs.setdefault("timeout", self.timeout)
+
+        return self.session.request(method, f"{self.base_url}{path}",
+                                    **kwargs)
+
+    def get(self, path, **kwargs):
+        """Calls the service with GET."""
+
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        """Calls the service with POST."""
+
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        """Calls the service with PUT."""
+
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        """Calls the service with DELETE."""
+
+        return self.request("DELETE", path, **kwargs)
+
+def client_from_env(base_url):
+    """Creates a client configured by the environment variables HTTP_TIMEOUT,
+    HTTP_POOL_SIZE, HTTP_RETRIES and HTTP_BACKOFF.
+
+    Args:
+        base_url (str): The service's URL.
+    Returns:
+        ServiceClient: The client.
+    """
+
+    return ServiceClient(
+        base_url,
+        timeout=float(os.getenv("HTTP_TIMEOUT", "5")),
+        pool_size=int(os.getenv("HTTP_POOL_SIZE", "10")),
+        retries=int(os.getenv("HTTP_RETRIES", "3")),
+        backoff=float(os.getenv("HTTP_BACKOFF", "0.1"))
+    )
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The cache of the responses of another service
+
+A cached response is used as it is for ttl seconds. After that, it is
+revalidated with a conditional request (If-None-Match with its ETag): a 304
+keeps it for ttl seconds more, a 200 replaces it. The database adapter sends
+the content version of every content response (X-Content-Version), so a cache
+can tell whether a new response needs to be processed again.
+"""
+
+import threading
+
+from time import monotonic
+
+# The header carrying the content version of a response.
+VERSION_HEADER = "X-Content-Version"
+
+class CacheEntry:
+    # pylint: disable=too-few-public-methods
+    """A cached value, with the validators of the response it came from."""
+
+    def __init__(self, value, etag, version, expires):
+        """
+        Args:
+            value: The cached value, e.g. the response's body.
+            etag (str): The response's ETag header, None if it had none.
+            version (str): The response's content version, None if it had
+                           none.
+            expires (float): When the value needs revalidation (monotonic).
+        """
+
+        self.value = value
+        self.etag = etag
+        self.version = version
+        self.expires = expires
+
+    def headers(self):
+        """
+        Returns:
+            dict: The validators, as the headers of a response.
+        """
+
+        headers = {}
+        if self.etag is not None:
+            headers["ETag"] = self.etag
+        if self.version is not None:
+            headers[VERSION_HEADER] = self.version
+
+        return headers
+
+class ResponseCache:
+    """Responses kept by key for ttl seconds, then revalidated."""
+
+    def __init__(self, ttl=60.0):
+        """
+        Args:
+            ttl (float, optional): How long (seconds) a response is used
+                                   before being revalidated. Defaults to 60.
+        """
+
+        self.ttl = ttl
+        # key -> CacheEntry
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """
+        Returns:
+            tuple: The key's entry (None if there is none) and True if it can
+                   be used without revalidation.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+        return (entry, entry is not None and monotonic() < entry.expires)
+
+    def request_headers(self, key):
+        """
+        Returns:
+            dict: The headers making the request of a key conditional, empty
+                  if there is nothing to revalidate.
+        """
+
+        (entry, _) = self.lookup(key)
+
+        if entry is None or entry.etag is None:
+            return {}
+
+        return {"If-None-Match": entry.etag}
+
+    def store(self, key, value, headers):
+        """Caches a value for ttl seconds.
+
+        Args:
+            key (str): The key, e.g. the route.
+            value: The value.
+            headers (dict): The headers of the response the value came from.
+        Returns:
+            CacheEntry: The new entry.
+        """
+
+        entry = CacheEntry(value, headers.get("ETag"),
+                           headers.get(VERSION_HEADER),
+                           monotonic() + self.ttl)
+
+        with self._lock:
+            self._entries[key] = entry
+
+        return entry
+
+    def revalidated(self, key):
+        """Keeps a key's value for ttl seconds more, as the service confirmed
+        it is up to date.
+
+        Returns:
+            CacheEntry: The entry, None if there is none.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.expires = monotonic() + self.ttl
+
+        return entry
+
+    def update(self, key, entry, reply):
+        """Updates a key with the service's reply to its conditional request:
+        a 304 revalidates the entry, a 200 replaces it with the reply's body.
+
+        Args:
+            key (str): The key.
+            entry (CacheEntry): The key's entry, None if there is none.
+            reply: The reply, with its status_code, text and headers.
+        Returns:
+            CacheEntry: The key's entry, None if the reply is an error.
+        """
+
+        if reply.status_code == 304 and entry is not None:
+            return self.revalidated(key)
+
+        if reply.status_code == 200:
+            return self.store(key, reply.text, reply.headers)
+
+        return None
+
+def etag_matches(etag, if_none_match):
+    """
+    Returns:
+        bool: True if an If-None-Match header matches an ETag, so a 304 can be
+              returned.
+    """
+
+    if etag is None or not if_none_match:
+        return False
+
+    def strong(tag):
+        # The weak comparison of RFC 7232, the "W/" prefix is ignored.
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    tags = {strong(tag) for tag in if_none_match.split(",")}
+
+    return "*" in tags or strong(etag) in tags
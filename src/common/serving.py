@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The production server of the Flask services
+
+In production, the services run in gunicorn instead of Flask's development
+server: several worker processes, each serving several requests at once, with
+request timeouts and graceful reloads (send SIGHUP to the master process).
+Everything loaded before calling serve (e.g. the model) is shared by the
+workers, copy-on-write.
+"""
+
+import os
+
+from gunicorn.app.base import BaseApplication
+
+class Server(BaseApplication):
+    """A gunicorn server for an already created Flask app."""
+
+    def __init__(self, app, options, post_fork=None):
+        """
+        Args:
+            app (flask.Flask): The app.
+            options (dict): gunicorn's settings.
+            post_fork (function, optional): Called in every worker after it
+                                            is created. Defaults to None.
+        """
+
+        self.app = app
+        self.options = options
+        self.post_fork = post_fork
+        super().__init__()
+
+    def init(self, parser, opts, args):
+        """Not used, the settings are given by load_config."""
+
+    def load_config(self):
+        """Applies the settings."""
+
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+        if self.post_fork is not None:
+            self.cfg.set("post_fork",
+                         lambda server, worker: self.post_fork())
+
+    def load(self):
+        """
+        Returns:
+            flask.Flask: The app.
+        """
+
+        return self.app
+
+def server_options(host, port, workers=2, threads=8):
+    """
+    Build gunicorn's settings, the defaults being overridden by WEB_WORKERS,
+    WEB_THREADS, WEB_TIMEOUT, WEB_GRACEFUL_TIMEOUT and WEB_MAX_REQUESTS.
+
+    Args:
+        host (str): The address to bind to.
+        port (int): The port to bind to.
+        workers (int, optional): The default number of worker processes.
+                                 Defaults to 2.
+        threads (int, optional): The default number of threads of a worker.
+                                 Defaults to 8.
+    Returns:
+        dict: The settings.
+    """
+
+    max_requests = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+
+    return {
+        "bind": f"{host}:{port}",
+        "workers": int(os.getenv("WEB_WORKERS", str(workers))),
+        "threads": int(os.getenv("WEB_THREADS", str(threads))),
+        # A worker busy with one request for longer than this is restarted.
+        "timeout": int(os.getenv("WEB_TIMEOUT", "30")),
+        # How long the workers have to finish their requests on reload / exit.
+        "graceful_timeout": int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30")),
+        # Restart the workers after this many requests (0 = never).
+        "max_requests": max_requests,
+        "max_requests_jitter": max_requests // 10,
+        "preload_app": True
+    }
+
+def serve(app, host, port, post_fork=None, **defaults):
+    """
+    Serve an app with gunicorn, until the server is stopped.
+
+    Args:
+        app (flask.Flask): The app.
+        host (str): The address to bind to.
+        port (int): The port to bind to.
+        post_fork (function, optional): Called in every worker after it is
+                                        created, e.g. to open the worker's own
+                                        database connections. Defaults to None.
+        **defaults: The default numbers of workers and threads, see
+                    server_options.
+    """
+
+    Server(app, server_options(host, port, **defaults), post_fork).run()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The validation of the JSON bodies exchanged by the services
+
+jsonschema.validate checks the schema against its metaschema and builds a new
+validator on every call. Here every schema is checked and its validator built
+once, when the module defining it is imported, and validating a body only runs
+the validator. The schemas used by several services are defined here.
+
+Running this module is a microbenchmark of validating a body both ways:
+    python -m common.validation -n 10000
+"""
+
+import json
+import timeit
+
+from argparse import ArgumentParser
+from functools import partial
+
+import jsonschema
+
+def compile_schema(schema):
+    """
+    Check a schema and build its validator.
+
+    Args:
+        schema (dict): The JSON schema.
+    Raises:
+        jsonschema.exceptions.SchemaError: If the schema is not valid.
+    Returns:
+        The validator, e.g. a jsonschema.Draft7Validator.
+    """
+
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+
+    return validator_class(schema)
+
+def validate_json(json_data, validator):
+    """
+    Check if a JSON object follow a schema or not.
+
+    Args:
+        json_data (dict): The input JSON obect.
+        validator: The wanted schema's validator, built by compile_schema.
+    Returns:
+        bool: True if the object is correct, False otherwise.
+    """
+
+    return validator.is_valid(json_data)
+
+# A course, as sent by the database adapter.
+COURSE_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "course_id": {"type": "number"},
+        "course_name": {"type": "string"},
+        "course_description": {"type": "string"},
+        "course_num_steps": {"type": "number"},
+        "course_num_questions": {"type": "number"}
+    },
+    "required": ["course_id", "course_name", "course_description",
+                 "course_num_steps", "course_num_questions"]
+})
+
+# The body of a user's registration.
+REGISTER_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "user_id": {"type": "number"},
+        "user_name": {"type": "string"}
+    },
+    "required": ["user_id", "user_name"]
+})
+
+# The body of an enrollment to a course.
+ENROLL_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "user_id": {"type": "number"},
+        "course_name": {"type": "string"}
+    },
+    "required": ["user_id", "course_name"]
+})
+
+# The body of a user's message.
+MESSAGE_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "user_id": {"type": "number"},
+        "message": {"type": "string"}
+    },
+    "required": ["user_id", "message"]
+})
+
+def benchmark(number):
+    """
+    Time the validation of valid and invalid bodies with jsonschema.validate
+    (per call) and with the compiled validators.
+
+    Args:
+        number (int): The validations of every body.
+    Returns:
+        list: The microseconds per validation, for every body.
+    """
+
+    def per_call(body, schema):
+        try:
+            jsonschema.validate(instance=body, schema=schema)
+        except jsonschema.exceptions.ValidationError:
+            return False
+
+        return True
+
+    course = {"course_id": 1, "course_name": "Geometry",
+              "course_description": "Points and lines", "course_num_steps": 9,
+              "course_num_questions": 5}
+    cases = [
+        ("message", MESSAGE_SCHEMA, {"user_id": 1, "message": "an answer"}),
+        ("message, missing field", MESSAGE_SCHEMA, {"user_id": 1}),
+        ("course", COURSE_SCHEMA, course),
+        ("course, wrong type", COURSE_SCHEMA, {**course, "course_id": "1"})
+    ]
+
+    results = []
+    for (name, validator, body) in cases:
+        # Both ways must agree.
+        assert per_call(body, validator.schema) == \
+               validate_json(body, validator)
+
+        before = timeit.timeit(partial(per_call, body, validator.schema),
+                               number=number)
+        after = timeit.timeit(partial(validate_json, body, validator),
+                              number=number)
+
+        results.append({"body": name,
+                        "per_call_us": round(before / number * 1e6, 2),
+                        "compiled_us": round(after / number * 1e6, 2),
+                        "speedup": round(before / after, 1)})
+
+    return results
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the validation of the "
+                                        "JSON bodies.")
+    parser.add_argument("-n", "--number", type=int, default=10000,
+                        help="the validations of every body (default: 10000)")
+    args = parser.parse_args()
+
+    for result in benchmark(args.number):
+        print(json.dumps(result))
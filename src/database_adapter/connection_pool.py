@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The pool of connections to the database
+
+Every request checks out its own connection, which is returned to the pool
+when the request ends. The queries are prepared once per pooled connection.
+"""
+
+import os
+import sys
+
+from threading import BoundedSemaphore, Lock
+from time import monotonic, sleep
+from flask import abort, current_app, g
+from psycopg2.pool import ThreadedConnectionPool
+
+import psycopg2
+import psycopg2.extensions
+
+class PreparedConnection(psycopg2.extensions.connection):
+    # pylint: disable=too-few-public-methods
+    """
+    A connection which remembers if the statements were prepared on it.
+    """
+
+    prepared = False
+
+def prepare_statements(conn, statements):
+    """
+    Prepare the statements on a connection, once in its lifetime. Prepared
+    statements live as long as the database session, so the queries are parsed
+    and planned once per pooled connection, not on every request.
+
+    Args:
+        conn (PreparedConnection): The connection.
+        statements (dict): The queries, name -> (parameter types, query).
+    """
+
+    if conn.prepared:
+        return
+
+    with conn.cursor() as cursor:
+        for name, (types, query) in statements.items():
+            params = f" ({', '.join(types)})" if types else ""
+            cursor.execute(f"PREPARE {name}{params} AS {query};")
+    conn.commit()
+
+    conn.prepared = True
+
+def execute(cursor, name, *params):
+    """
+    Run a prepared statement.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The cursor.
+        name (str): The statement's name.
+        params: The statement's parameters.
+    """
+
+    if params:
+        placeholders = ", ".join(["%s"] * len(params))
+        cursor.execute(f"EXECUTE {name} ({placeholders});", params)
+    else:
+        cursor.execute(f"EXECUTE {name};")
+
+class PoolTimeout(Exception):
+    """
+    No connection was freed in time.
+    """
+
+class ConnectionPool:
+    # pylint: disable=too-many-instance-attributes
+    """
+    A bounded pool of connections to the PostgreSQL database, with the
+    prepared statements and the saturation metrics.
+    """
+
+    def __init__(self, logger, statements, minconn=1, maxconn=10, timeout=5.0,
+                 ping_idle=30.0):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        """
+        Args:
+            logger (logging.Logger): The application's logger.
+            statements (dict): The queries prepared on every connection,
+                               name -> (parameter types, query).
+            minconn (int, optional): The connections kept open. Defaults to 1.
+            maxconn (int, optional): The most connections. Defaults to 10.
+            timeout (float, optional): How long a checkout waits for a free
+                                       connection (seconds). Defaults to 5.
+            ping_idle (float, optional): Connections idle for longer than this
+                                         (seconds) are checked on checkout.
+                                         Defaults to 30.
+        """
+
+        self.logger = logger
+        self.statements = statements
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_idle = ping_idle
+
+        self._pool = None
+        self._slots = BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._stats_lock = Lock()
+        self._stats = {"checkouts": 0, "waits": 0, "timeouts": 0, "in_use": 0,
+                       "peak_in_use": 0}
+
+    def open(self):
+        """
+        Connect to the database, retrying with backoff until its server
+        starts. The connections opened before, if any, are dropped.
+        """
+
+        host = os.getenv("POSTGRES_HOST", "database")
+        database = os.getenv("POSTGRES_DB", "postgres")
+        user = os.getenv("POSTGRES_USER", "admin")
+        password = os.getenv("POSTGRES_PASSWORD", "adminpass")
+        retries = int(os.getenv("DB_CONNECT_RETRIES", "10"))
+        delay = 0.5
+
+        self._last_used.clear()
+
+        for _ in range(retries):
+            try:
+                self._pool = ThreadedConnectionPool(
+                    self.minconn, self.maxconn, host=host, database=database,
+                    user=user, password=password,
+                    connection_factory=PreparedConnection)
+
+                self.logger.info("Connection with database ready!")
+
+                return
+            except psycopg2.OperationalError:
+                self.logger.warning("Connection with database failed! Retry "
+                                    "in %.1fs...", delay)
+                sleep(delay)
+                delay = min(delay * 2, 10)
+
+        self.logger.critical("Connection with database failed!")
+        sys.exit(1)
+
+    def closeall(self):
+        """
+        Close all the connections, e.g. before gunicorn forks the workers,
+        which cannot share them.
+        """
+
+        self._pool.closeall()
+
+    def getconn(self):
+        """
+        Take a connection outside of a request (e.g. when populating the
+        database). It is not counted by the metrics.
+
+        Returns:
+            PreparedConnection: The connection.
+        """
+
+        return self._pool.getconn()
+
+    def putconn(self, conn):
+        """
+        Return a connection taken by getconn.
+
+        Args:
+            conn (PreparedConnection): The connection.
+        """
+
+        self._pool.putconn(conn)
+
+    def is_alive(self, conn):
+        """
+        Check if a connection can still be used.
+
+        Args:
+            conn (psycopg2.extensions.connection): The connection.
+        Returns:
+            bool: True if the connection works, False otherwise.
+        """
+
+        if conn.closed:
+            return False
+
+        # Connections used recently are trusted, the others are pinged.
+        if monotonic() - self._last_used.get(id(conn), 0) < self.ping_idle:
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+
+        return True
+
+    def checkout(self):
+        """
+        Take a working connection, with the statements prepared. If no
+        connection is free, wait for the pool's timeout.
+
+        Raises:
+            PoolTimeout: If no connection was freed in time.
+            psycopg2.Error: If the database cannot be reached.
+        Returns:
+            PreparedConnection: The connection, to be given back by checkin.
+        """
+
+        # The slot is released by checkin, when the request ends.
+        # pylint: disable=consider-using-with
+        waited = not self._slots.acquire(blocking=False)
+        if waited and not self._slots.acquire(timeout=self.timeout):
+            with self._stats_lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout()
+        # pylint: enable=consider-using-with
+
+        try:
+            conn = self._pool.getconn()
+            if not self.is_alive(conn):
+                self.logger.warning("Broken database connection, "
+                                    "reconnecting...")
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            prepare_statements(conn, self.statements)
+        except psycopg2.Error:
+            self._slots.release()
+            raise
+
+        with self._stats_lock:
+            self._stats["checkouts"] += 1
+            self._stats["waits"] += waited
+            self._stats["in_use"] += 1
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"],
+                                             self._stats["in_use"])
+
+        return conn
+
+    def checkin(self, conn, exc=None):
+        """
+        Give back a connection taken by checkout. Broken connections are
+        closed and replaced later.
+
+        Args:
+            conn (PreparedConnection): The connection.
+            exc (Exception, optional): The error which ended the request, if
+                                       any. Defaults to None.
+        """
+
+        broken = conn.closed or isinstance(exc, (psycopg2.OperationalError,
+                                                 psycopg2.InterfaceError))
+        if not broken:
+            try:
+                # Drop anything left uncommitted by the request.
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+
+        if broken:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = monotonic()
+
+        self._pool.putconn(conn, close=bool(broken))
+        self._slots.release()
+
+        with self._stats_lock:
+            self._stats["in_use"] -= 1
+
+    def metrics(self):
+        """
+        Returns:
+            dict: The pool's saturation metrics and sizes.
+        """
+
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        stats["min"] = self.minconn
+        stats["max"] = self.maxconn
+
+        return stats
+
+    def init_app(self, app):
+        """
+        Serve the requests of a Flask application from the pool (see get_conn).
+
+        Args:
+            app (flask.Flask): The application.
+        """
+
+        app.extensions["connection_pool"] = self
+        app.teardown_appcontext(put_conn)
+
+def pool_from_env(logger, statements):
+    """
+    Create the connection pool configured by DB_POOL_MIN, DB_POOL_MAX,
+    DB_POOL_TIMEOUT and DB_POOL_PING_IDLE. It is not connected yet.
+
+    Args:
+        logger (logging.Logger): The application's logger.
+        statements (dict): The queries prepared on every connection.
+    Returns:
+        ConnectionPool: The pool.
+    """
+
+    return ConnectionPool(
+        logger, statements,
+        minconn=int(os.getenv("DB_POOL_MIN", "1")),
+        maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+        timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+        ping_idle=float(os.getenv("DB_POOL_PING_IDLE", "30"))
+    )
+
+def get_conn():
+    """
+    Check out a connection from the application's pool for the current
+    request. The connection is returned to the pool when the request ends. If
+    no connection is free in time, fail the request with 503.
+
+    Returns:
+        psycopg2.extensions.connection: The connection.
+    """
+
+    if "conn" in g:
+        return g.conn
+
+    try:
+        g.conn = current_app.extensions["connection_pool"].checkout()
+    except (PoolTimeout, psycopg2.Error):
+        abort(503)
+
+    return g.conn
+
+def put_conn(exc):
+    """
+    Return the request's connection, if any, to the application's pool.
+
+    Args:
+        exc (Exception): The error which ended the request, if any.
+    """
+
+    conn = g.pop("conn", None)
+    if conn is not None:
+        current_app.extensions["connection_pool"].checkin(conn, exc)
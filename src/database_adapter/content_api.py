@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The routes of the course content
+
+The courses, course steps, mid-course questions and test steps are answered
+from the application's content cache (see content_cache.py), never from the
+database.
+"""
+
+import json
+import random
+
+from flask import Blueprint, Response, current_app, request
+
+from connection_pool import get_conn
+from common.response_cache import VERSION_HEADER
+from common.validation import compile_schema, validate_json
+
+# The routes of the course content
+CONTENT_API = Blueprint("content", __name__)
+
+# The columns which can be selected from the "courses" table.
+COURSE_COLUMNS = ("course_id", "course_name", "course_description",
+                  "course_num_steps", "course_num_questions")
+
+def content_response(content, results):
+    """
+    Create the response for a content query. The content's ETag is sent, so
+    the client can make the next query conditional, and its version, so the
+    client can tell when the content changed.
+
+    Args:
+        content (content_cache.Content): The content snapshot used.
+        results (list or dict): The body of the response.
+    Returns:
+        Response: - 200 and the results in the body.
+                  - 304 if the client's copy matches the ETag.
+    """
+
+    response = Response(
+        status=200,
+        response=json.dumps(results),
+        mimetype="application/json"
+    )
+    response.set_etag(content.etag)
+    if content.version is not None:
+        response.headers[VERSION_HEADER] = str(content.version)
+
+    return response.make_conditional(request)
+
+def current_content():
+    """
+    Get the cached course content, reloading it first if another process
+    imported a new version.
+
+    Returns:
+        content_cache.Content: The content snapshot.
+    """
+
+    cache = current_app.extensions["content_cache"]
+    if cache.check_due():
+        return cache.refresh(get_conn())
+
+    return cache.current
+
+@CONTENT_API.route("/api/courses", methods=["GET"])
+def courses_get():
+    """
+    Retrieve the list of available courses.
+
+    Returns:
+        Response: - 200 in case of success and the list of courses in the body.
+                  - 304 if the client's copy is up to date.
+    """
+
+    content = current_content()
+
+    return content_response(content, content.courses)
+
+# The body of GET /api/course.
+COURSE_GET_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "course_id": {"type": "number"},
+        "course_name": {"type": "string"},
+        "fields": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "string",
+            }
+        }
+    },
+    "oneOf": [
+        {
+            "required": [
+                "course_id"
+            ]
+        },
+        {
+            "required": [
+                "course_name"
+            ]
+        }
+    ]
+})
+
+@CONTENT_API.route("/api/course", methods=["GET"])
+def course_get():
+    """
+    Get information from the database about a course, given its id or name. If
+    there are field names received in the body, only those will be queried. If
+    no field is provided, every field will be selected. The body should be a
+    JSON object following the schema:
+    {
+        "course_id": id OR "course_name": name,
+        "fields": ["field1", ...]
+    }
+
+    Returns:
+        Response: - 200 in case of success and the course info in the body.
+                  - 400 if the body does not have all the necessary information
+                  or the field names are wrong.
+                  - 304 if the client's copy is up to date.
+                  - 404 if the course is not found.
+    """
+
+    payload = request.get_json(silent=True)
+
+    is_valid = validate_json(payload, COURSE_GET_SCHEMA)
+    if not is_valid:
+        return Response(status=400)
+
+    fields = payload.get("fields", COURSE_COLUMNS)
+    if not set(fields) <= set(COURSE_COLUMNS):
+        return Response(status=400)
+
+    content = current_content()
+
+    if "course_id" in payload:
+        results = content.course_by_id(payload["course_id"])
+    else:
+        results = content.course_by_name(payload["course_name"])
+
+    if len(results) == 0:
+        return Response(status=404)
+
+    # The whole row is cached, only the wanted fields are sent.
+    results = [{field: row[field] for field in fields} for row in results]
+
+    return content_response(content, results)
+
+# The body of GET /api/course_steps.
+COURSE_STEP_GET_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "course_step_inner_id": {"type": "number"},
+        "course_id": {"type": "number"}
+    },
+    "required": ["course_step_inner_id", "course_id"]
+})
+
+@CONTENT_API.route("/api/course_steps", methods=["GET"])
+def course_step_get():
+    """
+    Retrieve a course step from the database.
+
+    Returns:
+        Response: - 200 in case of success and the step's object in the body.
+                  - 400 if the body does not have all the necessary information.
+                  - 304 if the client's copy is up to date.
+                  - 404 if the step does not exist.
+    """
+
+    payload = request.get_json(silent=True)
+
+    is_valid = validate_json(payload, COURSE_STEP_GET_SCHEMA)
+    if not is_valid:
+        return Response(status=400)
+
+    content = current_content()
+    results = content.course_step(payload["course_id"],
+                                  payload["course_step_inner_id"])
+
+    if len(results) == 0:
+        return Response(status=404)
+
+    return content_response(content, results)
+
+@CONTENT_API.route("/api/course_steps/max/<int:course_id>", methods=["GET"])
+def course_step_max_get(course_id=None):
+    """
+    Retrieve the max inner id of a course step from the database, for a given
+    course.
+
+    Returns:
+        Response: - 200 in case of success and the maximum id in the body.
+                  - 304 if the client's copy is up to date.
+    """
+
+    content = current_content()
+
+    # As MAX() does, answer null for a course without steps.
+    return content_response(content,
+                            [{"max": content.course_step_max(course_id)}])
+
+@CONTENT_API.route("/api/mid_questions/<int:course_id>", methods=["GET"])
+def mid_question_get(course_id=None):
+    """
+    Retrieve a course mid-course question from the database.
+
+    Args:
+        course_id (int): The current's course id.
+    Returns:
+        Response: - 200 in case of success and the step's object in the body.
+                  - 304 if the client's copy is up to date.
+                  - 404 if the question does not exist.
+    """
+
+    content = current_content()
+    results = content.mid_question(course_id)
+
+    if len(results) == 0:
+        return Response(status=404)
+
+    return content_response(content, results)
+
+# The body of GET /api/test_steps.
+TEST_STEP_GET_RANDOM_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "test_step_inner_id": {"type": "number"},
+        "course_id": {"type": "number"}
+    },
+    "required": ["test_step_inner_id", "course_id"]
+})
+
+@CONTENT_API.route("/api/test_steps", methods=["GET"])
+def test_step_get_random():
+    """
+    Retrieve a course test step from the database. The step is randomly chosen
+    from the cached pool of variants.
+
+    Returns:
+        Response: - 200 in case of success and the step's object in the body.
+                  - 400 if the body does not have all the necessary information.
+                  - 404 if the step does not exist.
+    """
+
+    payload = request.get_json(silent=True)
+
+    is_valid = validate_json(payload, TEST_STEP_GET_RANDOM_SCHEMA)
+    if not is_valid:
+        return Response(status=400)
+
+    pool = current_content().test_pool(payload["course_id"],
+                                       payload["test_step_inner_id"])
+
+    if len(pool) == 0:
+        return Response(status=404)
+
+    # The response is different every time, so it gets no ETag.
+    return Response(
+        status=200,
+        response=json.dumps([random.choice(pool)]),
+        mimetype="application/json"
+    )
+
+@CONTENT_API.route("/api/test_steps/<int:test_step_id>", methods=["GET"])
+def test_step_get_exact(test_step_id=None):
+    """
+    Retrieve a course test step from the database given the test_step_id.
+
+    Returns:
+        Response: - 200 in case of success and the step's object in the body.
+                  - 304 if the client's copy is up to date.
+                  - 404 if the step does not exist.
+    """
+
+    content = current_content()
+    results = content.test_step(test_step_id)
+
+    if len(results) == 0:
+        return Response(status=404)
+
+    return content_response(content, results)
+
+@CONTENT_API.route("/api/test_steps/max/<int:course_id>", methods=["GET"])
+def test_step_max_get(course_id=None):
+    """
+    Retrieve the max inner id of a test step from the database, for a given
+    course.
+
+    Returns:
+        Response: - 200 in case of success and the maximum id in the body.
+                  - 304 if the client's copy is up to date.
+    """
+
+    content = current_content()
+
+    # As MAX() does, answer null for a course without steps.
+    return content_response(content,
+                            [{"max": content.test_step_max(course_id)}])
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The in-memory cache of the course content
+
+The courses, course steps, mid-course questions and test steps are written when
+the database is populated and do not change while serving, so they are read
+once and every content request becomes a lookup in memory.
+"""
+
+import hashlib
+import json
+import threading
+
+from time import monotonic
+
+from psycopg2.extras import RealDictCursor
+
+class Content:
+    # pylint: disable=too-many-instance-attributes
+    """
+    A snapshot of the course content, indexed for the adapter's queries. The
+    snapshot is never modified, a reload builds a new one.
+    """
+
+    def __init__(self, version, courses, course_steps, mid_questions,
+                 test_steps):
+        """
+        Args:
+            version (int): The content version (from "content_versions").
+            courses (list): The rows of the "courses" table.
+            course_steps (list): The rows of the "course_steps" table.
+            mid_questions (list): The rows of the "mid_questions" table.
+            test_steps (list): The rows of the "test_steps" table.
+        """
+
+        self.version = version
+        self.courses = courses
+        self.counts = {"courses": len(courses),
+                       "course_steps": len(course_steps),
+                       "mid_questions": len(mid_questions),
+                       "test_steps": len(test_steps)}
+
+        # Any change of the content changes the ETag.
+        digest = hashlib.sha1(json.dumps(
+                     [courses, course_steps, mid_questions, test_steps],
+                     sort_keys=True).encode("utf-8"))
+        self.etag = digest.hexdigest()
+
+        self._courses_by_id = {}
+        self._courses_by_name = {}
+        for course in courses:
+            self._courses_by_id.setdefault(course["course_id"], []) \
+                               .append(course)
+            self._courses_by_name.setdefault(course["course_name"], []) \
+                                 .append(course)
+
+        self._course_steps = {}
+        self._course_step_max = {}
+        for step in course_steps:
+            course_id = step["course_id"]
+            inner_id = step["course_step_inner_id"]
+            self._course_steps.setdefault((course_id, inner_id), []) \
+                              .append(step)
+            self._course_step_max[course_id] = max(
+                inner_id, self._course_step_max.get(course_id, inner_id))
+
+        self._mid_questions = {}
+        for question in mid_questions:
+            self._mid_questions.setdefault(question["course_id"], []) \
+                               .append(question)
+
+        self._test_steps = {}
+        self._test_pools = {}
+        self._test_step_max = {}
+        for step in test_steps:
+            course_id = step["course_id"]
+            inner_id = step["test_step_inner_id"]
+            self._test_steps[step["test_step_id"]] = [step]
+            self._test_pools.setdefault((course_id, inner_id), []).append(step)
+            self._test_step_max[course_id] = max(
+                inner_id, self._test_step_max.get(course_id, inner_id))
+
+    def course_by_id(self, course_id):
+        """
+        Returns:
+            list: The courses having the id.
+        """
+
+        return self._courses_by_id.get(course_id, [])
+
+    def course_by_name(self, course_name):
+        """
+        Returns:
+            list: The courses having the name.
+        """
+
+        return self._courses_by_name.get(course_name, [])
+
+    def course_step(self, course_id, inner_id):
+        """
+        Returns:
+            list: The steps of a course having the inner id.
+        """
+
+        return self._course_steps.get((course_id, inner_id), [])
+
+    def course_step_max(self, course_id):
+        """
+        Returns:
+            int: The max inner id of a course's steps, None if it has no steps.
+        """
+
+        return self._course_step_max.get(course_id)
+
+    def mid_question(self, course_id):
+        """
+        Returns:
+            list: The mid-course questions of a course.
+        """
+
+        return self._mid_questions.get(course_id, [])
+
+    def test_step(self, test_step_id):
+        """
+        Returns:
+            list: The test step having the id.
+        """
+
+        return self._test_steps.get(test_step_id, [])
+
+    def test_pool(self, course_id, inner_id):
+        """
+        Returns:
+            list: The variants of a course's test step having the inner id.
+        """
+
+        return self._test_pools.get((course_id, inner_id), [])
+
+    def test_step_max(self, course_id):
+        """
+        Returns:
+            int: The max inner id of a course's test steps, None if it has no
+                 test.
+        """
+
+        return self._test_step_max.get(course_id)
+
+def latest_version(cursor):
+    """
+    Returns:
+        int: The latest imported content version, None if there is none.
+    """
+
+    cursor.execute("SELECT MAX(content_version) AS version \
+                    FROM content_versions;")
+
+    return cursor.fetchone()["version"]
+
+class ContentCache:
+    """
+    Holds the current content snapshot. Requests take the snapshot once and
+    use it until they end, so a reload never mixes two versions of the content
+    in a response.
+
+    When several processes serve the content, an import made by one of them is
+    noticed by the others when they check the latest content version, at most
+    every check_interval seconds.
+    """
+
+    def __init__(self, check_interval=5.0):
+        """
+        Args:
+            check_interval (float, optional): How often (seconds) to check for
+                                              a new content version. Defaults
+                                              to 5.0.
+        """
+
+        self.current = None
+        self.check_interval = check_interval
+        self._next_check = monotonic() + check_interval
+        self._check_lock = threading.Lock()
+
+    def check_due(self):
+        """
+        Tell if the content version should be checked now. Only one caller is
+        told so in every interval.
+
+        Returns:
+            bool: True if the caller should call refresh.
+        """
+
+        now = monotonic()
+        if now < self._next_check:
+            return False
+
+        with self._check_lock:
+            if now < self._next_check:
+                return False
+
+            self._next_check = now + self.check_interval
+
+        return True
+
+    def refresh(self, conn):
+        """
+        Reload the content if a newer version was imported.
+
+        Args:
+            conn (psycopg2.extensions.connection): The connection used.
+        Returns:
+            Content: The current snapshot.
+        """
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            version = latest_version(cursor)
+        conn.commit()
+
+        if version != self.current.version:
+            return self.load(conn)
+
+        return self.current
+
+    def load(self, conn):
+        """
+        Read the content from the database and replace the current snapshot.
+
+        Args:
+            conn (psycopg2.extensions.connection): The connection used.
+        Returns:
+            Content: The new snapshot.
+        """
+
+        def read(table, key):
+            cursor.execute(f"SELECT * FROM {table} ORDER BY {key};")
+            return [dict(row) for row in cursor.fetchall()]
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            content = Content(latest_version(cursor),
+                              read("courses", "course_id"),
+                              read("course_steps", "course_step_id"),
+                              read("mid_questions", "mid_question_id"),
+                              read("test_steps", "test_step_id"))
+        conn.commit()
+
+        self.current = content
+
+        return self.current
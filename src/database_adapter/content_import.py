@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The import of the course content into the database
+
+The data file is imported in bulk, in a single transaction, so the old content
+is served until the new one is committed. A course's id is its position in the
+data file, since the other tables refer to the courses by it. The other rows
+are identified by their natural keys (e.g. the course and the step's inner id),
+so they keep their ids, which the users' sessions refer to, when the data file
+is reordered, and a new row gets a new id. A test step is one of the questions
+asked for its inner id, so it is identified by its whole content. This makes
+the import an idempotent upsert. Every import is recorded as a new content
+version, keyed by the hash of the data file, and an unchanged file is not
+imported again.
+"""
+
+import hashlib
+import json
+
+from time import perf_counter
+
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+# The content tables, in import order: (table, id column, natural key
+# columns, data columns). The courses are identified by their position.
+TABLES = (
+    ("courses", "course_id", (), ("course_name", "course_description",
+                                  "course_num_steps", "course_num_questions")),
+    ("course_steps", "course_step_id", ("course_id", "course_step_inner_id"),
+     ("course_step_inner_id", "course_step_text", "course_step_url",
+      "course_id")),
+    ("mid_questions", "mid_question_id", ("course_id", ),
+     ("mid_question_text", "mid_question_ans", "course_id")),
+    ("test_steps", "test_step_id", ("course_id", "test_step_inner_id",
+                                    "test_step_text", "test_step_ans"),
+     ("test_step_inner_id", "test_step_text", "test_step_ans", "course_id"))
+)
+
+# The key of the advisory lock which serializes the imports.
+IMPORT_LOCK = 0x4d617468
+
+# The number of rows sent in one INSERT statement.
+PAGE_SIZE = 1000
+
+def read_data_file(data_file):
+    """
+    Read the course content from a data file.
+
+    Args:
+        data_file (str): The path to the data file (e.g. courses.json).
+    Returns:
+        tuple: The content (dict) and the SHA-256 hash of the file (str).
+    """
+
+    with open(data_file, "rb") as fin:
+        data = fin.read()
+
+    return json.loads(data), hashlib.sha256(data).hexdigest()
+
+def upsert_query(table, key, columns):
+    """
+    Build the query which inserts or updates rows of a content table.
+
+    Args:
+        table (str): The table's name.
+        key (str): The id column.
+        columns (tuple): The data columns.
+    Returns:
+        psycopg2.sql.Composed: The query, taking the rows as "VALUES %s".
+    """
+
+    # Unchanged rows are not written again.
+    return sql.SQL("INSERT INTO {0}({1}) VALUES %s ON CONFLICT ({2}) \
+                    DO UPDATE SET ({3})=ROW({4}) \
+                    WHERE ({5}) IS DISTINCT FROM ({4});").format(
+               sql.Identifier(table),
+               sql.SQL(", ").join(map(sql.Identifier, (key,) + columns)),
+               sql.Identifier(key),
+               sql.SQL(", ").join(map(sql.Identifier, columns)),
+               sql.SQL(", ").join(sql.Identifier("excluded", column)
+                                  for column in columns),
+               sql.SQL(", ").join(sql.Identifier(table, column)
+                                  for column in columns)
+           )
+
+def assign_ids(cursor, table, key, natural_key, items):
+    """
+    Find the ids of the rows of a content table by their natural keys, the
+    new rows getting ids after the existing ones. A natural key found twice in
+    the data file gets a new id the second time, so the import fails on the
+    table's unique index. Without a natural key, a row's id is its position.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The cursor used.
+        table (str): The table's name.
+        key (str): The id column.
+        natural_key (tuple): The natural key columns, empty for none.
+        items (list): The rows of the data file.
+    Returns:
+        list: The id of every row.
+    """
+
+    if not natural_key:
+        return list(range(1, len(items) + 1))
+
+    cursor.execute(sql.SQL("SELECT {}, {} FROM {};").format(
+                       sql.Identifier(key),
+                       sql.SQL(", ").join(map(sql.Identifier, natural_key)),
+                       sql.Identifier(table)))
+    existing = {tuple(row[1:]): row[0] for row in cursor.fetchall()}
+    next_id = max(existing.values(), default=0) + 1
+
+    row_ids = []
+    for item in items:
+        row_id = existing.pop(tuple(item.get(column)
+                                    for column in natural_key), None)
+        if row_id is None:
+            row_id = next_id
+            next_id += 1
+        row_ids.append(row_id)
+
+    return row_ids
+
+def import_content(conn, courses_data, data_hash, force=False):
+    """
+    Import the course content into the database, in one transaction. The
+    rows missing from the data file are deleted, except for the courses,
+    whose deletion would also delete the users enrolled in them.
+
+    Args:
+        conn (psycopg2.extensions.connection): The connection used.
+        courses_data (dict): The content, as read from the data file.
+        data_hash (str): The hash of the data file.
+        force (bool, optional): If an unchanged data file should be imported
+                                again. Defaults to False.
+    Raises:
+        psycopg2.DatabaseError: If the content is not valid. Nothing is
+                                changed in this case.
+    Returns:
+        dict: The content version, if the data was imported, the time it took
+              and the number of rows of every table.
+    """
+
+    start = perf_counter()
+
+    with conn.cursor() as cursor:
+        # Concurrent imports wait for each other, the lock is released when
+        # the transaction ends.
+        cursor.execute("SELECT pg_advisory_xact_lock(%s);", (IMPORT_LOCK, ))
+
+        cursor.execute("SELECT content_version, data_hash \
+                        FROM content_versions \
+                        ORDER BY content_version DESC LIMIT 1;")
+        latest = cursor.fetchone()
+
+        if latest is not None and latest[1] == data_hash and not force:
+            conn.rollback()
+            return {"version": latest[0], "imported": False}
+
+        counts = {}
+        for (table, key, natural_key, columns) in TABLES:
+            items = courses_data.get(table, [])
+            row_ids = assign_ids(cursor, table, key, natural_key, items)
+
+            execute_values(cursor, upsert_query(table, key, columns),
+                           [(row_id, ) + tuple(item.get(column)
+                                               for column in columns)
+                            for (row_id, item) in zip(row_ids, items)],
+                           page_size=PAGE_SIZE)
+
+            if table != "courses":
+                cursor.execute(sql.SQL("DELETE FROM {0} \
+                                        WHERE NOT {1}=ANY(%s);").format(
+                                   sql.Identifier(table), sql.Identifier(key)),
+                               (row_ids, ))
+
+            # The ids were given explicitly, move the sequence after them.
+            cursor.execute(sql.SQL("SELECT setval(pg_get_serial_sequence({}, \
+                                    {}), COALESCE(MAX({}), 0) + 1, FALSE) \
+                                    FROM {};").format(
+                               sql.Literal(table), sql.Literal(key),
+                               sql.Identifier(key), sql.Identifier(table)))
+
+            counts[table] = len(items)
+
+        cursor.execute("INSERT INTO content_versions(data_hash) VALUES (%s) \
+                        RETURNING content_version;", (data_hash, ))
+        version = cursor.fetchone()[0]
+
+    conn.commit()
+
+    return {"version": version, "imported": True,
+            "seconds": round(perf_counter() - start, 3), **counts}
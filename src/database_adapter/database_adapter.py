@@ -16,76 +16,119 @@ import os
 import sys
 
 from argparse  import ArgumentParser
-from time import localtime, sleep
+from time import localtime
 from flask import Flask, Response, request
 from psycopg2.extras import RealDictCursor
-from psycopg2 import sql
 
-import jsonschema
 import psycopg2
 import psycopg2.errors
 
+from connection_pool import execute, get_conn, pool_from_env
+from content_api import CONTENT_API
+from content_cache import ContentCache
+from content_import import import_content, read_data_file
+from sessions import SESSION_STATEMENTS, SESSIONS_API
+from user_advance import ADVANCE_API, ADVANCE_STATEMENTS
+from common.serving import serve
+from common.validation import compile_schema, validate_json
+
 # The Flask server's object
 app = Flask(__name__)
 
-def validate_json(json_data, json_schema):
-    """
-    Check if a JSON object follow a schema or not.
+# The columns which can be selected or returned from the "users" table, with
+# the types of the values which can be written.
+USER_COLUMNS = {
+    "user_id": "BIGINT",
+    "user_name": "VARCHAR",
+    "user_step": "INT2",
+    "user_score": "INT2",
+    "course_id": "INT2",
+    "user_test_started": "BOOL"
+}
+
+# The combinations of columns which can be updated by PUT /api/user, sorted.
+USER_UPDATE_SHAPES = (
+    ("user_step",),
+    ("user_step", "user_test_started"),
+    ("course_id", "user_step", "user_test_started"),
+    ("user_name",),
+    ("user_score",)
+)
+
+# The queries prepared on every connection: name -> (parameter types, query).
+STATEMENTS = {
+    "user_get": (("BIGINT",), "SELECT * FROM users WHERE user_id=$1"),
+    "user_add": (("BIGINT", "VARCHAR"),
+                 "INSERT INTO users(user_id, user_name) VALUES ($1, $2)"),
+    "user_inc_score": (("BIGINT",), "UPDATE users \
+                                     SET user_score=user_score+1 \
+                                     WHERE user_id=$1 RETURNING user_id"),
+    "user_del": (("BIGINT",),
+                 "DELETE FROM users WHERE user_id=$1 RETURNING 1")
+}
+
+def update_statement(columns):
+    """
+    Build the statement updating some columns of a user. The new values are the
+    first parameters, the user id is the last one.
 
     Args:
-        json_data (dict): The input JSON obect.
-        json_schema (dict): The wanted JSON schema.
+        columns (tuple): The updated columns.
     Returns:
-        bool: True if the object is correct, False otherwise.
+        tuple: The parameter types and the query.
     """
 
-    try:
-        jsonschema.validate(instance=json_data, schema=json_schema)
-    except jsonschema.exceptions.ValidationError:
-        return False
+    assignments = ", ".join(f"{column}=${i}"
+                            for (i, column) in enumerate(columns, 1))
 
-    return True
+    return (tuple(USER_COLUMNS[column] for column in columns) +
+            ("BIGINT",),
+            f"UPDATE users SET {assignments} \
+              WHERE user_id=${len(columns) + 1} RETURNING *")
 
-def init_postgres_con():
-    """
-    Start the connection to the PostgreSQL database.
-    """
+# Every update shape gets its own statement.
+USER_UPDATES = {columns: "user_update_" + "_".join(columns)
+                for columns in USER_UPDATE_SHAPES}
+STATEMENTS.update({name: update_statement(columns)
+                   for (columns, name) in USER_UPDATES.items()})
+
+# The conversation state is served by its own routes.
+STATEMENTS.update(SESSION_STATEMENTS)
+app.register_blueprint(SESSIONS_API)
 
-    host = "database"
-    database = os.getenv("POSTGRES_DB", "postgres")
-    user = os.getenv("POSTGRES_USER", "admin")
-    password = os.getenv("POSTGRES_PASSWORD", "adminpass")
+# The course content is served from memory by its own routes.
+app.register_blueprint(CONTENT_API)
 
-    # Run in a loop until the database server starts.
-    while True:
-        try:
-            pg_conn = psycopg2.connect(host=host, database=database,
-                                       user=user, password=password)
+# A user advances through the activity in a single transaction.
+STATEMENTS.update(ADVANCE_STATEMENTS)
+app.register_blueprint(ADVANCE_API)
 
-            LOGGER.info("Connection with database ready!")
+def init_worker():
+    """
+    Reconnect the connection pool in a gunicorn worker. The connections opened
+    before the fork cannot be shared by the processes.
+    """
 
-            return pg_conn
-        except psycopg2.OperationalError:
-            LOGGER.warning("Connection with database failed! Retry...")
-            sleep(1)
+    POOL.open()
 
 def populate_postgres():
     """
-    Check if the table schema is correct and create the tables if necessary.
+    Check if the table schema is correct and create the tables if necessary,
+    then import the data file, if it changed since the last import.
     """
 
     data_file = os.environ.get("DATA_FILE", "courses.json")
 
-    with open(data_file, "r") as fin:
-        try:
-            courses_data = json.load(fin)
-        except json.decoder.JSONDecodeError:
-            LOGGER.critical("Reading data file failed!")
-            sys.exit()
+    try:
+        courses_data, data_hash = read_data_file(data_file)
+    except (OSError, json.decoder.JSONDecodeError):
+        LOGGER.critical("Reading data file failed!")
+        sys.exit()
 
     LOGGER.info("Data file was read: %s", data_file)
 
-    cursor = CONN.cursor()
+    conn = POOL.getconn()
+    cursor = conn.cursor()
 
     # Check the existence of "courses" table (and create it).
     cursor.execute(
@@ -110,23 +153,6 @@ def populate_postgres():
             );
             """)
 
-        for course in courses_data["courses"]:
-            columns = list(course.keys())
-            values = list(course.values())
-            query = sql.SQL("INSERT INTO courses({}) VALUES({}) \
-                             RETURNING course_id;").format(
-                        sql.SQL(", ").join(map(sql.Identifier, columns)),
-                        sql.SQL(", ").join(map(sql.Literal, values)),
-                    )
-
-            try:
-                cursor.execute(query)
-            except psycopg2.DatabaseError as err:
-                cursor.close()
-                CONN.rollback()
-                LOGGER.critical(err.pgcode, err.pgerror)
-                sys.exit()
-
     # Check the existence of "course_steps" table (and create it).
     cursor.execute(
         """
@@ -155,23 +181,6 @@ def populate_postgres():
             );
             """)
 
-        for course_step in courses_data["course_steps"]:
-            columns = list(course_step.keys())
-            values = list(course_step.values())
-            query = sql.SQL("INSERT INTO course_steps({}) VALUES({}) \
-                             RETURNING course_step_id;").format(
-                        sql.SQL(", ").join(map(sql.Identifier, columns)),
-                        sql.SQL(", ").join(map(sql.Literal, values)),
-                    )
-
-            try:
-                cursor.execute(query)
-            except psycopg2.DatabaseError as err:
-                cursor.close()
-                CONN.rollback()
-                LOGGER.critical(err.pgcode, err.pgerror)
-                sys.exit()
-
     # Check the existence of "mid_questions" table (and create it).
     cursor.execute(
         """
@@ -199,23 +208,6 @@ def populate_postgres():
             );
             """)
 
-        for mid_question in courses_data["mid_questions"]:
-            columns = list(mid_question.keys())
-            values = list(mid_question.values())
-            query = sql.SQL("INSERT INTO mid_questions({}) VALUES({}) \
-                             RETURNING mid_question_id;").format(
-                        sql.SQL(", ").join(map(sql.Identifier, columns)),
-                        sql.SQL(", ").join(map(sql.Literal, values)),
-                    )
-
-            try:
-                cursor.execute(query)
-            except psycopg2.DatabaseError as err:
-                cursor.close()
-                CONN.rollback()
-                LOGGER.critical(err.pgcode, err.pgerror)
-                sys.exit()
-
     # Check the existence of "test_steps" table (and create it).
     cursor.execute(
         """
@@ -231,7 +223,7 @@ def populate_postgres():
         cursor.execute(
             """
             CREATE TABLE test_steps (
-                test_step_id SERIAL2 PRIMARY KEY,
+                test_step_id SERIAL PRIMARY KEY,
                 test_step_inner_id INT2 NOT NULL,
                 test_step_text VARCHAR(255) NOT NULL,
                 test_step_ans VARCHAR(255) NOT NULL,
@@ -244,22 +236,43 @@ def populate_postgres():
             );
             """)
 
-        for test_step in courses_data["test_steps"]:
-            columns = list(test_step.keys())
-            values = list(test_step.values())
-            query = sql.SQL("INSERT INTO test_steps({}) VALUES({}) \
-                             RETURNING test_step_id;").format(
-                        sql.SQL(", ").join(map(sql.Identifier, columns)),
-                        sql.SQL(", ").join(map(sql.Literal, values)),
-                    )
-
-            try:
-                cursor.execute(query)
-            except psycopg2.DatabaseError as err:
-                cursor.close()
-                CONN.rollback()
-                LOGGER.critical(err.pgcode, err.pgerror)
-                sys.exit()
+    # The test steps used to have SERIAL2 ids, too few for a large question
+    # bank.
+    cursor.execute(
+        """
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name=\'test_steps\' AND column_name=\'test_step_id\';
+        """)
+
+    if cursor.fetchone()[0] == "smallint":
+        LOGGER.info("Changing the type of test_steps.test_step_id to INT")
+
+        cursor.execute(
+            """
+            ALTER TABLE test_steps ALTER COLUMN test_step_id TYPE INT;
+            ALTER SEQUENCE test_steps_test_step_id_seq AS INT;
+            """)
+
+    # Check the existence of "content_versions" table (and create it).
+    cursor.execute(
+        """
+        SELECT EXISTS(
+            SELECT * FROM information_schema.tables
+            WHERE table_name=\'content_versions\'
+        );
+        """)
+
+    if not cursor.fetchone()[0]:
+        LOGGER.info("Creating table content_versions")
+
+        cursor.execute(
+            """
+            CREATE TABLE content_versions (
+                content_version SERIAL PRIMARY KEY,
+                data_hash CHAR(64) NOT NULL,
+                imported_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """)
 
     # Check the existence of "users" table (and create it).
     cursor.execute(
@@ -275,7 +288,7 @@ def populate_postgres():
         cursor.execute(
             """
             CREATE TABLE users (
-                user_id INT PRIMARY KEY,
+                user_id BIGINT PRIMARY KEY,
                 user_name VARCHAR(255) NOT NULL,
                 user_step INT2 NOT NULL DEFAULT 0,
                 user_score INT2 NOT NULL DEFAULT 0,
@@ -289,8 +302,92 @@ def populate_postgres():
             );
             """)
 
+    # Check the existence of "sessions" table (and create it). The conversation
+    # state is short-lived, it does not need to survive a database crash.
+    cursor.execute(
+        """
+        SELECT EXISTS(
+            SELECT * FROM information_schema.tables
+            WHERE table_name=\'sessions\'
+        );
+        """)
+
+    if not cursor.fetchone()[0]:
+        LOGGER.info("Creating table sessions")
+
+        cursor.execute(
+            """
+            CREATE UNLOGGED TABLE sessions (
+                session_kind VARCHAR(16) NOT NULL,
+                user_id BIGINT NOT NULL,
+                session_value JSONB NOT NULL,
+                expires_at TIMESTAMPTZ NOT NULL,
+                PRIMARY KEY(session_kind, user_id)
+            );
+            CREATE INDEX sessions_expires_at_idx ON sessions(expires_at);
+            """)
+
+    # The user ids are Telegram's, which do not fit in INT (also for existing
+    # tables).
+    cursor.execute(
+        """
+        SELECT table_name FROM information_schema.columns
+        WHERE table_name IN (\'users\', \'sessions\')
+        AND column_name=\'user_id\' AND data_type=\'integer\';
+        """)
+
+    for (table, ) in cursor.fetchall():
+        LOGGER.info("Changing %s.user_id to BIGINT", table)
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN user_id TYPE BIGINT;")
+
+    # Index the steps of a course by their inner id (also for existing tables).
+    # The natural keys the content is imported by are unique.
+    cursor.execute(
+        """
+        DROP INDEX IF EXISTS course_steps_course_inner_idx;
+        CREATE UNIQUE INDEX IF NOT EXISTS course_steps_course_inner_key
+            ON course_steps(course_id, course_step_inner_id);
+        CREATE INDEX IF NOT EXISTS test_steps_course_inner_idx
+            ON test_steps(course_id, test_step_inner_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS test_steps_content_key
+            ON test_steps(course_id, test_step_inner_id, test_step_text,
+                          test_step_ans);
+        """)
+
     cursor.close()
-    CONN.commit()
+    conn.commit()
+
+    try:
+        result = import_content(conn, courses_data, data_hash)
+    except psycopg2.DatabaseError as err:
+        conn.rollback()
+        LOGGER.critical("Importing data file failed! %s", err)
+        sys.exit()
+    finally:
+        POOL.putconn(conn)
+
+    if result["imported"]:
+        LOGGER.info("Data file imported in %.3fs: %s", result["seconds"],
+                    result)
+    else:
+        LOGGER.info("Data file already imported, content version %d",
+                    result["version"])
+
+# The body of GET /api/user.
+USER_GET_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "user_id": {"type": "number"},
+        "fields": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "string",
+            }
+        }
+    },
+    "required": ["user_id"]
+})
 
 @app.route("/api/user", methods=["GET"])
 def user_get():
@@ -311,62 +408,54 @@ def user_get():
                   - 404 if the user is not found.
     """
 
-    body_schema = {
-        "type": "object",
-        "properties": {
-            "user_id": {"type": "number"},
-            "fields": {
-                "type": "array",
-                "minItems": 1,
-                "items": {
-                    "type": "string",
-                }
-            }
-        },
-        "required": ["user_id"]
-    }
-
     payload = request.get_json(silent=True)
 
-    is_valid = validate_json(payload, body_schema)
+    is_valid = validate_json(payload, USER_GET_SCHEMA)
     if not is_valid:
         return Response(status=400)
 
-    user_id = payload["user_id"]
-
-    if "fields" in payload:
-        fields = payload["fields"]
-        query = sql.SQL("SELECT {} FROM users WHERE user_id={};").format(
-                    sql.SQL(", ").join(map(sql.Identifier, fields)),
-                    sql.Literal(user_id)
-                )
-    else:
-        query = sql.SQL("SELECT * FROM users WHERE user_id={};").format(
-                    sql.Literal(payload["user_id"])
-                )
+    fields = payload.get("fields", USER_COLUMNS)
+    if not set(fields) <= USER_COLUMNS.keys():
+        return Response(status=400)
 
-    cursor = CONN.cursor(cursor_factory=RealDictCursor)
+    conn = get_conn()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
 
     try:
-        cursor.execute(query)
+        execute(cursor, "user_get", payload["user_id"])
         results = cursor.fetchall()
-    except psycopg2.errors.UndefinedColumn:
-        CONN.rollback()
-        return Response(status=400)
+    except psycopg2.DataError:
+        # An id which is not a user id (e.g. 1.5 or out of range) matches no
+        # user.
+        conn.rollback()
+        return Response(status=404)
     finally:
         cursor.close()
 
-    CONN.commit()
+    conn.commit()
 
     if len(results) == 0:
         return Response(status=404)
 
+    # The whole row is selected, only the wanted fields are sent.
+    results = [{field: row[field] for field in fields} for row in results]
+
     return Response(
         status=200,
         response=json.dumps(results),
         mimetype="application/json"
     )
 
+# The body of POST /api/user.
+USER_ADD_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "user_id": {"type": "number"},
+        "user_name": {"type": "string"}
+    },
+    "required": ["user_id", "user_name"]
+})
+
 @app.route("/api/user", methods=["POST"])
 def user_add():
     """
@@ -385,18 +474,9 @@ def user_add():
                   - 409 if the user already exists.
     """
 
-    body_schema = {
-        "type": "object",
-        "properties": {
-            "user_id": {"type": "number"},
-            "user_name": {"type": "string"}
-        },
-        "required": ["user_id", "user_name"]
-    }
-
     payload = request.get_json(silent=True)
 
-    is_valid = validate_json(payload, body_schema)
+    is_valid = validate_json(payload, USER_ADD_SCHEMA)
     if not is_valid:
         return Response(
             status=400,
@@ -404,21 +484,16 @@ def user_add():
             mimetype="text/plain"
         )
 
-    query = sql.SQL("INSERT INTO users(user_id, user_name) \
-                     VALUES ({}, {});").format(
-                sql.Literal(payload["user_id"]),
-                sql.Literal(payload["user_name"])
-            )
-
-    cursor = CONN.cursor()
+    conn = get_conn()
+    cursor = conn.cursor()
 
     try:
-        cursor.execute(query)
+        execute(cursor, "user_add", payload["user_id"], payload["user_name"])
     except psycopg2.errors.UniqueViolation:
-        CONN.rollback()
+        conn.rollback()
         return Response(status=409)
     except psycopg2.DataError:
-        CONN.rollback()
+        conn.rollback()
         return Response(
             status=400,
             response="values",
@@ -427,16 +502,38 @@ def user_add():
     finally:
         cursor.close()
 
-    CONN.commit()
+    conn.commit()
 
     return Response(status=201)
 
+# The body of PUT /api/user.
+USER_UPDATE_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "user_id": {"type": "number"},
+        "user_name": {"type": "string"},
+        "user_step": {"type": "number"},
+        "user_score": {"type": "number"},
+        "course_id": {"type": ["number", "null"]},
+        "user_test_started": {"type": "boolean"},
+        "returning": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "string",
+            }
+        }
+    },
+    "required": ["user_id"]
+})
+
 @app.route("/api/user", methods=["PUT"])
 def user_update():
     """
     Update the information about a user in the database, given his id. Only the
     fields provided in the body will be updated, with their respective values.
-    The body should be a JSON object following the schema:
+    The updated fields must be one of the USER_UPDATE_SHAPES. The body should be
+    a JSON object following the schema:
     {
         "user_id": id,
         "col_name1": value1,
@@ -452,29 +549,9 @@ def user_update():
                   - 404 if the user is not found.
     """
 
-    body_schema = {
-        "type": "object",
-        "properties": {
-            "user_id": {"type": "number"},
-            "user_name": {"type": "string"},
-            "user_step": {"type": "number"},
-            "user_score": {"type": "number"},
-            "course_id": {"type": ["number", "null"]},
-            "user_test_started": {"type": "boolean"},
-            "returning": {
-                "type": "array",
-                "minItems": 1,
-                "items": {
-                    "type": "string",
-                }
-            }
-        },
-        "required": ["user_id"]
-    }
-
     payload = request.get_json(silent=True)
 
-    is_valid = validate_json(payload, body_schema)
+    is_valid = validate_json(payload, USER_UPDATE_SCHEMA)
     if not is_valid:
         return Response(
             status=400,
@@ -490,50 +567,39 @@ def user_update():
     else:
         returning = ["user_id"]
 
-    if len(payload) == 1:
+    shape = tuple(sorted(field for field in payload if field != "user_id"))
+    if shape not in USER_UPDATES or not set(returning) <= USER_COLUMNS.keys():
         return Response(
             status=400,
             response="fields",
             mimetype="text/plain"
         )
 
-    fields = payload.keys()
-    values = payload.values()
-    query = sql.SQL("UPDATE users SET ({})=({}) WHERE user_id={} \
-                     RETURNING {};").format(
-                sql.SQL(", ").join(map(sql.Identifier, fields)),
-                sql.SQL(", ").join(map(sql.Literal, values)),
-                sql.Literal(user_id),
-                sql.SQL(", ").join(map(sql.Identifier, returning)),
-            )
-
-    cursor = CONN.cursor()
+    conn = get_conn()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
 
     try:
-        cursor.execute(query)
+        execute(cursor, USER_UPDATES[shape],
+                *(payload[field] for field in shape), user_id)
         results = cursor.fetchall()
     except psycopg2.DataError:
-        CONN.rollback()
+        conn.rollback()
         return Response(
             status=400,
             response="values",
             mimetype="text/plain"
         )
-    except psycopg2.errors.UndefinedColumn:
-        CONN.rollback()
-        return Response(
-            status=400,
-            response="fields",
-            mimetype="text/plain"
-        )
     finally:
         cursor.close()
 
-    CONN.commit()
+    conn.commit()
 
     if len(results) == 0:
         return Response(status=404)
 
+    # The whole row is returned, only the wanted columns are sent.
+    results = [[row[column] for column in returning] for row in results]
+
     return Response(
         status=200,
         response=json.dumps(results),
@@ -551,23 +617,19 @@ def user_inc_score(user_id=None):
                   - 404 if the user is not found.
     """
 
-    query = sql.SQL("UPDATE users SET user_score=user_score+1 WHERE user_id={} \
-                     RETURNING user_id;").format(
-                sql.Literal(user_id)
-            )
-
-    cursor = CONN.cursor()
+    conn = get_conn()
+    cursor = conn.cursor()
 
     try:
-        cursor.execute(query)
+        execute(cursor, "user_inc_score", user_id)
         results = cursor.fetchall()
     except psycopg2.DataError:
-        CONN.rollback()
+        conn.rollback()
         return Response(status=400)
     finally:
         cursor.close()
 
-    CONN.commit()
+    conn.commit()
 
     if len(results) == 0:
         return Response(status=404)
@@ -586,371 +648,119 @@ def user_del(user_id=None):
                   - 404 if the user is not found.
     """
 
-    query = sql.SQL("DELETE FROM users WHERE user_id={} RETURNING 1;").format(
-                sql.Literal(user_id),
-            )
-
-    cursor = CONN.cursor()
-    cursor.execute(query)
-    num_updates = len(cursor.fetchall())
-    cursor.close()
-    CONN.commit()
-
-    if num_updates == 0:
-        return Response(status=404)
-
-    return Response(status=200)
-
-@app.route("/api/courses", methods=["GET"])
-def courses_get():
-    """
-    Retrieve the list of available courses.
-
-    Returns:
-        Response: - 200 in case of success and the list of courses in the body.
-    """
-
-    cursor = CONN.cursor(cursor_factory=RealDictCursor)
-
-    query = sql.SQL("SELECT * FROM courses;")
-
-    cursor.execute(query)
-    results = cursor.fetchall()
-    cursor.close()
-
-    CONN.commit()
-
-    return Response(
-        status=200,
-        response=json.dumps(results),
-        mimetype="application/json"
-    )
-
-@app.route("/api/course", methods=["GET"])
-def course_get():
-    """
-    Get information from the database about a course, given its id or name. If
-    there are field names received in the body, only those will be queried. If
-    no field is provided, every field will be selected. The body should be a
-    JSON object following the schema:
-    {
-        "course_id": id OR "course_name": name,
-        "fields": ["field1", ...]
-    }
-
-    Returns:
-        Response: - 200 in case of success and the course info in the body.
-                  - 400 if the body does not have all the necessary information
-                  or the field names are wrong.
-                  - 404 if the course is not found.
-    """
-
-    body_schema = {
-        "type": "object",
-        "properties": {
-            "course_id": {"type": "number"},
-            "course_name": {"type": "string"},
-            "fields": {
-                "type": "array",
-                "minItems": 1,
-                "items": {
-                    "type": "string",
-                }
-            }
-        },
-        "oneOf": [
-            {
-                "required": [
-                    "course_id"
-                ]
-            },
-            {
-                "required": [
-                    "course_name"
-                ]
-            }
-        ]
-    }
-
-    payload = request.get_json(silent=True)
-
-    is_valid = validate_json(payload, body_schema)
-    if not is_valid:
-        return Response(status=400)
-
-    if "course_id" in payload:
-        cond_field = "course_id"
-        val = payload["course_id"]
-    else:
-        cond_field = "course_name"
-        val = payload["course_name"]
-
-    if "fields" in payload:
-        fields = payload["fields"]
-        query = sql.SQL("SELECT {} FROM courses WHERE {}={};").format(
-                    sql.SQL(", ").join(map(sql.Identifier, fields)),
-                    sql.Identifier(cond_field),
-                    sql.Literal(val)
-                )
-    else:
-        query = sql.SQL("SELECT * FROM courses WHERE {}={};").format(
-                    sql.Identifier(cond_field),
-                    sql.Literal(val)
-                )
-
-    cursor = CONN.cursor(cursor_factory=RealDictCursor)
+    conn = get_conn()
+    cursor = conn.cursor()
 
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-    except psycopg2.errors.UndefinedColumn:
-        CONN.rollback()
-        return Response(status=400)
+        execute(cursor, "user_del", user_id)
+        num_updates = len(cursor.fetchall())
+    except psycopg2.DataError:
+        # An id out of range matches no user.
+        conn.rollback()
+        return Response(status=404)
     finally:
         cursor.close()
 
-    CONN.commit()
-
-    if len(results) == 0:
-        return Response(status=404)
-
-    return Response(
-        status=200,
-        response=json.dumps(results),
-        mimetype="application/json"
-    )
-
-@app.route("/api/course_steps", methods=["GET"])
-def course_step_get():
-    """
-    Retrieve a course step from the database.
-
-    Returns:
-        Response: - 200 in case of success and the step's object in the body.
-                  - 400 if the body does not have all the necessary information.
-                  - 404 if the step does not exist.
-    """
-
-    body_schema = {
-        "type": "object",
-        "properties": {
-            "course_step_inner_id": {"type": "number"},
-            "course_id": {"type": "number"}
-        },
-        "required": ["course_step_inner_id", "course_id"]
-    }
-
-    payload = request.get_json(silent=True)
-
-    is_valid = validate_json(payload, body_schema)
-    if not is_valid:
-        return Response(status=400)
-
-    step_id = payload["course_step_inner_id"]
-    course_id = payload["course_id"]
-    query = sql.SQL("SELECT * FROM course_steps \
-                     WHERE course_step_inner_id={} AND course_id={};").format(
-                sql.Literal(step_id),
-                sql.Literal(course_id)
-            )
-
-    cursor = CONN.cursor(cursor_factory=RealDictCursor)
+    conn.commit()
 
-    cursor.execute(query)
-    results = cursor.fetchall()
-    cursor.close()
-
-    CONN.commit()
-
-    if len(results) == 0:
+    if num_updates == 0:
         return Response(status=404)
 
-    return Response(
-        status=200,
-        response=json.dumps(results),
-        mimetype="application/json"
-    )
+    return Response(status=200)
 
-@app.route("/api/course_steps/max/<int:course_id>", methods=["GET"])
-def course_step_max_get(course_id=None):
+@app.route("/api/content/reload", methods=["POST"])
+def content_reload():
     """
-    Retrieve the max inner id of a course step from the database, for a given
-    course.
+    Reload the cached course content from the database, after it was changed.
 
     Returns:
-        Response: - 200 in case of success and the maximum id in the body.
-                  - 404 if the step does not exist.
+        Response: - 200 and the new ETag and row counts in the body.
     """
 
-    query = sql.SQL("SELECT MAX(course_step_inner_id) FROM course_steps \
-                     WHERE course_id={};").format(
-                sql.Literal(course_id)
-            )
-
-    cursor = CONN.cursor(cursor_factory=RealDictCursor)
-
-    cursor.execute(query)
-    results = cursor.fetchall()
-    cursor.close()
-
-    CONN.commit()
-
-    if len(results) == 0:
-        return Response(status=404)
+    content = CONTENT.load(get_conn())
 
     return Response(
         status=200,
-        response=json.dumps(results),
+        response=json.dumps({"etag": content.etag, **content.counts}),
         mimetype="application/json"
     )
 
-@app.route("/api/mid_questions/<int:course_id>", methods=["GET"])
-def mid_question_get(course_id=None):
-    """
-    Retrieve a course mid-course question from the database.
-
-    Args:
-        course_id (int): The current's course id.
-    Returns:
-        Response: - 200 in case of success and the step's object in the body.
-                  - 404 if the question does not exist.
-    """
-
-    query = sql.SQL("SELECT * FROM mid_questions WHERE course_id={};").format(
-                sql.Literal(course_id)
-            )
-
-    cursor = CONN.cursor(cursor_factory=RealDictCursor)
-
-    cursor.execute(query, (course_id, ))
-    results = cursor.fetchall()
-    cursor.close()
-
-    CONN.commit()
-
-    if len(results) == 0:
-        return Response(status=404)
-
-    return Response(
-        status=200,
-        response=json.dumps(results),
-        mimetype="application/json"
-    )
+# The body of POST /api/content/import.
+CONTENT_IMPORT_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "force": {"type": "boolean"}
+    }
+})
 
-@app.route("/api/test_steps", methods=["GET"])
-def test_step_get_random():
+@app.route("/api/content/import", methods=["POST"])
+def content_import():
     """
-    Retrieve a course test step from the database. The step is randomly chosen
-    from the pool.
+    Import the data file again, then reload the cached course content. The old
+    content is served until the import is committed. The body is optional and
+    should be a JSON object following the schema:
+    {
+        "force": true / false
+    }
 
     Returns:
-        Response: - 200 in case of success and the step's object in the body.
-                  - 400 if the body does not have all the necessary information.
-                  - 404 if the step does not exist.
+        Response: - 200 and the content version, the import's duration and
+                  the row counts in the body.
+                  - 400 if the body is wrong.
+                  - 422 if the data file cannot be read or imported.
     """
 
-    body_schema = {
-        "type": "object",
-        "properties": {
-            "test_step_inner_id": {"type": "number"},
-            "course_id": {"type": "number"}
-        },
-        "required": ["test_step_inner_id", "course_id"]
-    }
-
-    payload = request.get_json(silent=True)
+    payload = request.get_json(silent=True) or {}
 
-    is_valid = validate_json(payload, body_schema)
+    is_valid = validate_json(payload, CONTENT_IMPORT_SCHEMA)
     if not is_valid:
         return Response(status=400)
 
-    step_id = payload["test_step_inner_id"]
-    course_id = payload["course_id"]
-    query = sql.SQL("SELECT * FROM test_steps \
-                     WHERE test_step_inner_id={} AND course_id={} \
-                     ORDER BY RANDOM() LIMIT 1;").format(
-                sql.Literal(step_id),
-                sql.Literal(course_id)
-            )
-
-    cursor = CONN.cursor(cursor_factory=RealDictCursor)
-
-    cursor.execute(query)
-    results = cursor.fetchall()
-    cursor.close()
-
-    CONN.commit()
-
-    if len(results) == 0:
-        return Response(status=404)
-
-    return Response(
-        status=200,
-        response=json.dumps(results),
-        mimetype="application/json"
-    )
-
-@app.route("/api/test_steps/<int:test_step_id>", methods=["GET"])
-def test_step_get_exact(test_step_id=None):
-    """
-    Retrieve a course test step from the database given the test_step_id.
-
-    Returns:
-        Response: - 200 in case of success and the step's object in the body.
-                  - 404 if the step does not exist.
-    """
+    data_file = os.environ.get("DATA_FILE", "courses.json")
 
-    query = sql.SQL("SELECT * FROM test_steps WHERE test_step_id={};").format(
-                sql.Literal(test_step_id)
-            )
+    try:
+        courses_data, data_hash = read_data_file(data_file)
+    except (OSError, json.decoder.JSONDecodeError):
+        LOGGER.error("Reading data file failed!")
+        return Response(status=422)
 
-    cursor = CONN.cursor(cursor_factory=RealDictCursor)
+    conn = get_conn()
 
-    cursor.execute(query)
-    results = cursor.fetchall()
-    cursor.close()
+    try:
+        result = import_content(conn, courses_data, data_hash,
+                                payload.get("force", False))
+    except psycopg2.DatabaseError as err:
+        conn.rollback()
+        LOGGER.error("Importing data file failed! %s", err)
+        return Response(
+            status=422,
+            response=str(err),
+            mimetype="text/plain"
+        )
 
-    CONN.commit()
-
-    if len(results) == 0:
-        return Response(status=404)
+    if result["imported"]:
+        LOGGER.info("Data file imported in %.3fs: %s", result["seconds"],
+                    result)
+        CONTENT.load(conn)
 
     return Response(
         status=200,
-        response=json.dumps(results),
+        response=json.dumps(result),
         mimetype="application/json"
     )
 
-@app.route("/api/test_steps/max/<int:course_id>", methods=["GET"])
-def test_step_max_get(course_id=None):
+@app.route("/api/metrics/pool", methods=["GET"])
+def pool_metrics_get():
     """
-    Retrieve the max inner id of a test step from the database, for a given
-    course.
+    Retrieve the connection pool's saturation metrics.
 
     Returns:
-        Response: - 200 in case of success and the maximum id in the body.
-                  - 404 if the step does not exist.
+        Response: - 200 and the metrics in the body.
     """
 
-    query = sql.SQL("SELECT MAX(test_step_inner_id) FROM test_steps \
-                     WHERE course_id={};").format(
-                sql.Literal(course_id)
-            )
-
-    cursor = CONN.cursor(cursor_factory=RealDictCursor)
-
-    cursor.execute(query)
-    results = cursor.fetchall()
-    cursor.close()
-
-    CONN.commit()
-
-    if len(results) == 0:
-        return Response(status=404)
-
     return Response(
         status=200,
-        response=json.dumps(results),
+        response=json.dumps(POOL.metrics()),
         mimetype="application/json"
     )
 
@@ -971,6 +781,8 @@ if __name__ == "__main__":
     parser = ArgumentParser(description="Run an adapter to PostgreSQL.")
     parser.add_argument("-d", "--debug", action="store_true",
                     help="specify if additional debug output should be shown")
+    parser.add_argument("-p", "--production", action="store_true",
+                    help="serve with gunicorn instead of the development server")
     args = parser.parse_args()
 
     # Debug activation flag
@@ -989,10 +801,26 @@ if __name__ == "__main__":
 
     LOGGER.info("Database adapter started!")
 
-    # Database connection controller object
-    CONN = init_postgres_con()
+    # Database connection pool, every request checks out its own connection.
+    POOL = pool_from_env(LOGGER, STATEMENTS)
+    POOL.open()
+    POOL.init_app(app)
     populate_postgres()
 
+    # The course content is served from memory.
+    CONTENT = ContentCache(float(os.getenv("CONTENT_CHECK_INTERVAL", "5")))
+    app.extensions["content_cache"] = CONTENT
+    db_conn = POOL.getconn()
+    CONTENT.load(db_conn)
+    POOL.putconn(db_conn)
+    LOGGER.info("Course content cached: %s", CONTENT.current.counts)
+
     db_adapt_port = int(os.getenv("DB_ADAPT_PORT", "5000"))
     db_adapt_addr = os.getenv("DB_ADAPT_ADDR", "0.0.0.0")
-    app.run(host=db_adapt_addr, port=db_adapt_port, debug=DEBUG)
+
+    if args.production:
+        # Every worker opens its own connections.
+        POOL.closeall()
+        serve(app, db_adapt_addr, db_adapt_port, post_fork=init_worker)
+    else:
+        app.run(host=db_adapt_addr, port=db_adapt_port, debug=DEBUG)
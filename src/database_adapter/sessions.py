@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The conversation state of the users
+
+The central component keeps the state of a conversation (e.g. the question a
+user has to answer) in the "sessions" table, so any of its workers can serve
+the next message.
+"""
+
+import json
+
+from flask import Blueprint, Response, request
+from psycopg2.extras import RealDictCursor
+
+import psycopg2
+
+from connection_pool import execute, get_conn
+from common.validation import compile_schema, validate_json
+
+# The routes of the conversation state
+SESSIONS_API = Blueprint("sessions", __name__)
+
+# The queries prepared on every connection: name -> (parameter types, query).
+SESSION_STATEMENTS = {
+    "session_set": (("VARCHAR", "BIGINT", "JSONB", "FLOAT8"),
+                    "INSERT INTO sessions VALUES ($1, $2, $3, \
+                     NOW() + make_interval(secs => $4)) \
+                     ON CONFLICT (session_kind, user_id) DO UPDATE \
+                     SET (session_value, expires_at)= \
+                     (EXCLUDED.session_value, EXCLUDED.expires_at)"),
+    "session_pop": (("VARCHAR", "BIGINT"),
+                    "DELETE FROM sessions \
+                     WHERE session_kind=$1 AND user_id=$2 \
+                     RETURNING session_value, expires_at>NOW() AS valid"),
+    "session_pop_first": (("VARCHAR[]", "BIGINT"),
+                          "DELETE FROM sessions \
+                           WHERE user_id=$2 AND session_kind=ANY($1) \
+                           AND (expires_at<=NOW() OR session_kind=( \
+                               SELECT session_kind FROM sessions \
+                               WHERE user_id=$2 AND session_kind=ANY($1) \
+                               AND expires_at>NOW() \
+                               ORDER BY array_position($1, session_kind) \
+                               LIMIT 1)) \
+                           RETURNING session_kind, session_value, \
+                           expires_at>NOW() AS valid"),
+    "session_clear": (("BIGINT",),
+                      "DELETE FROM sessions WHERE user_id=$1"),
+    "session_purge": ((), "DELETE FROM sessions WHERE expires_at<NOW()")
+}
+
+# The body of PUT /api/session/<kind>/<int:user_id>.
+SESSION_SET_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "value": {},
+        "ttl": {"type": "number", "exclusiveMinimum": 0}
+    },
+    "required": ["value", "ttl"]
+})
+
+@SESSIONS_API.route("/api/session/<kind>/<int:user_id>", methods=["PUT"])
+def session_set(kind=None, user_id=None):
+    """
+    Save a piece of a user's conversation state, replacing the old one, until
+    it expires. The expired state of all the users is dropped. The body should
+    be a JSON object following the schema:
+    {
+        "value": value,
+        "ttl": seconds
+    }
+
+    Args:
+        kind (str): The kind of state, e.g. "answer".
+        user_id (int): The user id received by the URL.
+    Returns:
+        Response: - 200 in case of success.
+                  - 400 if the body does not have all the necessary information.
+    """
+
+    payload = request.get_json(silent=True)
+
+    is_valid = validate_json(payload, SESSION_SET_SCHEMA)
+    if not is_valid:
+        return Response(status=400)
+
+    conn = get_conn()
+    cursor = conn.cursor()
+
+    try:
+        execute(cursor, "session_purge")
+        execute(cursor, "session_set", kind, user_id,
+                json.dumps(payload["value"]), payload["ttl"])
+    except psycopg2.DataError:
+        conn.rollback()
+        return Response(status=400)
+    finally:
+        cursor.close()
+
+    conn.commit()
+
+    return Response(status=200)
+
+@SESSIONS_API.route("/api/session/<kind>/<int:user_id>", methods=["DELETE"])
+def session_pop(kind=None, user_id=None):
+    """
+    Remove a piece of a user's conversation state and retrieve it. As the
+    removal is atomic, only one request gets the state.
+
+    Args:
+        kind (str): The kind of state, e.g. "answer".
+        user_id (int): The user id received by the URL.
+    Returns:
+        Response: - 200 in case of success and the value in the body.
+                  - 404 if there is no state or it expired.
+    """
+
+    conn = get_conn()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+    try:
+        execute(cursor, "session_pop", kind, user_id)
+        result = cursor.fetchone()
+    except psycopg2.DataError:
+        conn.rollback()
+        return Response(status=404)
+    finally:
+        cursor.close()
+
+    conn.commit()
+
+    if result is None or not result["valid"]:
+        return Response(status=404)
+
+    return Response(
+        status=200,
+        response=json.dumps(result["session_value"]),
+        mimetype="application/json"
+    )
+
+# The body of POST /api/session/<int:user_id>/pop.
+SESSION_POP_FIRST_SCHEMA = compile_schema({
+    "type": "object",
+    "properties": {
+        "kinds": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "string",
+            }
+        }
+    },
+    "required": ["kinds"]
+})
+
+@SESSIONS_API.route("/api/session/<int:user_id>/pop", methods=["POST"])
+def session_pop_first(user_id=None):
+    """
+    Remove the first piece of a user's conversation state, in the order of the
+    kinds given, and retrieve it, in one statement. The expired state of these
+    kinds is removed too. The body should be a JSON object following the
+    schema:
+    {
+        "kinds": ["kind1", ...]
+    }
+
+    Args:
+        user_id (int): The user id received by the URL.
+    Returns:
+        Response: - 200 in case of success and the kind and the value in the
+                  body, as {"kind": kind, "value": value}.
+                  - 400 if the body does not have all the necessary information.
+                  - 404 if there is no state or it expired.
+    """
+
+    payload = request.get_json(silent=True)
+
+    is_valid = validate_json(payload, SESSION_POP_FIRST_SCHEMA)
+    if not is_valid:
+        return Response(status=400)
+
+    conn = get_conn()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+    try:
+        execute(cursor, "session_pop_first", payload["kinds"], user_id)
+        results = cursor.fetchall()
+    except psycopg2.DataError:
+        conn.rollback()
+        return Response(status=404)
+    finally:
+        cursor.close()
+
+    conn.commit()
+
+    results = [row for row in results if row["valid"]]
+    if len(results) == 0:
+        return Response(status=404)
+
+    return Response(
+        status=200,
+        response=json.dumps({"kind": results[0]["session_kind"],
+                             "value": results[0]["session_value"]}),
+        mimetype="application/json"
+    )
+
+@SESSIONS_API.route("/api/session/<int:user_id>", methods=["DELETE"])
+def session_clear(user_id=None):
+    """
+    Remove the whole conversation state of a user.
+
+    Args:
+        user_id (int): The user id received by the URL.
+    Returns:
+        Response: - 200.
+    """
+
+    conn = get_conn()
+    cursor = conn.cursor()
+    execute(cursor, "session_clear", user_id)
+    cursor.close()
+    conn.commit()
+
+    return Response(status=200)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - A user's advance through the enrolled activity
+
+The user's row is locked, moved to the next step and the step is read from the
+content cache, in one request and one transaction, instead of the separate
+calls the central component used to make.
+"""
+
+import json
+import random
+
+from flask import Blueprint, Response
+from psycopg2.extras import RealDictCursor
+
+import psycopg2
+
+from connection_pool import execute, get_conn
+from content_api import current_content
+
+# The route of the advance
+ADVANCE_API = Blueprint("advance", __name__)
+
+# The queries prepared on every connection: name -> (parameter types, query).
+ADVANCE_STATEMENTS = {
+    "user_lock": (("BIGINT",), "SELECT user_step, course_id, \
+                                user_test_started FROM users \
+                                WHERE user_id=$1 FOR UPDATE"),
+    "user_advance": (("INT2", "BOOL", "BIGINT"),
+                     "UPDATE users SET user_step=$1, user_test_started=$2 \
+                      WHERE user_id=$3"),
+    "user_unenroll": (("BIGINT",), "UPDATE users SET course_id=NULL, \
+                                    user_step=0, user_test_started=FALSE \
+                                    WHERE user_id=$1")
+}
+
+@ADVANCE_API.route("/api/user/<int:user_id>/advance", methods=["POST"])
+def user_advance(user_id=None):
+    """
+    Move the user to the next step of the activity he is enrolled to, course or
+    test, and retrieve that step, in a single transaction. The body of the
+    response is a JSON object following the schema:
+    {
+        "event": "" / "test_started" / "test_finished",
+        "category": "lesson" / "mid" / "test",   (missing if test_finished)
+        ...the fields of the course step, mid question or test step
+    }
+
+    Args:
+        user_id (int): The user id received by the URL.
+    Returns:
+        Response: - 200 in case of success and the new step in the body.
+                  - 403 if the user is not enrolled in an activity.
+                  - 404 if the user is not found.
+                  - 500 if the new step does not exist.
+    """
+
+    content = current_content()
+
+    conn = get_conn()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+    try:
+        execute(cursor, "user_lock", user_id)
+        user = cursor.fetchone()
+
+        if user is None:
+            conn.rollback()
+            return Response(status=404)
+
+        user_step = user["user_step"]
+        course_id = user["course_id"]
+        user_test_started = user["user_test_started"]
+
+        if user_step == 0 or course_id is None:
+            conn.rollback()
+            return Response(status=403)
+
+        max_course_step = content.course_step_max(course_id)
+
+        event = ""
+        if user_test_started:
+            max_step = content.test_step_max(course_id)
+
+            if user_step >= max_step:
+                # The test is finished, unenroll the user.
+                execute(cursor, "user_unenroll", user_id)
+                conn.commit()
+
+                return Response(
+                    status=200,
+                    response=json.dumps({"event": "test_finished"}),
+                    mimetype="application/json"
+                )
+
+            user_step += 1
+        elif user_step >= max_course_step:
+            # The course is finished, start the test.
+            event = "test_started"
+            user_test_started = True
+            user_step = 1
+        else:
+            user_step += 1
+
+        execute(cursor, "user_advance", user_step, user_test_started, user_id)
+
+        if user_test_started:
+            category = "test"
+            steps = content.test_pool(course_id, user_step)
+            steps = [random.choice(steps)] if steps else []
+        elif user_step == (max_course_step // 2 + 1):
+            category = "mid"
+            steps = content.mid_question(course_id)
+        else:
+            category = "lesson"
+            steps = content.course_step(course_id, user_step)
+
+        if len(steps) == 0:
+            conn.rollback()
+            return Response(status=500)
+    except psycopg2.DataError:
+        conn.rollback()
+        return Response(status=500)
+    finally:
+        cursor.close()
+
+    conn.commit()
+
+    # The cached rows are shared, the response gets a copy.
+    step = dict(steps[0])
+    step["event"] = event
+    step["category"] = category
+
+    return Response(
+        status=200,
+        response=json.dumps(step),
+        mimetype="application/json"
+    )
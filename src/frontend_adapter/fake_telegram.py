@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - A fake Telegram Bot API server, for local load tests
+
+It serves the Bot API methods used by the frontend adapter and sends it the
+updates of several simulated users, to its webhook if one was set, otherwise
+through getUpdates. Every update is a message, /help by default, which does
+not need the other services. Start the adapter with
+TELEGRAM_BASE_URL=http://localhost:8081/bot (and, for the webhook mode,
+WEBHOOK_URL=http://localhost:8443), then run e.g.:
+    python fake_telegram.py --users 100 --messages 10
+
+The time until the last reply, the number of replies (fewer than the updates
+if the adapter merged some of them), the rejected webhook deliveries and the
+getUpdates calls made while idle are printed.
+"""
+
+import json
+import threading
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep, time
+
+import requests
+
+class FakeTelegram:
+    """The state of the fake Bot API: the webhook, the pending updates and
+    the counters.
+    """
+
+    def __init__(self):
+        self.webhook_url = None
+        self.updates = []
+        self.next_update_id = 1
+        self.counts = {"getUpdates": 0, "replies": 0, "rejected": 0}
+        # The (chat id, text) of every reply.
+        self.replies = []
+        self.last_reply = monotonic()
+        self.cond = threading.Condition()
+
+    def call(self, method, params):
+        """
+        Run a Bot API method.
+
+        Args:
+            method (str): The method's name, e.g. "sendMessage".
+            params (dict): The parameters.
+        Returns:
+            The result of the method, None if it is not supported.
+        """
+
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "MathBot",
+                    "username": "math_bot"}
+
+        if method == "setWebhook":
+            with self.cond:
+                self.webhook_url = params.get("url") or None
+            return True
+
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+
+        if method == "getUpdates":
+            return self.get_updates(int(params.get("offset") or 0),
+                                    float(params.get("timeout") or 0))
+
+        if method.startswith("send"):
+            with self.cond:
+                self.counts["replies"] += 1
+                self.replies.append((int(params.get("chat_id", 0)),
+                                     params.get("text", "")))
+                self.last_reply = monotonic()
+                self.cond.notify_all()
+
+            message = {"message_id": 1, "date": int(time()),
+                       "chat": {"id": int(params.get("chat_id", 0)),
+                                "type": "private"},
+                       "text": params.get("text", "")}
+            if method == "sendPhoto":
+                # The same file_id for every photo.
+                message["photo"] = [{"file_id": "photo", "width": 1,
+                                     "height": 1,
+                                     "file_unique_id": "photo"}]
+
+            return message
+
+        return None
+
+    def get_updates(self, offset, timeout):
+        """
+        The long polling of the updates.
+
+        Returns:
+            list: The updates having an id of at least offset.
+        """
+
+        deadline = monotonic() + timeout
+
+        with self.cond:
+            self.counts["getUpdates"] += 1
+            self.updates = [update for update in self.updates
+                            if update["update_id"] >= offset]
+
+            while not self.updates and monotonic() < deadline:
+                self.cond.wait(deadline - monotonic())
+
+            return list(self.updates)
+
+    def new_update(self, user_id, text):
+        """
+        Returns:
+            dict: A message update from a user.
+        """
+
+        with self.cond:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        message = {"message_id": update_id, "date": int(time()), "from": user,
+                   "chat": {"id": user_id, "type": "private",
+                            "first_name": user["first_name"]},
+                   "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0,
+                                    "length": len(text.split()[0])}]
+
+        return {"update_id": update_id, "message": message}
+
+    def deliver(self, update, session):
+        """Send an update to the webhook, again while it is rejected, as
+        Telegram does, or add it to the pending updates."""
+
+        if self.webhook_url is None:
+            with self.cond:
+                self.updates.append(update)
+                self.cond.notify_all()
+            return
+
+        while session.post(self.webhook_url, json=update).status_code != 200:
+            with self.cond:
+                self.counts["rejected"] += 1
+            sleep(0.1)
+
+    def wait_adapter(self, timeout=None):
+        """
+        Wait until the adapter sets its webhook or starts polling.
+
+        Args:
+            timeout (float, optional): How long (seconds) to wait. Defaults to
+                                       None (no limit).
+        Returns:
+            bool: False if the timeout expired.
+        """
+
+        deadline = None if timeout is None else monotonic() + timeout
+
+        with self.cond:
+            while self.webhook_url is None and not self.counts["getUpdates"]:
+                if deadline is not None and monotonic() >= deadline:
+                    return False
+                self.cond.wait(0.1)
+
+        return True
+
+    def wait_replies(self, count, quiet, timeout):
+        """
+        Wait until count replies were sent in total or, as merged replies are
+        fewer, no reply was sent for quiet seconds.
+
+        Returns:
+            bool: False if the timeout expired.
+        """
+
+        deadline = monotonic() + timeout
+
+        with self.cond:
+            while self.counts["replies"] < count:
+                now = monotonic()
+                if now >= self.last_reply + quiet:
+                    break
+                if now >= deadline:
+                    return False
+                self.cond.wait(min(deadline, self.last_reply + quiet) - now)
+
+        return True
+
+def make_handler(fake):
+    """
+    Returns:
+        type: The request handler class of the fake's HTTP server.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        """Serves /bot<token>/<method>."""
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            """Runs a Bot API method."""
+
+            method = self.path.rsplit("/", 1)[-1]
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            try:
+                params = json.loads(body) if body else {}
+            except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+                # A file upload (multipart/form-data), its parameters are not
+                # needed.
+                params = {}
+
+            result = fake.call(method, params)
+            if result is None:
+                reply = {"ok": False, "error_code": 404,
+                         "description": "Not Found"}
+            else:
+                reply = {"ok": True, "result": result}
+
+            data = json.dumps(reply).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST
+
+        def log_message(self, *_):  # pylint: disable=arguments-differ
+            """Requests are not logged."""
+
+    return Handler
+
+def run_load(fake, users, messages, text, concurrency):
+    """
+    Send the users' updates, every user sending its messages in order, and
+    wait for the replies.
+
+    Returns:
+        dict: The number of updates, the number of replies, the time until
+              the last reply and the rejected webhook deliveries.
+    """
+
+    start = monotonic()
+    replies = fake.counts["replies"]
+    rejected = fake.counts["rejected"]
+
+    def send(user_id):
+        with requests.Session() as session:
+            for _ in range(messages):
+                fake.deliver(fake.new_update(user_id, text), session)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(send, range(1000, 1000 + users)))
+
+    total = users * messages
+    answered = fake.wait_replies(replies + total, quiet=5, timeout=300)
+    seconds = fake.last_reply - start
+
+    return {"updates": total, "answered": answered,
+            "replies": fake.counts["replies"] - replies,
+            "seconds": round(seconds, 3),
+            "updates_per_second": round(total / seconds, 1),
+            "rejected": fake.counts["rejected"] - rejected}
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Run a fake Telegram Bot API server "
+                                        "and load the frontend adapter.")
+    parser.add_argument("--port", type=int, default=8081,
+                        help="the fake server's port (default: 8081)")
+    parser.add_argument("--users", type=int, default=100,
+                        help="the number of users (default: 100)")
+    parser.add_argument("--messages", type=int, default=10,
+                        help="the messages of every user (default: 10)")
+    parser.add_argument("--text", default="/help",
+                        help="the messages' text (default: /help)")
+    parser.add_argument("--concurrency", type=int, default=32,
+                        help="the users sending at once (default: 32)")
+    parser.add_argument("--idle", type=float, default=10.0,
+                        help="the idle time (seconds) measured after the "
+                             "load (default: 10)")
+    args = parser.parse_args()
+
+    FAKE = FakeTelegram()
+    server = ThreadingHTTPServer(("0.0.0.0", args.port), make_handler(FAKE))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print("Waiting for the frontend adapter...")
+    FAKE.wait_adapter()
+    mode = "webhook" if FAKE.webhook_url else "polling"
+    report = run_load(FAKE, args.users, args.messages, args.text,
+                      args.concurrency)
+
+    polls = FAKE.counts["getUpdates"]
+    sleep(args.idle)
+    report["idle_get_updates"] = FAKE.counts["getUpdates"] - polls
+
+    print(json.dumps({"mode": mode, **report}))
+    server.shutdown()
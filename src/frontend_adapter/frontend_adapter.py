@@ -13,33 +13,50 @@ Math Bot (C) 2021 - The adapter to the Facebook Messenger frontend.
 import logging
 import json
 import os
+import queue
 import sys
 
 from argparse import ArgumentParser
 from time import localtime, strftime
 
-import jsonschema
 import requests
 import telegram as tg
 import telegram.ext as tge
 
-def validate_json(json_data, json_schema):
-    """
-    Check if a JSON object follow a schema or not.
+from media_cache import MediaCache
+from send_queue import QueuedBot
+from user_dispatcher import UserDispatcher
+from common.http_client import client_from_env
+from common.response_cache import VERSION_HEADER, ResponseCache
+from common.validation import COURSE_SCHEMA, validate_json
 
-    Args:
-        json_data (dict): The input JSON obect.
-        json_schema (dict): The wanted JSON schema.
-    Returns:
-        bool: True if the object is correct, False otherwise.
-    """
+class UpdateQueue(queue.Queue):
+    """A bounded queue of the received updates, waiting for a free worker."""
 
-    try:
-        jsonschema.validate(instance=json_data, schema=json_schema)
-    except jsonschema.exceptions.ValidationError:
-        return False
+    def __init__(self, maxsize, put_timeout=None):
+        """
+        Args:
+            maxsize (int): The maximum number of waiting updates.
+            put_timeout (float, optional): How long (seconds) to wait for room
+                                           in a full queue before raising
+                                           queue.Full. Defaults to None (wait
+                                           as long as needed).
+        """
+
+        super().__init__(maxsize)
+        self.put_timeout = put_timeout
 
-    return True
+    def put(self, item, block=True, timeout=None):
+        """Adds an update, waiting at most put_timeout if the queue is full.
+
+        Raises:
+            queue.Full: If the queue is still full after put_timeout.
+        """
+
+        if timeout is None:
+            timeout = self.put_timeout
+
+        super().put(item, block, timeout)
 
 def start_cmd(update: tg.Update, _: tge.CallbackContext) -> None:
     """
@@ -55,7 +72,7 @@ def start_cmd(update: tg.Update, _: tge.CallbackContext) -> None:
     user = update.effective_user
 
     query_payload = {"user_id" : user.id, "user_name" : user.full_name}
-    req = requests.post(f"{MATH_BOT_HOST}/api/register", json=query_payload)
+    req = MATH_BOT.post("/api/register", json=query_payload)
     LOGGER.info("Register POST %s", req.status_code)
 
     if req.status_code == 409:
@@ -145,7 +162,9 @@ def time_cmd(update: tg.Update, _: tge.CallbackContext) -> None:
 
 def courses_cmd(update: tg.Update, _: tge.CallbackContext) -> None:
     """
-    Retrieve the available courses when the command /courses is issued.
+    Retrieve the available courses when the command /courses is issued. The
+    reply is cached for COURSES_CACHE_TTL seconds, then revalidated with the
+    central component and rebuilt only if the content version changed.
 
     Args:
         update (telegram.Update): The incoming update.
@@ -154,30 +173,60 @@ def courses_cmd(update: tg.Update, _: tge.CallbackContext) -> None:
 
     LOGGER.info("%s received", update.message.text)
 
-    req = requests.get(f"{MATH_BOT_HOST}/api/courses")
-    LOGGER.info("Courses GET %s", req.status_code)
+    (entry, fresh) = COURSES_CACHE.lookup("courses")
+
+    if not fresh:
+        req = MATH_BOT.get("/api/courses",
+                           headers=COURSES_CACHE.request_headers("courses"))
+        LOGGER.info("Courses GET %s", req.status_code)
+
+        # The cached reply is still valid if the list did not change, or if
+        # it has the same content version.
+        unchanged = entry is not None and \
+                    (req.status_code == 304 or
+                     req.status_code == 200 and entry.version is not None and
+                     req.headers.get(VERSION_HEADER) == entry.version)
+
+        if unchanged:
+            entry = COURSES_CACHE.revalidated("courses")
+        elif req.status_code == 200:
+            reply = courses_reply(req)
+            if reply is None:
+                update.message.reply_text("Something happened.")
+                return
+            entry = COURSES_CACHE.store("courses", reply, req.headers)
+        else:
+            update.message.reply_text("Something happened.")
+            return
+
+    update.message.reply_markdown_v2(entry.value)
 
-    if req.status_code != 200:
-        update.message.reply_text("Something happened.")
-        return
+def courses_reply(req):
+    """
+    Build the reply to /courses.
+
+    Args:
+        req (requests.Response): The list of courses, from the central
+                                 component.
+    Returns:
+        str: The reply (MarkdownV2), None if a course is not valid.
+    """
 
     reply = "The list of available courses is:"
     try:
         for course in req.json():
             is_valid = validate_json(course, COURSE_SCHEMA)
             if not is_valid:
-                update.message.reply_text("Something happened.")
-                return
+                return None
 
             reply += f"\n\- *{course['course_name']}*:"
             reply += f"\n  Course length: {course['course_num_steps']}"
             reply += f"\n  Test length: {course['course_num_questions']}"
             reply += f"\n  Description: {course['course_description']}"
     except json.decoder.JSONDecodeError:
-        update.message.reply_text("Something happened.")
-        return
+        return None
 
-    update.message.reply_markdown_v2(reply.replace(".", "\."))
+    return reply.replace(".", "\.")
 
 def enroll_cmd(update: tg.Update, ctx: tge.CallbackContext) -> None:
     """
@@ -201,7 +250,7 @@ def enroll_cmd(update: tg.Update, ctx: tge.CallbackContext) -> None:
     course_name = cmd_args[0]
     user_id = update.effective_user.id
     query_payload = {"user_id" : user_id, "course_name" : course_name}
-    req = requests.post(f"{MATH_BOT_HOST}/api/enroll", json=query_payload)
+    req = MATH_BOT.post("/api/enroll", json=query_payload)
     LOGGER.info("Enroll POST %s", req.status_code)
 
     if req.status_code == 404:
@@ -248,7 +297,7 @@ def enroll_cmd(update: tg.Update, ctx: tge.CallbackContext) -> None:
 
     update.message.reply_markdown_v2(reply.replace(".", "\."))
 
-    req = requests.get(f"{MATH_BOT_HOST}/api/current_step/{user_id}")
+    req = MATH_BOT.get(f"/api/current_step/{user_id}")
     LOGGER.info("Enroll GET %s", req.status_code)
 
     if req.status_code != 200 or req.text == "":
@@ -286,8 +335,8 @@ def next_cmd(update: tg.Update, _: tge.CallbackContext) -> None:
     user = update.effective_user
     user_id = user.id
 
-    req = requests.post(f"{MATH_BOT_HOST}/api/next/{user_id}")
-    LOGGER.info("Next POST %s", req.status_code)
+    req = MATH_BOT.post(f"/api/advance/{user_id}")
+    LOGGER.info("Advance POST %s", req.status_code)
 
     if req.status_code == 403:
         update.message.reply_text("You are not enrolled in any course!")
@@ -303,7 +352,13 @@ def next_cmd(update: tg.Update, _: tge.CallbackContext) -> None:
         update.message.reply_text("Something happened.")
         return
 
-    if req.text == "test_finished":
+    try:
+        step = req.json()
+    except json.decoder.JSONDecodeError:
+        update.message.reply_text("Something happened.")
+        return
+
+    if step["event"] == "test_finished":
         update.message.reply_markdown_v2(
             f"Congratulations {user.mention_markdown_v2()}\!\n"
             "You finished your test\! 👏 Type /score to check your points\.\n"
@@ -311,56 +366,30 @@ def next_cmd(update: tg.Update, _: tge.CallbackContext) -> None:
         )
         return
 
-    if req.text == "test_started":
+    if step["event"] == "test_started":
         update.message.reply_markdown_v2(
             "You finished the course so fast\! 🤯\n"
             "Your test will start now\. Answer all your questions to maximize "
             "your score\."
         )
 
-    req = requests.get(f"{MATH_BOT_HOST}/api/current_step/{user_id}")
-    LOGGER.info("Next GET %s", req.status_code)
-
-    if req.status_code == 200:
-        # The message is a course step.
-        try:
-            course_step = req.json()
-        except json.decoder.JSONDecodeError:
-            return
-
-        course_step_text = course_step["course_step_text"]
-        update.message.reply_text(course_step_text)
+    if step["category"] == "lesson":
+        update.message.reply_text(step["text"])
 
-        if "course_step_url" in course_step:
-            course_step_url = course_step["course_step_url"]
-            update.message.reply_photo(course_step_url)
+        if "url" in step:
+            update.message.reply_photo(step["url"])
 
         update.message.reply_text("Type /next for the next lesson.")
-        return
-
-    if req.status_code == 205 and req.text != "":
-        # The message is a mid question or a test step.
-        slash_pos = req.text.find("/")
-
-        if slash_pos == -1:
-            update.message.reply_text("Something happened.")
-            return
-
-        category = req.text[:slash_pos]
-        question = req.text[slash_pos + 1:]
-
-        if category == "test":
-            update.message.reply_text(
-                "Answer this question for 1 point or type /next to skip."
-            )
-            update.message.reply_text(question)
-        else:
-            update.message.reply_text(
-                "Answer this question or type /next to skip."
-            )
-            update.message.reply_text(question)
+    elif step["category"] == "test":
+        update.message.reply_text(
+            "Answer this question for 1 point or type /next to skip."
+        )
+        update.message.reply_text(step["text"])
     else:
-        update.message.reply_text("Something happened.")
+        update.message.reply_text(
+            "Answer this question or type /next to skip."
+        )
+        update.message.reply_text(step["text"])
 
 def score_cmd(update: tg.Update, _: tge.CallbackContext) -> None:
     """
@@ -374,7 +403,7 @@ def score_cmd(update: tg.Update, _: tge.CallbackContext) -> None:
     LOGGER.info("%s received", update.message.text)
 
     user_id = update.effective_user.id
-    req = requests.get(f"{MATH_BOT_HOST}/api/score/{user_id}")
+    req = MATH_BOT.get(f"/api/score/{user_id}")
     LOGGER.info("Score GET %s", req.status_code)
 
     if req.status_code == 404:
@@ -408,7 +437,7 @@ def cancel_cmd(update: tg.Update, _: tge.CallbackContext) -> None:
     LOGGER.info("%s received", update.message.text)
 
     user_id = update.effective_user.id
-    req = requests.post(f"{MATH_BOT_HOST}/api/cancel/{user_id}")
+    req = MATH_BOT.post(f"/api/cancel/{user_id}")
     LOGGER.info("Cancel POST %s", req.status_code)
 
     if req.status_code == 404:
@@ -444,7 +473,7 @@ def quit_cmd(update: tg.Update, _: tge.CallbackContext) -> None:
     LOGGER.info("%s received", update.message.text)
 
     user_id = update.effective_user.id
-    req = requests.post(f"{MATH_BOT_HOST}/api/quit/{user_id}")
+    req = MATH_BOT.post(f"/api/quit/{user_id}")
     LOGGER.info("Quit POST %s", req.status_code)
 
     if req.status_code == 200:
@@ -492,7 +521,7 @@ def text_msg(update: tg.Update, _: tge.CallbackContext) -> None:
     msg = update.message.text
 
     query_payload = {"user_id" : user_id, "message" : msg}
-    req = requests.post(f"{MATH_BOT_HOST}/api/message", json=query_payload)
+    req = MATH_BOT.post("/api/message", json=query_payload)
     LOGGER.info("Message POST %s", req.status_code)
 
     if req.status_code == 200:
@@ -511,9 +540,39 @@ def text_msg(update: tg.Update, _: tge.CallbackContext) -> None:
         update.message.reply_text(
             "I am sad that you are leaving! 😥 See you around! 👋"
         )
+    elif req.status_code == 413:
+        update.message.reply_text(
+            "Your answer is too long. 😵 Please try a shorter one!"
+        )
     else:
         update.message.reply_text("Something happened.")
 
+def error_handler(update: object, ctx: tge.CallbackContext) -> None:
+    """
+    The handler to be called when a handler raised an error, e.g. math_bot
+    could not be reached.
+
+    Args:
+        update (object): The update which caused the error, if any.
+        ctx (telegram.ext.CallbackContext): The context callback.
+    """
+
+    LOGGER.error("Update %s caused error %s", update, ctx.error)
+
+    if isinstance(ctx.error, requests.exceptions.RequestException) and \
+       isinstance(update, tg.Update) and update.effective_message:
+        update.effective_message.reply_text("Something happened.")
+
+def log_send_metrics(ctx: tge.CallbackContext) -> None:
+    """
+    Log the send queue's metrics (queue depth and send latency).
+
+    Args:
+        ctx (telegram.ext.CallbackContext): The context callback.
+    """
+
+    LOGGER.info("Send queue: %s", json.dumps(ctx.bot.send_queue.metrics()))
+
 if __name__ == "__main__":
     parser = ArgumentParser(description="Run an adapter to the Telegram API.")
     parser.add_argument("-d", "--debug", action="store_true",
@@ -538,6 +597,8 @@ if __name__ == "__main__":
 
     math_bot_port = os.getenv("MATH_BOT_PORT", "5001")
     MATH_BOT_HOST = f"http://math_bot:{math_bot_port}"
+    # Keep-alive client for math_bot.
+    MATH_BOT = client_from_env(MATH_BOT_HOST)
     API_TOKEN = os.getenv("API_TOKEN")
 
     if API_TOKEN is None:
@@ -545,43 +606,90 @@ if __name__ == "__main__":
         while True:
             continue
 
-    COURSE_SCHEMA = {
-        "type": "object",
-        "properties": {
-            "course_id": {"type": "number"},
-            "course_name": {"type": "string"},
-            "course_description": {"type": "string"},
-            "course_num_steps": {"type": "number"},
-            "course_num_questions": {"type": "number"}
-        },
-        "required": ["course_id", "course_name", "course_description",
-                     "course_num_steps", "course_num_questions"]
+    # The reply to /courses, which changes only when new content is imported.
+    COURSES_CACHE = ResponseCache(float(os.getenv("COURSES_CACHE_TTL", "60")))
+
+    # The handlers run in DISPATCHER_WORKERS threads, every user's updates
+    # being handled in order by the same thread. Their replies are sent by
+    # SEND_WORKERS threads, within the rate limits. TELEGRAM_BASE_URL points
+    # the bot to another server, e.g. fake_telegram.py.
+    num_workers = int(os.getenv("DISPATCHER_WORKERS", "8"))
+    send_options = {
+        "global_rate": float(os.getenv("SEND_GLOBAL_RATE", "30")),
+        "chat_rate": float(os.getenv("SEND_CHAT_RATE", "1")),
+        "chat_burst": float(os.getenv("SEND_CHAT_BURST", "3")),
+        "workers": int(os.getenv("SEND_WORKERS", "4")),
+        "max_pending": int(os.getenv("SEND_QUEUE_SIZE", "10000"))
     }
-
-    # The Telegram updater.
-    updater = tge.Updater(API_TOKEN)
+    # The lesson images are uploaded once, from IMAGES_DIR, then sent by
+    # file_id, the file_ids being kept in MEDIA_CACHE_FILE.
+    media = MediaCache(os.getenv("MEDIA_CACHE_FILE",
+                                 "/tmp/media/file_ids.json"),
+                       os.getenv("IMAGES_DIR", "/tmp/images_course"))
+    telegram_bot = QueuedBot(API_TOKEN, send_options, media,
+                             base_url=os.getenv("TELEGRAM_BASE_URL"),
+                             request=tg.utils.request.Request(
+                                 con_pool_size=num_workers +
+                                               send_options["workers"] + 4))
+
+    # The updates waiting for a free shard. A full queue stops the polling until
+    # there is room or, with a webhook, rejects the update, which Telegram
+    # delivers again later.
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+    updates = UpdateQueue(int(os.getenv("UPDATE_QUEUE_SIZE", "1000")),
+                          put_timeout=0 if WEBHOOK_URL else None)
+
+    jobs = tge.JobQueue()
     # Dispatcher for registering handlers.
-    dispatcher = updater.dispatcher
+    dispatcher = UserDispatcher(telegram_bot, updates, num_workers, jobs,
+                                int(os.getenv("SHARD_QUEUE_SIZE", "100")))
+    jobs.set_dispatcher(dispatcher)
+    # The Telegram updater.
+    updater = tge.Updater(workers=None, dispatcher=dispatcher)
 
     # Telegram command handlers.
-    dispatcher.add_handler(tge.CommandHandler("start", start_cmd))
-    dispatcher.add_handler(tge.CommandHandler("help", help_cmd))
-    dispatcher.add_handler(tge.CommandHandler("gdpr", gdpr_cmd))
-    dispatcher.add_handler(tge.CommandHandler("time", time_cmd))
-    dispatcher.add_handler(tge.CommandHandler("courses", courses_cmd))
-    dispatcher.add_handler(tge.CommandHandler("enroll", enroll_cmd))
-    dispatcher.add_handler(tge.CommandHandler("next", next_cmd))
-    dispatcher.add_handler(tge.CommandHandler("score", score_cmd))
-    dispatcher.add_handler(tge.CommandHandler("cancel", cancel_cmd))
-    dispatcher.add_handler(tge.CommandHandler("quit", quit_cmd))
+    handlers = [
+        ("start", start_cmd),
+        ("help", help_cmd),
+        ("gdpr", gdpr_cmd),
+        ("time", time_cmd),
+        ("courses", courses_cmd),
+        ("enroll", enroll_cmd),
+        ("next", next_cmd),
+        ("score", score_cmd),
+        ("cancel", cancel_cmd),
+        ("quit", quit_cmd)
+    ]
+    for (command, callback) in handlers:
+        dispatcher.add_handler(tge.CommandHandler(command, callback,
+                                                  run_async=True))
     # Telegram handler for unknown commands.
-    dispatcher.add_handler(tge.MessageHandler(tge.Filters.command, unknown))
+    dispatcher.add_handler(tge.MessageHandler(tge.Filters.command, unknown,
+                                              run_async=True))
     # Telegram handler for text messages.
-    dispatcher.add_handler(tge.MessageHandler(tge.Filters.text, text_msg))
-
-    # Start the Bot
-    updater.start_polling()
+    dispatcher.add_handler(tge.MessageHandler(tge.Filters.text, text_msg,
+                                              run_async=True))
+    # Telegram handler for errors.
+    dispatcher.add_error_handler(error_handler)
+
+    jobs.run_repeating(log_send_metrics,
+                       interval=float(os.getenv("SEND_METRICS_INTERVAL", "60")))
+
+    # Start the Bot: Telegram sends the updates to the webhook if WEBHOOK_URL
+    # is set (the public URL which reaches WEBHOOK_ADDR:WEBHOOK_PORT, the
+    # token being added to it), otherwise they are polled.
+    if WEBHOOK_URL:
+        updater.start_webhook(listen=os.getenv("WEBHOOK_ADDR", "0.0.0.0"),
+                              port=int(os.getenv("WEBHOOK_PORT", "8443")),
+                              url_path=API_TOKEN,
+                              webhook_url=f"{WEBHOOK_URL.rstrip('/')}/"
+                                          f"{API_TOKEN}")
+    else:
+        updater.start_polling()
 
     # Run the bot until Ctrl-C is pressed or the process receives SIGINT,
     # SIGTERM or SIGABRT.
     updater.idle()
+
+    # Send the last replies.
+    telegram_bot.send_queue.stop()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The cache of the lesson images uploaded to Telegram
+
+A photo sent to Telegram gets a file_id, which the bot can send again without
+Telegram downloading the image. The lesson images are uploaded once, from the
+local copy of images_course when there is one (otherwise Telegram fetches
+their URL once), and their file_ids are kept in a JSON file, by URL, together
+with the SHA-1 of the uploaded file. An image whose local copy changed is
+uploaded again, as is one whose file_id Telegram rejects (e.g. after the bot's
+token changed). Identical images share one file_id.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import telegram as tg
+
+# The part of an image's URL after which comes its path in images_course.
+IMAGES_MARKER = "/images_course/"
+
+def file_sha1(path):
+    """
+    Returns:
+        str: The hex SHA-1 of a file's content.
+    """
+
+    digest = hashlib.sha1()
+
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(65536), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+class MediaCache:
+    """A persistent map from the images' URLs to their Telegram file_ids."""
+
+    def __init__(self, path, images_dir=None):
+        """
+        Args:
+            path (str): The JSON file of the map, created if missing.
+            images_dir (str, optional): The local copy of images_course.
+                                        Defaults to None (the images are
+                                        sent by URL the first time).
+        """
+
+        self.path = path
+        self.images_dir = images_dir
+        self._lock = threading.Lock()
+        # url -> {"file_id": ..., "sha1": ...}
+        self._entries = {}
+        # url -> the SHA-1 of the local file, computed once
+        self._hashes = {}
+        # url -> the lock held while uploading the image, so it is uploaded
+        # once even if several chats need it at once
+        self._uploads = {}
+
+        try:
+            with open(path, encoding="utf-8") as file:
+                self._entries = json.load(file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            logging.getLogger(__name__).exception("Cannot read %s", path)
+
+    def local_file(self, url):
+        """
+        Returns:
+            str: The local copy of an image, None if there is none.
+        """
+
+        if self.images_dir is None or IMAGES_MARKER not in url:
+            return None
+
+        name = url.split(IMAGES_MARKER, 1)[1]
+        path = os.path.normpath(os.path.join(self.images_dir, name))
+
+        # Only the files of images_dir are sent.
+        if not path.startswith(os.path.join(self.images_dir, "")) or \
+           not os.path.isfile(path):
+            return None
+
+        return path
+
+    def _local_hash(self, url):
+        """
+        Returns:
+            tuple: The local copy of an image and its SHA-1, (None, None) if
+                   there is no local copy.
+        """
+
+        path = self.local_file(url)
+        if path is None:
+            return (None, None)
+
+        with self._lock:
+            sha1 = self._hashes.get(url)
+
+        if sha1 is None:
+            sha1 = file_sha1(path)
+            with self._lock:
+                self._hashes[url] = sha1
+
+        return (path, sha1)
+
+    def file_id(self, url):
+        """
+        Returns:
+            str: The cached file_id of an image, None if it is not cached or
+                 its local copy changed since it was uploaded.
+        """
+
+        (_, sha1) = self._local_hash(url)
+
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and (sha1 is None or entry["sha1"] == sha1):
+                return entry["file_id"]
+
+            # The same image, under another URL.
+            if sha1 is not None:
+                for other in self._entries.values():
+                    if other["sha1"] == sha1:
+                        return other["file_id"]
+
+        return None
+
+    def store(self, url, file_id, sha1=None):
+        """Records an image's file_id and saves the map."""
+
+        with self._lock:
+            self._entries[url] = {"file_id": file_id, "sha1": sha1}
+            self._save()
+
+    def forget(self, url):
+        """Removes an image's file_id, and those of the same image."""
+
+        with self._lock:
+            entry = self._entries.pop(url, None)
+            if entry is not None and entry["sha1"] is not None:
+                self._entries = {other_url: other
+                                 for (other_url, other)
+                                 in self._entries.items()
+                                 if other["sha1"] != entry["sha1"]}
+            self._save()
+
+    def _save(self):
+        """Writes the map, replacing the file atomically. The lock must be
+        held.
+        """
+
+        tmp_path = f"{self.path}.tmp"
+
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(self._entries, file, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            logging.getLogger(__name__).exception("Cannot write %s",
+                                                  self.path)
+
+    def send_photo(self, send, chat_id, url):
+        """
+        Send an image by its file_id, uploading it first if it is not cached.
+
+        Args:
+            send (function): Sends a photo, called as send(chat_id, photo),
+                             returning the sent telegram.Message.
+            chat_id (int): The chat's id.
+            url (str): The image's URL.
+        Returns:
+            telegram.Message: The sent message.
+        """
+
+        file_id = self.file_id(url)
+
+        if file_id is not None:
+            try:
+                return send(chat_id, file_id)
+            except tg.error.BadRequest:
+                # Telegram does not know this file_id (anymore).
+                logging.getLogger(__name__).warning(
+                    "The file_id of %s was rejected, uploading it again", url)
+                self.forget(url)
+
+        with self._lock:
+            upload = self._uploads.setdefault(url, threading.Lock())
+
+        with upload:
+            # Another chat may have uploaded it meanwhile.
+            file_id = self.file_id(url)
+            if file_id is not None:
+                return send(chat_id, file_id)
+
+            (path, sha1) = self._local_hash(url)
+
+            if path is None:
+                message = send(chat_id, url)
+            else:
+                with open(path, "rb") as file:
+                    message = send(chat_id, file)
+
+            if message is not None and message.photo:
+                self.store(url, message.photo[-1].file_id, sha1)
+
+        return message
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The rate-limited queue of the messages sent to Telegram
+
+The handlers' replies are queued and the handlers return immediately. Sender
+threads send them, every chat's messages in order, within Telegram's flood
+limits: a token bucket for every chat and one for the whole bot. Consecutive
+text messages waiting for the same chat are merged into one message, as long
+as it stays under Telegram's length limit.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+import telegram as tg
+
+from telegram.utils.helpers import escape_markdown
+
+# The maximum length of a Telegram text message.
+MAX_TEXT_LEN = 4096
+
+class TokenBucket:
+    """Allows rate events per second, in bursts of at most burst events."""
+
+    def __init__(self, rate, burst, now):
+        """
+        Args:
+            rate (float): The events allowed per second.
+            burst (float): The maximum number of events at once.
+            now (float): The current time (monotonic).
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def wait(self, now):
+        """
+        Args:
+            now (float): The current time (monotonic).
+        Returns:
+            float: How long (seconds) until an event is allowed, 0 if now.
+        """
+
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+        if self.tokens >= 1:
+            return 0.0
+
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        """Records an event, which wait allowed."""
+
+        self.tokens -= 1
+
+    def idle(self, now):
+        """
+        Returns:
+            bool: True if the bucket is full again, so it can be forgotten.
+        """
+
+        return self.wait(now) == 0 and self.tokens >= self.burst
+
+def merge_texts(items, max_len=MAX_TEXT_LEN):
+    """
+    Merge consecutive text messages. A plain text joining a MarkdownV2 one is
+    escaped.
+
+    Args:
+        items (collections.deque): The waiting messages of a chat, as
+                                   (kind, payload, parse_mode, enqueue time)
+                                   tuples. The merged ones are removed.
+        max_len (int, optional): The maximum length of the merged text.
+                                 Defaults to MAX_TEXT_LEN.
+    Returns:
+        tuple: The message to send (kind, payload, parse_mode) and the enqueue
+               times of the merged messages (list).
+    """
+
+    (kind, payload, parse_mode, enqueued) = items.popleft()
+    stamps = [enqueued]
+
+    if kind != "text":
+        return (kind, payload, parse_mode), stamps
+
+    while items and items[0][0] == "text":
+        (_, text, mode, enqueued) = items[0]
+
+        if mode != parse_mode:
+            if {mode, parse_mode} != {None, tg.ParseMode.MARKDOWN_V2}:
+                break
+            if mode is None:
+                text = escape_markdown(text, version=2)
+            else:
+                payload = escape_markdown(payload, version=2)
+                parse_mode = mode
+
+        merged = f"{payload}\n\n{text}"
+        if len(merged) > max_len:
+            break
+
+        items.popleft()
+        (payload, stamps) = (merged, stamps + [enqueued])
+
+    return (kind, payload, parse_mode), stamps
+
+class SendQueue:
+    # pylint: disable=too-many-instance-attributes
+    """Sends messages asynchronously, in order for every chat, merging the
+    consecutive texts of a chat and respecting the rate limits.
+    """
+
+    def __init__(self, send, global_rate=30.0, chat_rate=1.0, chat_burst=3.0,
+                 workers=4, max_pending=10000):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        """
+        Args:
+            send (function): Sends a message, called as
+                             send(chat_id, kind, payload, parse_mode), kind
+                             being "text" or "photo".
+            global_rate (float, optional): The messages per second of the
+                                           whole bot. Defaults to 30.
+            chat_rate (float, optional): The messages per second of a chat.
+                                         Defaults to 1.
+            chat_burst (float, optional): The messages a chat may receive at
+                                          once. Defaults to 3.
+            workers (int, optional): The number of sender threads. Defaults
+                                     to 4.
+            max_pending (int, optional): The maximum number of waiting
+                                         messages, put waits while there are
+                                         more. Defaults to 10000.
+        """
+
+        self._send = send
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_pending = max_pending
+
+        self._cond = threading.Condition()
+        # chat_id -> the chat's waiting messages
+        self._chats = {}
+        # chat_id -> the chat's token bucket
+        self._buckets = {}
+        # The chats being scheduled or sent, at most one send per chat.
+        self._active = set()
+        # The scheduled chats, as (due time, sequence, chat_id).
+        self._ready = []
+        self._seq = itertools.count()
+        self._global = TokenBucket(global_rate, global_rate, monotonic())
+        self._pending = 0
+        self._next_prune = monotonic()
+        self._running = True
+
+        self._stats = {
+            "sent": 0,
+            "messages": 0,
+            "failed": 0,
+            "retried": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+            "send_total": 0.0,
+            "send_max": 0.0
+        }
+
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="sender")
+        self._scheduler = threading.Thread(target=self._run,
+                                           name="send-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def put(self, chat_id, kind, payload, parse_mode=None):
+        """Queues a message.
+
+        Args:
+            chat_id (int): The chat's id.
+            kind (str): "text" or "photo".
+            payload (str): The text or the photo's URL / file_id.
+            parse_mode (str, optional): The text's parse mode. Defaults to
+                                        None.
+        """
+
+        with self._cond:
+            while self._pending >= self.max_pending:
+                self._cond.wait()
+
+            self._chats.setdefault(chat_id, deque()).append(
+                (kind, payload, parse_mode, monotonic()))
+            self._pending += 1
+
+            if chat_id not in self._active:
+                self._schedule(chat_id, monotonic())
+
+    def _schedule(self, chat_id, due):
+        """Schedules a chat's next send. The lock must be held."""
+
+        self._active.add(chat_id)
+        heapq.heappush(self._ready, (due, next(self._seq), chat_id))
+        self._cond.notify_all()
+
+    def _prune(self, now):
+        """Forgets the buckets of the idle chats. The lock must be held."""
+
+        self._buckets = {chat_id: bucket
+                         for (chat_id, bucket) in self._buckets.items()
+                         if chat_id in self._active or not bucket.idle(now)}
+        self._next_prune = now + 60
+
+    def _run(self):
+        """The scheduler loop: wait for the first due chat allowed by the rate
+        limits and hand its next message to a sender.
+        """
+
+        with self._cond:
+            while self._running:
+                now = monotonic()
+                if now >= self._next_prune:
+                    self._prune(now)
+
+                if not self._ready:
+                    self._cond.wait(60)
+                    continue
+
+                (due, _, chat_id) = self._ready[0]
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+
+                bucket = self._buckets.get(chat_id)
+                if bucket is None:
+                    bucket = TokenBucket(self.chat_rate, self.chat_burst, now)
+                    self._buckets[chat_id] = bucket
+
+                wait = max(bucket.wait(now), self._global.wait(now))
+                if wait > 0:
+                    heapq.heapreplace(self._ready,
+                                      (now + wait, next(self._seq), chat_id))
+                    continue
+
+                heapq.heappop(self._ready)
+                bucket.take()
+                self._global.take()
+
+                (message, stamps) = merge_texts(self._chats[chat_id])
+                self._pool.submit(self._deliver, chat_id, message, stamps)
+
+    def _deliver(self, chat_id, message, stamps):
+        """Sends a message, in a sender thread, and schedules the chat's next
+        one.
+        """
+
+        start = monotonic()
+        retry_after = None
+
+        try:
+            self._send(chat_id, *message)
+            failed = False
+        except tg.error.RetryAfter as err:
+            retry_after = err.retry_after
+            failed = False
+        except Exception:  # pylint: disable=broad-except
+            logging.getLogger(__name__).exception("Sending to %s failed",
+                                                  chat_id)
+            failed = True
+
+        now = monotonic()
+
+        with self._cond:
+            if retry_after is not None:
+                # Send the same message again, after the flood wait.
+                self._chats[chat_id].appendleft(message + (stamps[0], ))
+                self._pending -= len(stamps) - 1
+                self._stats["retried"] += 1
+                heapq.heappush(self._ready, (now + retry_after,
+                                             next(self._seq), chat_id))
+                self._cond.notify_all()
+                return
+
+            stats = self._stats
+            stats["sent"] += 1
+            stats["messages"] += len(stamps)
+            stats["failed"] += len(stamps) if failed else 0
+            stats["send_total"] += now - start
+            stats["send_max"] = max(stats["send_max"], now - start)
+            stats["latency_total"] += sum(now - stamp for stamp in stamps)
+            stats["latency_max"] = max(stats["latency_max"], now - stamps[0])
+
+            self._pending -= len(stamps)
+
+            if self._chats[chat_id]:
+                heapq.heappush(self._ready, (now, next(self._seq), chat_id))
+            else:
+                del self._chats[chat_id]
+                self._active.discard(chat_id)
+
+            self._cond.notify_all()
+
+    def metrics(self):
+        """Reports the queue depth, the send latency (from put to sent) and
+        the duration of the API calls.
+
+        Returns:
+            dict: The metrics.
+        """
+
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = self._pending
+            stats["chats_waiting"] = len(self._chats)
+
+        stats["merged"] = stats["messages"] - stats["sent"]
+        stats["latency_avg"] = stats["latency_total"] / stats["messages"] \
+                               if stats["messages"] else 0
+        stats["send_avg"] = stats["send_total"] / stats["sent"] \
+                            if stats["sent"] else 0
+
+        return stats
+
+    def stop(self, timeout=10.0):
+        """Sends the waiting messages, for at most timeout seconds, and stops
+        the senders.
+
+        Args:
+            timeout (float, optional): How long (seconds) to wait. Defaults
+                                       to 10.
+        """
+
+        deadline = monotonic() + timeout
+
+        with self._cond:
+            while self._pending and monotonic() < deadline:
+                self._cond.wait(deadline - monotonic())
+
+            self._running = False
+            self._cond.notify_all()
+
+        self._scheduler.join()
+        self._pool.shutdown(wait=False)
+
+class QueuedBot(tg.Bot):
+    """A bot whose text messages and photos (sent by URL or file_id, without
+    other options) go through a SendQueue. send_message and send_photo return
+    None for them, instead of the sent message. The queued photos are sent by
+    file_id once uploaded, if the bot has a media cache.
+    """
+
+    def __init__(self, token, send_options=None, media_cache=None, **kwargs):
+        """
+        Args:
+            token (str): The bot's token.
+            send_options (dict, optional): The SendQueue's arguments. Defaults
+                                           to None.
+            media_cache (media_cache.MediaCache, optional): The file_ids of
+                                                            the uploaded
+                                                            photos. Defaults
+                                                            to None.
+            **kwargs: telegram.Bot's arguments.
+        """
+
+        super().__init__(token, **kwargs)
+        self.media_cache = media_cache
+        self.send_queue = SendQueue(self._send_now, **(send_options or {}))
+
+    def _send_now(self, chat_id, kind, payload, parse_mode):
+        """Sends a message of the queue."""
+
+        if kind == "photo":
+            if self.media_cache is None:
+                super().send_photo(chat_id, payload)
+            else:
+                self.media_cache.send_photo(super().send_photo, chat_id,
+                                            payload)
+        else:
+            super().send_message(chat_id, payload, parse_mode=parse_mode)
+
+    # pylint: disable=arguments-differ
+    def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        """Queues a text message, sends it now if it has other options."""
+
+        if any(kwargs.values()):
+            return super().send_message(chat_id, text, parse_mode=parse_mode,
+                                        **kwargs)
+
+        self.send_queue.put(chat_id, "text", text, parse_mode or None)
+
+        return None
+
+    def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        """Queues a photo, sends it now if it is a file or has options."""
+
+        if caption or any(kwargs.values()) or not isinstance(photo, str):
+            return super().send_photo(chat_id, photo, caption=caption,
+                                      **kwargs)
+
+        self.send_queue.put(chat_id, "photo", photo)
+
+        return None
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The per-user dispatch of the Telegram updates
+
+The updates of different users are handled in parallel, but the updates of
+one user are handled one at a time, in the order they were received, so two
+quick messages of a user cannot both advance the user's step. Every user is
+assigned to one of a fixed number of shards, each having a worker thread and
+a bounded queue, so the memory used does not grow with the number of users.
+
+Running this module is a load test: simulated users send messages which take
+a fixed time to handle, the throughput is measured for several numbers of
+workers and the per-user order is checked, e.g.:
+    python user_dispatcher.py --users 200 --messages 5 --latency 0.02
+The order and the concurrency are tested, from the repository's root, with:
+    python -m pytest tests/test_user_dispatcher.py
+"""
+
+import json
+import queue
+import threading
+import warnings
+
+from argparse import ArgumentParser
+from time import monotonic, sleep, time
+
+import telegram as tg
+import telegram.ext as tge
+
+class ShardedExecutor:
+    """Runs functions in worker threads, the functions submitted with the same
+    key being run in order, by the same worker.
+    """
+
+    def __init__(self, shards, queue_size=100, name="shard"):
+        """
+        Args:
+            shards (int): The number of worker threads.
+            queue_size (int, optional): The maximum number of functions
+                                        waiting for a worker; submit waits
+                                        while its worker's queue is full.
+                                        Defaults to 100.
+            name (str, optional): The prefix of the threads' names. Defaults
+                                  to "shard".
+        """
+
+        self._queues = [queue.Queue(queue_size) for _ in range(shards)]
+        self._threads = [threading.Thread(target=self._run, args=(tasks,),
+                                          name=f"{name}-{shard}",
+                                          daemon=True)
+                         for (shard, tasks) in enumerate(self._queues)]
+
+        for thread in self._threads:
+            thread.start()
+
+    @staticmethod
+    def _run(tasks):
+        """The worker loop: run the functions until the stop marker (None)."""
+
+        while True:
+            task = tasks.get()
+
+            try:
+                if task is None:
+                    return
+
+                (func, func_args) = task
+                func(*func_args)
+            finally:
+                tasks.task_done()
+
+    def submit(self, key, func, *func_args):
+        """Queues a function, after the ones submitted with the same key.
+
+        Args:
+            key (int): The key, e.g. a user's id.
+            func (function): The function, its exceptions are not caught.
+            *func_args: The function's arguments.
+        """
+
+        self._queues[hash(key) % len(self._queues)].put((func, func_args))
+
+    def join(self):
+        """Waits until every submitted function was run."""
+
+        for tasks in self._queues:
+            tasks.join()
+
+    def stop(self):
+        """Stops the workers, after they run the submitted functions."""
+
+        for tasks in self._queues:
+            tasks.put(None)
+
+        for thread in self._threads:
+            thread.join()
+
+def update_key(update):
+    """
+    Returns:
+        int: The id of the user (or chat) who sent an update, 0 if none.
+    """
+
+    if isinstance(update, tg.Update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+
+    return 0
+
+class UserDispatcher(tge.Dispatcher):
+    """A dispatcher which runs the run_async handlers of every user's updates
+    in order, on the user's shard. The dispatcher's thread waits while the
+    shard's queue is full, so the updates wait in the update queue.
+    """
+
+    def __init__(self, bot, update_queue, workers, job_queue, queue_size=100):
+        """
+        Args:
+            bot (telegram.Bot): The bot.
+            update_queue (queue.Queue): The received updates.
+            workers (int): The number of shards (worker threads).
+            job_queue (telegram.ext.JobQueue): The job queue.
+            queue_size (int, optional): The maximum number of updates waiting
+                                        in a shard. Defaults to 100.
+        """
+
+        # The handlers do not run in the dispatcher's own workers, the warning
+        # about not having any is wrong.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            super().__init__(bot, update_queue, workers=0,
+                             job_queue=job_queue)
+        self.shards = ShardedExecutor(workers, queue_size, name="user-shard")
+
+    def run_async(self, func, *func_args, update=None, **func_kwargs):
+        """Runs a handler on the shard of the update's user. Its errors are
+        sent to the error handlers.
+        """
+
+        def run():
+            try:
+                func(*func_args, **func_kwargs)
+            except Exception as err:  # pylint: disable=broad-except
+                try:
+                    self.dispatch_error(update, err)
+                except Exception:  # pylint: disable=broad-except
+                    self.logger.exception("An error handler raised an error")
+
+        self.shards.submit(update_key(update), run)
+
+    def stop(self):
+        """Stops the dispatcher and its shards."""
+
+        super().stop()
+        self.shards.stop()
+
+def make_updates(bot, users, messages):
+    """
+    Returns:
+        list: The messages of the users, numbered from 0 in every user's
+              order, the users taking turns.
+    """
+
+    updates = []
+    for seq in range(messages):
+        for user_id in range(1, users + 1):
+            user = {"id": user_id, "is_bot": False, "first_name": "User"}
+            updates.append(tg.Update.de_json({
+                "update_id": len(updates) + 1,
+                "message": {"message_id": seq, "date": int(time()),
+                            "from": user,
+                            "chat": {"id": user_id, "type": "private"},
+                            "text": str(seq)}
+            }, bot))
+
+    return updates
+
+def load_test(workers, users, messages, latency):
+    """
+    Handle the messages of several users, every message taking latency
+    seconds, and check that every user's messages were handled in order, one
+    at a time.
+
+    Returns:
+        dict: The throughput (messages per second) and the order violations.
+    """
+
+    bot = tg.Bot("123:load-test")
+    dispatcher = UserDispatcher(bot, queue.Queue(), workers, None,
+                                queue_size=users * messages)
+
+    handled = {}
+    busy = set()
+    violations = []
+    lock = threading.Lock()
+
+    def handler(update, _):
+        (user_id, seq) = (update.effective_user.id, int(update.message.text))
+
+        with lock:
+            if user_id in busy or handled.get(user_id, -1) != seq - 1:
+                violations.append((user_id, seq))
+            busy.add(user_id)
+
+        # The call to math_bot.
+        sleep(latency)
+
+        with lock:
+            busy.discard(user_id)
+            handled[user_id] = seq
+
+    dispatcher.add_handler(tge.MessageHandler(tge.Filters.text, handler,
+                                              run_async=True))
+
+    updates = make_updates(bot, users, messages)
+
+    start = monotonic()
+    for update in updates:
+        dispatcher.process_update(update)
+    dispatcher.shards.join()
+    seconds = monotonic() - start
+    dispatcher.shards.stop()
+
+    return {"workers": workers, "messages": len(updates),
+            "seconds": round(seconds, 3),
+            "throughput": round(len(updates) / seconds, 1),
+            "order_violations": len(violations)}
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Load test the per-user dispatcher.")
+    parser.add_argument("--users", type=int, default=200,
+                        help="the number of users (default: 200)")
+    parser.add_argument("--messages", type=int, default=5,
+                        help="the messages of every user (default: 5)")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="the time (seconds) to handle a message "
+                             "(default: 0.02)")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=[1, 2, 4, 8, 16, 32],
+                        help="the numbers of workers to test")
+    args = parser.parse_args()
+
+    for num_workers in args.workers:
+        print(json.dumps(load_test(num_workers, args.users, args.messages,
+                                   args.latency)))
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The log of the graded answers, used for retraining
+
+The graded answers are queued by the request handlers and written by a
+background thread, in batches, as CSV rows (message, reference, prediction
+and, optionally, the similarity), the fields being quoted and escaped by the
+csv module. The log is appended to, so restarting keeps it. When it grows past
+a size or gets older than a period, it is renamed with the time of the
+rotation and compressed with gzip, and a new log is started. A log is written
+by a single process: when several processes grade answers (e.g. gunicorn's
+workers), every one writes its own log, named with its pid.
+"""
+
+import csv
+import gzip
+import io
+import logging
+import os
+import queue
+import shutil
+import threading
+
+from time import monotonic, strftime
+
+# The columns of the log, the similarity being optional.
+COLUMNS = ["message", "reference", "prediction"]
+SIMILARITY_COLUMN = "similarity"
+
+class AnswerLogger:
+    # pylint: disable=too-many-instance-attributes
+    """Writes the graded answers to a rotating CSV file, from a background
+    thread. Every process writes its own log, if per_process is set.
+    """
+
+    def __init__(self, path, max_bytes=64 * 2 ** 20, max_age=86400.0,
+                 similarity=False, batch_size=256, flush_interval=1.0,
+                 max_pending=100000, per_process=False):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        """
+        Args:
+            path (str): The log file, e.g. /tmp/logs/user_input.csv.
+            max_bytes (int, optional): The size after which the log is
+                                       rotated, 0 for none. Defaults to 64 MB.
+            max_age (float, optional): The time (seconds) after which the log
+                                       is rotated, 0 for none. Defaults to one
+                                       day.
+            similarity (bool, optional): If the similarity is logged, too.
+                                         Defaults to False.
+            batch_size (int, optional): The maximum number of answers written
+                                        at once. Defaults to 256.
+            flush_interval (float, optional): How long (seconds) the writer
+                                              waits for answers before
+                                              checking the rotation again.
+                                              Defaults to 1.
+            max_pending (int, optional): The maximum number of waiting
+                                         answers, the next ones are dropped.
+                                         Defaults to 100000.
+            per_process (bool, optional): If the pid of the process writing
+                                          the log is added to its name (e.g.
+                                          user_input-<pid>.csv), so several
+                                          processes can log to the same
+                                          directory. Defaults to False.
+        """
+
+        self.path = path
+        self.per_process = per_process
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.columns = COLUMNS + ([SIMILARITY_COLUMN] if similarity else [])
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue(max_pending)
+        # The log written, named by the writer thread.
+        self._path = path
+        self._file = None
+        self._writer = None
+        self._opened = None
+        self._lock = threading.Lock()
+        self._stats = {"written": 0, "dropped": 0, "rotations": 0,
+                       "errors": 0}
+
+        # Started by the first answer, so a forked process (e.g. a gunicorn
+        # worker) starts its own writer.
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        """Starts the writer thread, if it is not running."""
+
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name="answer-logger",
+                                                daemon=True)
+                self._thread.start()
+
+    def log(self, message, reference, prediction, similarity=None):
+        """Queues a graded answer, without waiting.
+
+        Args:
+            message (str): The user's answer.
+            reference (str): The reference answer.
+            prediction (bool): If the answer was accepted.
+            similarity (float, optional): The answer's similarity to the
+                                          reference. Defaults to None.
+        Returns:
+            bool: False if the answer was dropped, the queue being full.
+        """
+
+        row = [message, reference, int(prediction)]
+        if len(self.columns) > len(COLUMNS):
+            row.append("" if similarity is None else f"{similarity:.6f}")
+
+        self._start()
+
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+            return False
+
+        return True
+
+    def _open(self):
+        """Opens the log for appending, writing the header to a new one."""
+
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # The log stays open between the batches.
+        # pylint: disable=consider-using-with
+        self._file = open(self._path, "a", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._opened = monotonic()
+
+        if self._file.tell() == 0:
+            self._writer.writerow(self.columns)
+
+    def _same_columns(self):
+        """
+        Returns:
+            bool: True if the existing log has the same columns, e.g. it was
+                  not written without the similarity.
+        """
+
+        try:
+            with open(self._path, "r", newline="", encoding="utf-8") as fin:
+                header = next(csv.reader(fin), self.columns)
+        except FileNotFoundError:
+            return True
+
+        return header == self.columns
+
+    def _should_rotate(self):
+        """
+        Returns:
+            bool: True if the log has answers and is too large or too old.
+        """
+
+        size = self._file.tell()
+        if size <= len(",".join(self.columns)) + 2:
+            # Only the header.
+            return False
+
+        return (self.max_bytes and size >= self.max_bytes) or \
+               (self.max_age and monotonic() - self._opened >= self.max_age)
+
+    def _rotate(self):
+        """Renames the log with the current time, compresses it and starts a
+        new one.
+        """
+
+        self._file.close()
+
+        (root, ext) = os.path.splitext(self._path)
+        rotated = f"{root}-{strftime('%Y%m%d-%H%M%S')}{ext}"
+        suffix = 1
+        while os.path.exists(rotated) or os.path.exists(f"{rotated}.gz"):
+            rotated = f"{root}-{strftime('%Y%m%d-%H%M%S')}-{suffix}{ext}"
+            suffix += 1
+
+        os.replace(self._path, rotated)
+        self._open()
+
+        with open(rotated, "rb") as fin, \
+             gzip.open(f"{rotated}.gz", "wb") as fout:
+            shutil.copyfileobj(fin, fout, io.DEFAULT_BUFFER_SIZE * 16)
+        os.remove(rotated)
+
+        with self._lock:
+            self._stats["rotations"] += 1
+
+    def _write(self, rows):
+        """Writes a batch of answers, rotating the log first if needed."""
+
+        try:
+            if self._file is None:
+                self._open()
+                if not self._same_columns():
+                    self._rotate()
+            elif self._should_rotate():
+                self._rotate()
+
+            if rows:
+                self._writer.writerows(rows)
+                self._file.flush()
+        except (OSError, ValueError):
+            logging.getLogger(__name__).exception("Cannot write %s",
+                                                  self._path)
+            with self._lock:
+                self._stats["errors"] += 1
+
+            # The log is opened again for the next answers.
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            return
+
+        with self._lock:
+            self._stats["written"] += len(rows)
+
+    def _run(self):
+        """Writes the queued answers, in batches, until None is queued."""
+
+        if self.per_process:
+            # The writer runs in the process logging the answers, e.g. a
+            # forked worker.
+            (root, ext) = os.path.splitext(self.path)
+            self._path = f"{root}-{os.getpid()}{ext}"
+
+        running = True
+
+        while running:
+            rows = []
+            try:
+                row = self._queue.get(timeout=self.flush_interval)
+                while row is not None:
+                    rows.append(row)
+                    if len(rows) >= self.batch_size:
+                        break
+                    row = self._queue.get_nowait()
+                running = row is not None
+            except queue.Empty:
+                pass
+
+            self._write(rows)
+
+        if self._file is not None:
+            self._file.close()
+
+    def metrics(self):
+        """
+        Returns:
+            dict: The written and dropped answers, the rotations, the write
+                  errors and the waiting answers.
+        """
+
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+
+        return stats
+
+    def close(self, timeout=10.0):
+        """Writes the waiting answers and stops the writer.
+
+        Args:
+            timeout (float, optional): How long (seconds) to wait. Defaults
+                                       to 10.
+        """
+
+        if self._thread is None or not self._thread.is_alive():
+            return
+
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+def answer_logger_from_env():
+    """Creates the answer logger configured by ANSWER_LOG_FILE,
+    ANSWER_LOG_MAX_MB, ANSWER_LOG_ROTATE_HOURS and ANSWER_LOG_SIMILARITY. With
+    more than one worker (WEB_WORKERS), every worker writes its own log.
+
+    Returns:
+        AnswerLogger: The logger.
+    """
+
+    return AnswerLogger(
+        os.getenv("ANSWER_LOG_FILE", "/tmp/logs/user_input.csv"),
+        max_bytes=int(float(os.getenv("ANSWER_LOG_MAX_MB", "64")) * 2 ** 20),
+        max_age=float(os.getenv("ANSWER_LOG_ROTATE_HOURS", "24")) * 3600,
+        similarity=os.getenv("ANSWER_LOG_SIMILARITY", "0") == "1",
+        per_process=int(os.getenv("WEB_WORKERS", "1")) > 1
+    )
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The logic shared by the central applications
+
+math_bot.py (Flask) and math_bot_async.py (aiohttp) serve the same routes,
+with the same responses. The model grading the answers, the configuration and
+the decisions taken on the database adapter's replies are kept here, the
+applications only make the calls and build the responses.
+"""
+
+import atexit
+import logging
+import json
+import os
+import sys
+
+from threading import Event, Thread
+from time import localtime, monotonic
+
+from answer_logger import answer_logger_from_env
+from model import EmbeddingStore, InferenceQueue, data_loader, warm_up
+from model.nltk_resources import missing_resources
+
+# The minimum similarity of a correct answer to its reference
+COMPARE_THRESHOLD = 0.6
+
+# The state of a user who is not enrolled in an activity
+UNENROLLED = {"user_step" : 0, "course_id" : None, "user_test_started" : False}
+
+def setup_logging(name, debug):
+    """
+    Configure the logging of a central application.
+
+    Args:
+        name (str): The logger's name.
+        debug (bool): If additional debug output should be shown.
+    Returns:
+        logging.Logger: The logger.
+    """
+
+    logging.basicConfig(format="[%(levelname)s] %(asctime)s - %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S")
+    logging.Formatter.converter = localtime
+    logging.StreamHandler(sys.stdout)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG if debug else logging.WARNING)
+
+    logger.info("The central component started!")
+
+    return logger
+
+def db_adapter_host():
+    """
+    Returns:
+        str: The URL of the database adapter.
+    """
+
+    return f"http://database_adapter:{os.getenv('DB_ADAPT_PORT', '5000')}"
+
+def listen_address():
+    """
+    Returns:
+        tuple: The address (str) and the port (int) to serve on.
+    """
+
+    return (os.getenv("MATH_BOT_ADDR", "0.0.0.0"),
+            int(os.getenv("MATH_BOT_PORT", "5001")))
+
+class Grader:
+    # pylint: disable=too-many-instance-attributes
+    """The model grading the answers, with the reference answers' vectors,
+    the inference queue and the log of the graded answers.
+    """
+
+    def __init__(self, logger, started):
+        """
+        Args:
+            logger (logging.Logger): The application's logger.
+            started (float): The monotonic time the application started at.
+        """
+
+        self.logger = logger
+        self.started = started
+
+        # Longer answers are truncated or, with LONG_SENTENCE_POLICY=reject,
+        # rejected.
+        self.max_len = int(os.getenv("MAX_SENTENCE_LEN", "64"))
+        self.max_batch = int(os.getenv("INFER_MAX_BATCH", "32"))
+
+        (self.vocab, self.model) = data_loader(
+            "model/data/en_vocab.txt", "model/trax_model/model.pkl.gz",
+            os.getenv("MODEL_ENGINE", "trax"))
+
+        # The reference answers' vectors, computed by prepare.
+        self.store = EmbeddingStore(self.model, self.vocab, self.max_len)
+
+        # Concurrent answers are graded together, in micro-batches.
+        self.queue = InferenceQueue(
+            self.model, self.vocab,
+            window=float(os.getenv("INFER_BATCH_WINDOW_MS", "5")) / 1000,
+            max_batch=self.max_batch,
+            max_len=self.max_len,
+            truncate=os.getenv("LONG_SENTENCE_POLICY",
+                               "truncate") != "reject",
+            store=self.store
+        )
+
+        # The user responses to be used for retraining the model, written in
+        # the background to a rotating log.
+        self.answer_logger = answer_logger_from_env()
+        atexit.register(self.answer_logger.close)
+
+        # Set once the model is warmed up, in the process serving the
+        # requests.
+        self.ready = Event()
+
+    def prepare(self):
+        """
+        Embed the reference answers and compile the model for every input
+        shape an answer can be graded at, then mark the application as ready.
+        """
+
+        prepare_start = monotonic()
+        data_file = os.getenv("DATA_FILE", "courses.json")
+        try:
+            self.store.refresh_from_file(data_file)
+            self.logger.info("%d reference answers embedded", len(self.store))
+        except (OSError, json.decoder.JSONDecodeError, KeyError):
+            self.logger.warning("Reading data file failed! References will be "
+                                "embedded on their first use.")
+
+        # An answer is padded to the length it shares with its reference, and
+        # the references are not truncated.
+        max_len = max(self.max_len, self.store.max_length())
+        num_shapes = warm_up(self.model, max_len, self.max_batch,
+                             self.vocab["<PAD>"])
+        self.logger.info("Model warmed up on %d shapes in %.2fs", num_shapes,
+                         monotonic() - prepare_start)
+
+        self.ready.set()
+        self.logger.info("Ready in %.2fs", monotonic() - self.started)
+
+    def start_preparing(self):
+        """
+        Start prepare in the background, /api/ready and /api/message answering
+        503 until it is done. It runs in every process serving the requests
+        (e.g. after gunicorn forks a worker).
+        """
+
+        Thread(target=self.prepare, name="prepare-model", daemon=True).start()
+
+    def submit(self, msg, ref):
+        """
+        Queue an answer to be compared to its reference.
+
+        Raises:
+            InputTooLong: If the answer is too long and it is not truncated.
+        Returns:
+            concurrent.futures.Future: The cosine similarity of the answer and
+                                       the reference.
+        """
+
+        return self.queue.submit(msg, ref)
+
+    def record(self, msg, ref, sim):
+        """
+        Decide if an answer is correct and log it.
+
+        Returns:
+            bool: If the answer's similarity to the reference is high enough.
+        """
+
+        result = sim > COMPARE_THRESHOLD
+        self.answer_logger.log(msg, ref, result, sim)
+
+        return result
+
+    def grade(self, msg, ref):
+        """
+        Compare an answer to its reference, waiting for the inference queue.
+
+        Raises:
+            InputTooLong: If the answer is too long and it is not truncated.
+        Returns:
+            bool: If the answer is correct.
+        """
+
+        return self.record(msg, ref, self.queue.similarity(msg, ref))
+
+def load_grader(logger, started):
+    """
+    Load the model, exiting if the NLTK resources are missing.
+
+    Args:
+        logger (logging.Logger): The application's logger.
+        started (float): The monotonic time the application started at.
+    Returns:
+        Grader: The grader, not prepared yet.
+    """
+
+    # The NLTK resources are installed with the image and loaded on their
+    # first use, they are never downloaded here.
+    missing = missing_resources()
+    if missing:
+        logger.error("Missing NLTK resources: %s. Install them with "
+                     "python -m model.nltk_resources download",
+                     ", ".join(missing))
+        sys.exit(1)
+
+    return Grader(logger, started)
+
+def first_row(req):
+    """
+    Read the first row of a reply of the database adapter.
+
+    Args:
+        req: The reply.
+    Returns:
+        dict: The row, None if the reply is not a list of rows.
+    """
+
+    try:
+        return req.json()[0]
+    except (json.decoder.JSONDecodeError, TypeError, IndexError, KeyError):
+        return None
+
+def user_query(user_id, fields=None):
+    """
+    Args:
+        user_id (int): The user's id.
+        fields (list, optional): The wanted fields. Defaults to None (all).
+    Returns:
+        dict: The body of the request retrieving a user (GET /api/user).
+    """
+
+    query_payload = {"user_id" : user_id}
+    if fields is not None:
+        query_payload["fields"] = fields
+
+    return query_payload
+
+def user_reply(req):
+    """
+    Read the reply retrieving a user.
+
+    Returns:
+        tuple: The status code of the call (int) and the user (dict), None if
+               the call failed.
+    """
+
+    if req.status_code != 200:
+        return (req.status_code, None)
+
+    user = first_row(req)
+    if user is None:
+        return (500, None)
+
+    return (200, user)
+
+def user_step_fields(user):
+    """
+    Raises:
+        KeyError, TypeError: If the user does not have the fields.
+    Returns:
+        tuple: The user's step, course id and if the user's test started.
+    """
+
+    return (user["user_step"], user["course_id"], user["user_test_started"])
+
+def is_mid_question(user_step, num_course_steps):
+    """
+    Returns:
+        bool: If a course's step is its mid-course question.
+    """
+
+    return user_step == (num_course_steps // 2 + 1)
+
+def max_step_path(course_id, user_test_started):
+    """
+    Returns:
+        str: The database adapter's path of the last step of the user's
+             activity (the course or its test).
+    """
+
+    if user_test_started:
+        return f"/api/test_steps/max/{course_id}"
+
+    return f"/api/course_steps/max/{course_id}"
+
+def next_step_update(user_id, user_step, user_test_started, max_step):
+    """
+    Decide how a user advances from a step of the user's activity.
+
+    Args:
+        user_id (int): The user's id.
+        user_step (int): The user's current step.
+        user_test_started (bool): If the activity is the test.
+        max_step (int): The last step of the activity.
+    Returns:
+        tuple: The user's new fields (dict, the body of PUT /api/user) and the
+               reply ("test_finished" / "test_started", "" if none).
+    """
+
+    if user_step < max_step:
+        return ({"user_id" : user_id, "user_step" : user_step + 1}, "")
+
+    if user_test_started:
+        # The user finished the test, unenroll the user.
+        return ({"user_id" : user_id, **UNENROLLED}, "test_finished")
+
+    # The user finished the course, start the user's test.
+    return ({"user_id" : user_id, "user_step" : 1, "user_test_started" : True},
+            "test_started")
+
+def enroll_update(user_id, course_id):
+    """
+    Returns:
+        dict: The fields of a user starting a course (the body of PUT
+              /api/user).
+    """
+
+    return {"user_id" : user_id, "user_step" : 1, "course_id" : course_id,
+            "user_test_started" : False}
+
+def cancel_update(user_id, user):
+    """
+    Decide how a user's activity is canceled.
+
+    Args:
+        user_id (int): The user's id.
+        user (dict): The user's course_id and user_test_started.
+    Raises:
+        KeyError, TypeError: If the user does not have the fields.
+    Returns:
+        tuple: The user's new fields (dict, the body of PUT /api/user) and the
+               canceled activity ("test" / "course", "" if none).
+    """
+
+    if user["user_test_started"]:
+        reply = "test"
+    elif user["course_id"] is not None:
+        reply = "course"
+    else:
+        # The user was not enrolled.
+        reply = ""
+
+    return ({"user_id" : user_id, **UNENROLLED}, reply)
+
+def test_question(test_step):
+    """
+    Raises:
+        KeyError, TypeError: If the test step does not have the fields.
+    Returns:
+        tuple: The id and the text of a test step's question.
+    """
+
+    return (test_step["test_step_id"], test_step["test_step_text"])
+
+def lesson_payload(course_step):
+    """
+    Raises:
+        KeyError, TypeError: If the lesson does not have the fields.
+    Returns:
+        dict: The body of the reply of a lesson.
+    """
+
+    payload = {"course_step_text" : course_step["course_step_text"]}
+    if course_step["course_step_url"] is not None:
+        payload["course_step_url"] = course_step["course_step_url"]
+
+    return payload
+
+def advance_payload(step):
+    """
+    Build the reply of the step a user advanced to (see advance_msg).
+
+    Args:
+        step (dict): The step, as given by the database adapter.
+    Raises:
+        KeyError, TypeError: If the step does not have the fields.
+    Returns:
+        tuple: The body of the reply (dict) and the question the user has to
+               answer ([test_step_id, course_id], None if none).
+    """
+
+    payload = {"event": step["event"]}
+    answer = None
+
+    if step["event"] != "test_finished":
+        payload["category"] = step["category"]
+
+        if step["category"] == "test":
+            payload["text"] = step["test_step_text"]
+            answer = [step["test_step_id"], step["course_id"]]
+        elif step["category"] == "mid":
+            payload["text"] = step["mid_question_text"]
+            answer = [0, step["course_id"]]
+        else:
+            payload["text"] = step["course_step_text"]
+            if step["course_step_url"] is not None:
+                payload["url"] = step["course_step_url"]
+
+    return (payload, answer)
+
+def reference_query(test_step_id, course_id):
+    """
+    Args:
+        test_step_id (int): The test step's id, 0 for the mid-course question.
+        course_id (int): The course's id.
+    Returns:
+        tuple: The database adapter's path of a question and the field of its
+               reference answer.
+    """
+
+    if test_step_id == 0:
+        return (f"/api/mid_questions/{course_id}", "mid_question_ans")
+
+    return (f"/api/test_steps/{test_step_id}", "test_step_ans")
+
+def reference_answer(req, field):
+    """
+    Returns:
+        str: The reference answer of a question's reply, None if the call
+             failed.
+    """
+
+    if req.status_code != 200:
+        return None
+
+    try:
+        return first_row(req)[field]
+    except (KeyError, TypeError):
+        return None
+
+def confirms_quit(msg):
+    """
+    Returns:
+        bool: If a message confirms the user's quit command.
+    """
+
+    return msg[0].lower() == "y"
@@ -10,40 +10,56 @@ Computer Engeneering Department
 Math Bot (C) 2021 - Database adapter and initializer
 """
 
-import logging
 import json
 import os
-import sys
 
 from argparse  import ArgumentParser
-from time import localtime
+from time import monotonic
 from flask import Flask, Response, request
 
-import jsonschema
-import requests
-
-from model import data_loader, predict
+from central import advance_payload, cancel_update, confirms_quit, \
+                    db_adapter_host, enroll_update, first_row, \
+                    is_mid_question, lesson_payload, listen_address, \
+                    load_grader, max_step_path, next_step_update, \
+                    reference_answer, reference_query, setup_logging, \
+                    test_question, user_query, user_reply, user_step_fields
+from model import InputTooLong
+from session_store import SessionStoreError, session_store_from_env
+from common.http_client import client_from_env
+from common.response_cache import ResponseCache
+from common.serving import serve
+from common.validation import COURSE_SCHEMA, ENROLL_SCHEMA, MESSAGE_SCHEMA, \
+                              REGISTER_SCHEMA, validate_json
 
 # The Flask server's object
 app = Flask(__name__)
 
-def validate_json(json_data, json_schema):
+@app.errorhandler(SessionStoreError)
+def session_store_error(_err):
     """
-    Check if a JSON object follow a schema or not.
+    Answer the requests whose conversation state could not be read or saved,
+    e.g. while the database adapter is down.
 
-    Args:
-        json_data (dict): The input JSON obect.
-        json_schema (dict): The wanted JSON schema.
     Returns:
-        bool: True if the object is correct, False otherwise.
+        Response: - 503.
     """
 
-    try:
-        jsonschema.validate(instance=json_data, schema=json_schema)
-    except jsonschema.exceptions.ValidationError:
-        return False
+    return Response(status=503)
+
+def get_user(user_id, fields=None):
+    """
+    Retrieve a user from the database adapter.
 
-    return True
+    Args:
+        user_id (int): The user's id.
+        fields (list, optional): The wanted fields. Defaults to None (all).
+    Returns:
+        tuple: The status code of the call (int) and the user (dict), None if
+               the call failed.
+    """
+
+    return user_reply(DB_ADAPT.get("/api/user",
+                                   json=user_query(user_id, fields)))
 
 @app.route("/api/register", methods=["POST"])
 def register_msg():
@@ -58,18 +74,9 @@ def register_msg():
                   - 409 if the user already exists.
     """
 
-    body_schema = {
-        "type": "object",
-        "properties": {
-            "user_id": {"type": "number"},
-            "user_name": {"type": "string"}
-        },
-        "required": ["user_id", "user_name"]
-    }
-
     payload = request.get_json(silent=True)
 
-    is_valid = validate_json(payload, body_schema)
+    is_valid = validate_json(payload, REGISTER_SCHEMA)
     if not is_valid:
         return Response(
             status=400,
@@ -77,7 +84,7 @@ def register_msg():
             mimetype="text/plain"
         )
 
-    req = requests.post(f"{DB_ADAPT_HOST}/api/user", json=payload)
+    req = DB_ADAPT.post("/api/user", json=payload)
 
     return Response(
         status=req.status_code,
@@ -88,20 +95,37 @@ def register_msg():
 @app.route("/api/courses", methods=["GET"])
 def courses_msg():
     """
-    Retrieve the available courses.
+    Retrieve the available courses. The list is cached for COURSES_CACHE_TTL
+    seconds, then revalidated with the database adapter.
 
     Returns:
         Response: - 200 in case of success and the list of courses in the body.
+                  - 304 if the client's copy is up to date.
     """
 
-    req = requests.get(f"{DB_ADAPT_HOST}/api/courses")
+    (entry, fresh) = COURSES_CACHE.lookup("courses")
 
-    return Response(
-        status=req.status_code,
-        response=req.text,
-        mimetype="application/json"
+    if not fresh:
+        req = DB_ADAPT.get("/api/courses",
+                           headers=COURSES_CACHE.request_headers("courses"))
+
+        entry = COURSES_CACHE.update("courses", entry, req)
+        if entry is None:
+            return Response(
+                status=req.status_code,
+                response=req.text,
+                mimetype="application/json"
+            )
+
+    response = Response(
+        status=200,
+        response=entry.value,
+        mimetype="application/json",
+        headers=entry.headers()
     )
 
+    return response.make_conditional(request)
+
 @app.route("/api/enroll", methods=["POST"])
 def enroll_msg():
     """
@@ -117,31 +141,9 @@ def enroll_msg():
                   - 500 if there was an internal error.
     """
 
-    body_schema = {
-        "type": "object",
-        "properties": {
-            "user_id": {"type": "number"},
-            "course_name": {"type": "string"}
-        },
-        "required": ["user_id", "course_name"]
-    }
-
-    course_schema = {
-        "type": "object",
-        "properties": {
-            "course_id": {"type": "number"},
-            "course_name": {"type": "string"},
-            "course_description": {"type": "string"},
-            "course_num_steps": {"type": "number"},
-            "course_num_questions": {"type": "number"}
-        },
-        "required": ["course_id", "course_name", "course_description",
-                     "course_num_steps", "course_num_questions"]
-    }
-
     payload = request.get_json(silent=True)
 
-    is_valid = validate_json(payload, body_schema)
+    is_valid = validate_json(payload, ENROLL_SCHEMA)
     if not is_valid:
         return Response(status=400)
 
@@ -150,7 +152,7 @@ def enroll_msg():
 
     # Get the course id, given the name.
     query_payload = {"course_name" : new_course_name}
-    req = requests.get(f"{DB_ADAPT_HOST}/api/course", json=query_payload)
+    req = DB_ADAPT.get("/api/course", json=query_payload)
 
     if req.status_code == 404:
         return Response(
@@ -159,50 +161,36 @@ def enroll_msg():
             mimetype="text/plain"
         )
 
-    try:
-        new_course = req.json()[0]
-        is_valid = validate_json(new_course, course_schema)
-        if not is_valid:
-            return Response(status=500)
-
-        new_course_id = new_course["course_id"]
-    except (json.decoder.JSONDecodeError, TypeError):
+    new_course = first_row(req)
+    is_valid = validate_json(new_course, COURSE_SCHEMA)
+    if not is_valid:
         return Response(status=500)
 
     # Check if the user is enrolled and if the new course is actually the old
     # one.
-    query_payload = {"user_id" : user_id, "fields" : ["course_id"]}
-    req = requests.get(f"{DB_ADAPT_HOST}/api/user", json=query_payload)
+    (status, user) = get_user(user_id, ["course_id"])
 
-    if req.status_code == 404:
+    if status == 404:
         return Response(
             status=404,
             response="no_user",
             mimetype="text/plain"
         )
 
-    try:
-        user = req.json()[0]
-        curr_course_id = user["course_id"]
-    except (json.decoder.JSONDecodeError, TypeError):
+    if user is None or "course_id" not in user:
         return Response(status=500)
 
-    if new_course_id == curr_course_id:
+    if new_course["course_id"] == user["course_id"]:
         # The new course is actually the old one.
         return Response(status=200)
 
-    # Change the user's course, but first clear "wait response" for the user.
-    if user_id in WAIT_ANS:
-        del WAIT_ANS[user_id]
-
-    # Drop old user quit command.
-    if user_id in WAIT_CONF_DEL:
-        WAIT_CONF_DEL.remove(user_id)
+    # Change the user's course, but first clear "wait response" and the old
+    # quit command for the user.
+    SESSIONS.clear(user_id)
 
     # Update user data.
-    query_payload = {"user_id" : user_id, "user_step" : 1,
-                     "course_id" : new_course_id, "user_test_started" : False}
-    req = requests.put(f"{DB_ADAPT_HOST}/api/user", json=query_payload)
+    req = DB_ADAPT.put("/api/user",
+                       json=enroll_update(user_id, new_course["course_id"]))
 
     if req.status_code != 200:
         return Response(status=500)
@@ -226,22 +214,15 @@ def current_step(user_id=None):
                   - 500 if there was an internal error.
     """
 
-    query_payload = {"user_id" : user_id,
-                     "fields": ["user_step", "course_id", "user_test_started"]}
-    req = requests.get(f"{DB_ADAPT_HOST}/api/user", json=query_payload)
+    (status, user) = get_user(user_id, ["user_step", "course_id",
+                                        "user_test_started"])
 
-    if req.status_code == 404:
+    if status == 404:
         return Response(status=404)
 
-    if req.status_code != 200:
-        return Response(status=500)
-
     try:
-        user = req.json()[0]
-        user_step = user["user_step"]
-        course_id = user["course_id"]
-        user_test_started = user["user_test_started"]
-    except (json.decoder.JSONDecodeError, TypeError):
+        (user_step, course_id, user_test_started) = user_step_fields(user)
+    except (KeyError, TypeError):
         return Response(status=500)
 
     if user_step == 0 or course_id is None:
@@ -251,20 +232,18 @@ def current_step(user_id=None):
     if user_test_started:
         query_payload = {"test_step_inner_id" : user_step,
                          "course_id" : course_id}
-        req = requests.get(f"{DB_ADAPT_HOST}/api/test_steps",
+        req = DB_ADAPT.get("/api/test_steps",
                            json=query_payload)
         if req.status_code != 200:
             return Response(status=500)
 
         try:
-            test_step = req.json()[0]
-            test_step_text = test_step["test_step_text"]
-            test_step_id = test_step["test_step_id"]
-        except (json.decoder.JSONDecodeError, TypeError):
+            (test_step_id, test_step_text) = test_question(first_row(req))
+        except (KeyError, TypeError):
             return Response(status=500)
 
         # Mark "wait test response" for the user.
-        WAIT_ANS[user_id] = (test_step_id, course_id)
+        SESSIONS.set("answer", user_id, [test_step_id, course_id])
 
         return Response(
             status=205,
@@ -273,28 +252,27 @@ def current_step(user_id=None):
         )
 
     # If the current step is a mid question, send it, but first check that.
-    req = requests.get(f"{DB_ADAPT_HOST}/api/course_steps/max/{course_id}")
+    req = DB_ADAPT.get(f"/api/course_steps/max/{course_id}")
     if req.status_code != 200:
         return Response(status=500)
 
     try:
-        num_course_steps = req.json()[0]["max"]
-    except (json.decoder.JSONDecodeError, TypeError):
+        num_course_steps = first_row(req)["max"]
+    except (KeyError, TypeError):
         return Response(status=500)
 
-    if user_step == (num_course_steps // 2 + 1):
-        req = requests.get(f"{DB_ADAPT_HOST}/api/mid_questions/{course_id}")
+    if is_mid_question(user_step, num_course_steps):
+        req = DB_ADAPT.get(f"/api/mid_questions/{course_id}")
         if req.status_code != 200:
             return Response(status=500)
 
         try:
-            mid_question = req.json()[0]
-            mid_question_text = mid_question["mid_question_text"]
-        except (json.decoder.JSONDecodeError, TypeError):
+            mid_question_text = first_row(req)["mid_question_text"]
+        except (KeyError, TypeError):
             return Response(status=500)
 
         # Mark "wait mid question response" for the user.
-        WAIT_ANS[user_id] = (0, course_id)
+        SESSIONS.set("answer", user_id, [0, course_id])
 
         return Response(
             status=205,
@@ -305,21 +283,15 @@ def current_step(user_id=None):
     # If the current step is a lesson, send it.
     query_payload = {"course_step_inner_id" : user_step,
                      "course_id" : course_id}
-    req = requests.get(f"{DB_ADAPT_HOST}/api/course_steps", json=query_payload)
+    req = DB_ADAPT.get("/api/course_steps", json=query_payload)
     if req.status_code != 200:
         return Response(status=500)
 
     try:
-        course_step = req.json()[0]
-        course_step_text = course_step["course_step_text"]
-        course_step_url = course_step["course_step_url"]
-    except (json.decoder.JSONDecodeError, TypeError):
+        payload = lesson_payload(first_row(req))
+    except (KeyError, TypeError):
         return Response(status=500)
 
-    payload = {"course_step_text" : course_step_text}
-    if course_step_url is not None:
-        payload["course_step_url"] = course_step_url
-
     return Response(
         status=200,
         response=json.dumps(payload),
@@ -338,92 +310,95 @@ def next_msg(user_id=None):
                   - 500 if there was an internal error.
     """
 
-    # Clear "wait response" for the user.
-    if user_id in WAIT_ANS:
-        del WAIT_ANS[user_id]
+    # Clear "wait response" and the old quit command for the user.
+    SESSIONS.clear(user_id)
 
-    # Drop old user quit command.
-    if user_id in WAIT_CONF_DEL:
-        WAIT_CONF_DEL.remove(user_id)
+    (status, user) = get_user(user_id, ["user_step", "course_id",
+                                        "user_test_started"])
 
-    query_payload = {"user_id" : user_id,
-                     "fields": ["user_step", "course_id", "user_test_started"]}
-    req = requests.get(f"{DB_ADAPT_HOST}/api/user", json=query_payload)
-
-    if req.status_code == 404:
+    if status == 404:
         return Response(status=404)
 
-    if req.status_code != 200:
-        return Response(status=500)
-
     try:
-        user = req.json()[0]
-        user_step = user["user_step"]
-        course_id = user["course_id"]
-        user_test_started = user["user_test_started"]
-    except (json.decoder.JSONDecodeError, TypeError):
+        (user_step, course_id, user_test_started) = user_step_fields(user)
+    except (KeyError, TypeError):
         return Response(status=500)
 
     if user_step == 0 or course_id is None:
         return Response(status=403)
 
-    if user_test_started:
-        # Check if the user finished his test - if so, unenroll the user.
-        req = requests.get(f"{DB_ADAPT_HOST}/api/test_steps/max/{course_id}")
-        if req.status_code != 200:
-            return Response(status=500)
+    # Check if the user finished his course (start the user's test) or his
+    # test (unenroll the user).
+    req = DB_ADAPT.get(max_step_path(course_id, user_test_started))
+    if req.status_code != 200:
+        return Response(status=500)
 
-        try:
-            max_step = req.json()[0]["max"]
-        except (json.decoder.JSONDecodeError, TypeError):
-            return Response(status=500)
+    try:
+        max_step = first_row(req)["max"]
+    except (KeyError, TypeError):
+        return Response(status=500)
 
-        if user_step >= max_step:
-            query_payload = {"user_id" : user_id, "user_step" : 0,
-                             "course_id" : None, "user_test_started" : False}
-            req = requests.put(f"{DB_ADAPT_HOST}/api/user", json=query_payload)
+    (query_payload, reply) = next_step_update(user_id, user_step,
+                                              user_test_started, max_step)
+    req = DB_ADAPT.put("/api/user", json=query_payload)
 
-            if req.status_code != 200:
-                return Response(status=500)
+    if req.status_code != 200:
+        return Response(status=500)
 
-            return Response(
-                status=200,
-                response="test_finished",
-                mimetype="text/plain"
-            )
-    else:
-        # Check if the user finished his course - if so,start the user's test.
-        req = requests.get(f"{DB_ADAPT_HOST}/api/course_steps/max/{course_id}")
-        if req.status_code != 200:
-            return Response(status=500)
+    if not reply:
+        return Response(status=200)
 
-        try:
-            max_step = req.json()[0]["max"]
-        except (json.decoder.JSONDecodeError, TypeError):
-            return Response(status=500)
+    return Response(
+        status=200,
+        response=reply,
+        mimetype="text/plain"
+    )
 
-        if user_step >= max_step:
-            query_payload = {"user_id" : user_id, "user_step" : 1,
-                            "user_test_started" : True}
-            req = requests.put(f"{DB_ADAPT_HOST}/api/user", json=query_payload)
+@app.route("/api/advance/<int:user_id>", methods=["POST"])
+def advance_msg(user_id=None):
+    """
+    Set the user to the next lesson / question and retrieve it, in a single
+    call to the database adapter. The body of the response is a JSON object
+    following the schema:
+    {
+        "event": "" / "test_started" / "test_finished",
+        "category": "lesson" / "mid" / "test",   (missing if test_finished)
+        "text": "lesson or question text",       (missing if test_finished)
+        "url": "lesson picture"                  (optional)
+    }
 
-            if req.status_code != 200:
-                return Response(status=500)
+    Returns:
+        Response: - 200 if success and the new step in the body.
+                  - 403 if the user is not enrolled in an activity.
+                  - 404 if the user is not found.
+                  - 500 if there was an internal error.
+    """
 
-            return Response(
-                status=200,
-                response="test_started",
-                mimetype="text/plain"
-            )
+    # Clear "wait response" and the old quit command for the user.
+    SESSIONS.clear(user_id)
+
+    req = DB_ADAPT.post(f"/api/user/{user_id}/advance")
 
-    # Increase the user's step.
-    query_payload = {"user_id" : user_id, "user_step" : user_step + 1}
-    req = requests.put(f"{DB_ADAPT_HOST}/api/user", json=query_payload)
+    if req.status_code in (403, 404):
+        return Response(status=req.status_code)
 
     if req.status_code != 200:
         return Response(status=500)
 
-    return Response(status=200)
+    try:
+        (payload, answer) = advance_payload(req.json())
+    except (json.decoder.JSONDecodeError, TypeError, KeyError):
+        return Response(status=500)
+
+    if answer is not None:
+        # Mark "wait test / mid question response" for the user.
+        SESSIONS.set("answer", user_id, answer)
+
+    return Response(
+        status=200,
+        response=json.dumps(payload),
+        mimetype="application/json"
+    )
 
 @app.route("/api/score/<int:user_id>", methods=["GET"])
 def score_msg(user_id=None):
@@ -436,18 +411,14 @@ def score_msg(user_id=None):
                   - 500 if there was an internal error.
     """
 
-    query_payload = {"user_id" : user_id, "fields": ["user_score"]}
-    req = requests.get(f"{DB_ADAPT_HOST}/api/user", json=query_payload)
+    (status, user) = get_user(user_id, ["user_score"])
 
-    if req.status_code == 404:
+    if status == 404:
         return Response(status=404)
 
-    if req.status_code != 200:
-        return Response(status=500)
-
     try:
-        score = req.json()[0]["user_score"]
-    except (json.decoder.JSONDecodeError, TypeError):
+        score = user["user_score"]
+    except (KeyError, TypeError):
         return Response(status=500)
 
     return Response(
@@ -467,46 +438,24 @@ def cancel_msg(user_id=None):
                   - 500 if there was an internal error.
     """
 
-    # Clear "wait response" for the user.
-    if user_id in WAIT_ANS:
-        del WAIT_ANS[user_id]
+    # Clear "wait response" and the old quit command for the user.
+    SESSIONS.clear(user_id)
 
-    # Drop old user quit command.
-    if user_id in WAIT_CONF_DEL:
-        WAIT_CONF_DEL.remove(user_id)
+    (status, user) = get_user(user_id, ["course_id", "user_test_started"])
 
-    query_payload = {"user_id" : user_id,
-                     "fields" : ["course_id", "user_test_started"]}
-    req = requests.get(f"{DB_ADAPT_HOST}/api/user", json=query_payload)
-
-    if req.status_code == 404:
+    if status == 404:
         return Response(status=404)
 
-    if req.status_code != 200:
-        return Response(status=500)
-
     try:
-        user = req.json()[0]
-        course_id = user["course_id"]
-        user_test_started = user["user_test_started"]
-    except (json.decoder.JSONDecodeError, TypeError):
+        (query_payload, reply) = cancel_update(user_id, user)
+    except (KeyError, TypeError):
         return Response(status=500)
 
-    query_payload = {"user_id" : user_id, "user_step" : 0, "course_id" : None,
-                     "user_test_started" : False}
-    req = requests.put(f"{DB_ADAPT_HOST}/api/user", json=query_payload)
+    req = DB_ADAPT.put("/api/user", json=query_payload)
 
     if req.status_code != 200:
         return Response(status=500)
 
-    if user_test_started:
-        reply = "test"
-    elif course_id is not None:
-        reply = "course"
-    else:
-        # The user was not enrolled.
-        reply = ""
-
     return Response(
         status=200,
         response=reply,
@@ -527,8 +476,7 @@ def quit_msg(user_id=None):
                   - 500 if there was an internal error.
     """
 
-    query_payload = {"user_id" : user_id}
-    req = requests.get(f"{DB_ADAPT_HOST}/api/user", json=query_payload)
+    req = DB_ADAPT.get("/api/user", json=user_query(user_id))
 
     if req.status_code == 404:
         return Response(status=404)
@@ -536,19 +484,18 @@ def quit_msg(user_id=None):
     if req.status_code != 200:
         return Response(status=500)
 
-    if user_id in WAIT_CONF_DEL:
-        req = requests.delete(f"{DB_ADAPT_HOST}/api/user/{user_id}")
+    if SESSIONS.pop("quit", user_id):
+        req = DB_ADAPT.delete(f"/api/user/{user_id}")
         if req.status_code != 200:
+            # Let the user confirm again.
+            SESSIONS.set("quit", user_id, True)
             return Response(status=500)
 
-        WAIT_CONF_DEL.remove(user_id)
-
-        if user_id in WAIT_ANS:
-            del WAIT_ANS[user_id]
+        SESSIONS.clear(user_id)
 
         return Response(status=200)
 
-    WAIT_CONF_DEL.add(user_id)
+    SESSIONS.set("quit", user_id, True)
 
     return Response(status=205)
 
@@ -565,43 +512,44 @@ def recv_msg():
                   - 400 if the body is missing fields.
                   - 410 if the message was a user deletion confirmation and the
                   user was deleted.
+                  - 413 if the message is an answer which is too long.
                   - 500 if there was an internal error.
+                  - 503 if the model is not warmed up yet or the conversation
+                  state could not be read or saved.
     """
 
-    body_schema = {
-        "type": "object",
-        "properties": {
-            "user_id": {"type": "number"},
-            "message": {"type": "string"}
-        },
-        "required": ["user_id", "message"]
-    }
-
     payload = request.get_json(silent=True)
 
-    is_valid = validate_json(payload, body_schema)
+    is_valid = validate_json(payload, MESSAGE_SCHEMA)
     if not is_valid:
         return Response(status=400)
 
+    # An answer graded before the warm-up would wait for the model to compile.
+    # The user's state is kept, so the message can be sent again.
+    if not GRADER.ready.is_set():
+        return Response(status=503)
+
     user_id = payload["user_id"]
     msg = payload["message"]
 
+    # The pending quit command or, if there is none, the question the user
+    # has to answer, taken in one call. Taking the question also clears "wait
+    # response" for the user.
+    (kind, state) = SESSIONS.pop_first(("quit", "answer"), user_id)
+
     # Check if the message is a confirmation for the user's quit command.
-    if user_id in WAIT_CONF_DEL:
-        if msg[0].lower() == "y":
-            req = requests.delete(f"{DB_ADAPT_HOST}/api/user/{user_id}")
+    if kind == "quit":
+        if confirms_quit(msg):
+            req = DB_ADAPT.delete(f"/api/user/{user_id}")
             if req.status_code != 200:
+                # Let the user confirm again.
+                SESSIONS.set("quit", user_id, True)
                 return Response(status=500)
 
-            WAIT_CONF_DEL.remove(user_id)
-
-            if user_id in WAIT_ANS:
-                del WAIT_ANS[user_id]
+            SESSIONS.clear(user_id)
 
             return Response(status=410)
 
-        WAIT_CONF_DEL.remove(user_id)
-
         return Response(
             status=200,
             response="Quit aborted!",
@@ -609,39 +557,27 @@ def recv_msg():
         )
 
     # Check if the message is an answer.
-    if user_id in WAIT_ANS:
-        (test_step_id, course_id) = WAIT_ANS[user_id]
-        # Clear "wait response" for the user.
-        del WAIT_ANS[user_id]
-
-        if test_step_id == 0:
-            req = requests.get(f"{DB_ADAPT_HOST}/api/mid_questions/{course_id}")
-            if req.status_code != 200:
-                return Response(status=500)
-
-            try:
-                test_step = req.json()[0]
-                ref = test_step["mid_question_ans"]
-            except (json.decoder.JSONDecodeError, TypeError):
-                return Response(status=500)
-        else:
-            req = requests.get(f"{DB_ADAPT_HOST}/api/test_steps/{test_step_id}")
-            if req.status_code != 200:
-                return Response(status=500)
+    if kind == "answer":
+        (test_step_id, course_id) = state
 
-            try:
-                test_step = req.json()[0]
-                ref = test_step["test_step_ans"]
-            except (json.decoder.JSONDecodeError, TypeError):
-                return Response(status=500)
+        (path, field) = reference_query(test_step_id, course_id)
+        ref = reference_answer(DB_ADAPT.get(path), field)
+        if ref is None:
+            return Response(status=500)
 
-        # Compare the answer to the reference question.
-        result = predict((msg, ref), COMPARE_THRESHOLD, MODEL, VOCAB)
-        RESPONE_LOGGER.info("\"%s\",\"%s\",%d", msg, ref, result)
+        # Compare the answer to the reference question. The answer is padded
+        # to the length it shares with the reference, whose vector is already
+        # known.
+        try:
+            result = GRADER.grade(msg, ref)
+        except InputTooLong:
+            # Let the user answer again.
+            SESSIONS.set("answer", user_id, [test_step_id, course_id])
+            return Response(status=413)
 
         if result:
             if test_step_id != 0:
-                req = requests.put(f"{DB_ADAPT_HOST}/api/user/{user_id}/score")
+                req = DB_ADAPT.put(f"/api/user/{user_id}/score")
 
                 if req.status_code != 200:
                     return Response(status=500)
@@ -660,6 +596,40 @@ def recv_msg():
 
     return Response(status=200)
 
+@app.route("/api/ready", methods=["GET"])
+def ready_msg():
+    """
+    Check if the model is loaded and warmed up.
+
+    Returns:
+        Response: - 200 if the application is ready to serve requests.
+                  - 503 otherwise.
+    """
+
+    if not GRADER.ready.is_set():
+        return Response(status=503)
+
+    return Response(
+        status=200,
+        response="ready",
+        mimetype="text/plain"
+    )
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics_msg():
+    """
+    Retrieve the inference queue's metrics (batch sizes and queue wait).
+
+    Returns:
+        Response: - 200 and the metrics in the body.
+    """
+
+    return Response(
+        status=200,
+        response=json.dumps(GRADER.queue.metrics()),
+        mimetype="application/json"
+    )
+
 @app.route("/", methods=["GET"])
 def default():
     """
@@ -683,46 +653,43 @@ if __name__ == "__main__":
     parser = ArgumentParser(description="Run Math Bot's central application.")
     parser.add_argument("-d", "--debug", action="store_true",
                     help="specify if additional debug output should be shown")
+    parser.add_argument("-p", "--production", action="store_true",
+                    help="serve with gunicorn instead of the development server")
     args = parser.parse_args()
 
-    # Debug activation flag
-    DEBUG = args.debug
-    logging.basicConfig(format="[%(levelname)s] %(asctime)s - %(message)s",
-                        datefmt="%Y-%m-%d %H:%M:%S")
-    logging.Formatter.converter = localtime
-    logging.StreamHandler(sys.stdout)
+    # For logging the time until the central component is ready.
+    started = monotonic()
     # The debugging logging module
-    LOGGER = logging.getLogger(__name__)
-
-    if DEBUG:
-        LOGGER.setLevel(logging.DEBUG)
+    LOGGER = setup_logging(__name__, args.debug)
+
+    # Keep-alive client for the database adapter.
+    DB_ADAPT = client_from_env(db_adapter_host())
+    (math_bot_addr, math_bot_port) = listen_address()
+
+    # The users' conversation state, which expires:
+    # - "quit": True if the user needs to confirm the quit command.
+    # - "answer": [test_step_id, course_id] if the user needs to answer a
+    # question. test_step_id will be 0 if the question is not from a test (is
+    # a mid course question).
+    # With SESSION_BACKEND=database, the state is shared by every process.
+    SESSIONS = session_store_from_env(DB_ADAPT)
+
+    # The list of courses, which changes only when new content is imported.
+    COURSES_CACHE = ResponseCache(float(os.getenv("COURSES_CACHE_TTL", "60")))
+
+    # The model, the reference answers' vectors and the answers' log.
+    GRADER = load_grader(LOGGER, started)
+
+    if args.production:
+        # The model is loaded before the workers are forked, so they share its
+        # weights. Every worker warms it up and grades the answers in its own
+        # queue, answering /api/message with 503 until it is warmed up.
+        if int(os.getenv("WEB_WORKERS", "1")) > 1 and \
+           os.getenv("SESSION_BACKEND", "memory") == "memory":
+            LOGGER.warning("Every worker keeps its own conversation state! "
+                           "Use SESSION_BACKEND=database.")
+        serve(app, math_bot_addr, math_bot_port,
+              post_fork=GRADER.start_preparing, workers=1, threads=16)
     else:
-        LOGGER.setLevel(logging.WARNING)
-
-    LOGGER.info("The central component started!")
-
-    db_adapt_port = os.getenv("DB_ADAPT_PORT", "5000")
-    DB_ADAPT_HOST = f"http://database_adapter:{db_adapt_port}"
-    math_bot_port = int(os.getenv("MATH_BOT_PORT", "5001"))
-    math_bot_addr = os.getenv("MATH_BOT_ADDR", "0.0.0.0")
-
-    # Set with user who need to confirm quit command.
-    WAIT_CONF_DEL = set()
-    # Dictionary with users who need to response a question.
-    # WAIT_ANS[user_id] = (test_step_id, course_id)
-    # test_step_id will be 0 if the question is not from a test (is a mid
-    # course question).
-    WAIT_ANS = dict()
-
-    COMPARE_THRESHOLD = 0.6
-    (VOCAB, MODEL) = data_loader("model/data/en_vocab.txt",
-                                 "model/trax_model/model.pkl.gz")
-
-    # The user responses to be used for retraining the model.
-    RESPONE_LOGGER = logging.getLogger("Response logger")
-    handler = logging.FileHandler("/tmp/logs/user_input.csv", "w")
-    RESPONE_LOGGER.addHandler(handler)
-    RESPONE_LOGGER.setLevel(logging.INFO)
-    RESPONE_LOGGER.info("message, reference, prediction")
-
-    app.run(host=math_bot_addr, port=math_bot_port, debug=DEBUG)
+        GRADER.start_preparing()
+        app.run(host=math_bot_addr, port=math_bot_port, debug=args.debug)
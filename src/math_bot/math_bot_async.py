@@ -0,0 +1,702 @@
+#!/usr/bin/env python3
+# pylint: disable=R0911,R0912,R0914
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The asyncio variant of the central application
+
+It serves the same routes as math_bot.py, with the same responses, from a
+single thread: a request waiting for the database adapter or for the model
+does not hold a thread, so one process serves thousands of concurrent
+conversations. The independent calls of a request are made concurrently, and
+the model runs outside the event loop (in the inference queue's thread and
+the default executor).
+"""
+
+import asyncio
+import json
+import os
+
+from argparse  import ArgumentParser
+from time import monotonic
+
+from aiohttp import web
+
+from central import advance_payload, cancel_update, confirms_quit, \
+                    db_adapter_host, enroll_update, first_row, \
+                    is_mid_question, lesson_payload, listen_address, \
+                    load_grader, max_step_path, next_step_update, \
+                    reference_answer, reference_query, setup_logging, \
+                    test_question, user_query, user_reply, user_step_fields
+from model import InputTooLong
+from session_store import SessionStoreError, session_store_from_env
+from common.async_http_client import async_client_from_env
+from common.response_cache import ResponseCache, etag_matches
+from common.validation import COURSE_SCHEMA, ENROLL_SCHEMA, MESSAGE_SCHEMA, \
+                              REGISTER_SCHEMA, validate_json
+
+# The routes of the app
+routes = web.RouteTableDef()
+
+async def get_json(request):
+    """
+    Read the JSON body of a request.
+
+    Returns:
+        The body, None if it is not JSON.
+    """
+
+    try:
+        return await request.json()
+    except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+        return None
+
+@web.middleware
+async def session_store_errors(request, handler):
+    """
+    Answer 503 to the requests whose conversation state could not be read or
+    saved, e.g. while the database adapter is down.
+    """
+
+    try:
+        return await handler(request)
+    except SessionStoreError:
+        return web.Response(status=503)
+
+async def get_user(user_id, fields=None):
+    """
+    Retrieve a user from the database adapter.
+
+    Args:
+        user_id (int): The user's id.
+        fields (list, optional): The wanted fields. Defaults to None (all).
+    Returns:
+        tuple: The status code of the call (int) and the user (dict), None if
+               the call failed.
+    """
+
+    return user_reply(await DB_ADAPT.get("/api/user",
+                                         json=user_query(user_id, fields)))
+
+async def grade_answer(msg, ref):
+    """
+    Compare an answer to its reference in the inference queue, without
+    blocking the event loop.
+
+    Raises:
+        InputTooLong: If the answer is too long and it is not truncated.
+    Returns:
+        bool: If the answer is correct.
+    """
+
+    loop = asyncio.get_running_loop()
+    # Tokenizing is done in the executor, the model runs in the queue's thread
+    # and the answer waits for it here, without holding a thread.
+    future = await loop.run_in_executor(None, GRADER.submit, msg, ref)
+
+    return GRADER.record(msg, ref, await asyncio.wrap_future(future))
+
+@routes.post("/api/register")
+async def register_msg(request):
+    """
+    Register a new user.
+
+    Returns:
+        Response: - 201 in case of success.
+                  - 400 + "fields" if the body does not have all the necessary
+                  information.
+                  - 400 + "values" if the values are out of bounds.
+                  - 409 if the user already exists.
+    """
+
+    payload = await get_json(request)
+
+    is_valid = validate_json(payload, REGISTER_SCHEMA)
+    if not is_valid:
+        return web.Response(status=400, text="fields")
+
+    req = await DB_ADAPT.post("/api/user", json=payload)
+
+    return web.Response(status=req.status_code, text=req.text)
+
+@routes.get("/api/courses")
+async def courses_msg(request):
+    """
+    Retrieve the available courses. The list is cached for COURSES_CACHE_TTL
+    seconds, then revalidated with the database adapter.
+
+    Returns:
+        Response: - 200 in case of success and the list of courses in the body.
+                  - 304 if the client's copy is up to date.
+    """
+
+    (entry, fresh) = COURSES_CACHE.lookup("courses")
+
+    if not fresh:
+        req = await DB_ADAPT.get(
+            "/api/courses", headers=COURSES_CACHE.request_headers("courses"))
+
+        entry = COURSES_CACHE.update("courses", entry, req)
+        if entry is None:
+            return web.Response(status=req.status_code, text=req.text,
+                                content_type="application/json")
+
+    if etag_matches(entry.etag, request.headers.get("If-None-Match")):
+        return web.Response(status=304, headers=entry.headers())
+
+    return web.Response(status=200, text=entry.value,
+                        content_type="application/json",
+                        headers=entry.headers())
+
+@routes.post("/api/enroll")
+async def enroll_msg(request):
+    """
+    Enroll an user to a course / change the course the user is pursuing.
+
+    Returns:
+        Response: - 200 in case of success, if the new course is the same as the
+                  old one.
+                  - 200 + the information about the new course if success.
+                  - 400 if the body does not have all the necessary information.
+                  - 404 + "no_course" if the course is not found.
+                  - 404 + "no_user" if the user is not found.
+                  - 500 if there was an internal error.
+    """
+
+    payload = await get_json(request)
+
+    is_valid = validate_json(payload, ENROLL_SCHEMA)
+    if not is_valid:
+        return web.Response(status=400)
+
+    user_id = payload["user_id"]
+
+    # Get the course id, given the name, and the user's current course.
+    (req, (user_status, user)) = await asyncio.gather(
+        DB_ADAPT.get("/api/course",
+                     json={"course_name" : payload["course_name"]}),
+        get_user(user_id, ["course_id"])
+    )
+
+    if req.status_code == 404:
+        return web.Response(status=404, text="no_course")
+
+    new_course = first_row(req)
+    is_valid = validate_json(new_course, COURSE_SCHEMA)
+    if not is_valid:
+        return web.Response(status=500)
+
+    if user_status == 404:
+        return web.Response(status=404, text="no_user")
+
+    if user is None or "course_id" not in user:
+        return web.Response(status=500)
+
+    if new_course["course_id"] == user["course_id"]:
+        # The new course is actually the old one.
+        return web.Response(status=200)
+
+    # Change the user's course, but first clear "wait response" and the old
+    # quit command for the user.
+    await SESSIONS.clear(user_id)
+
+    # Update user data.
+    req = await DB_ADAPT.put(
+        "/api/user", json=enroll_update(user_id, new_course["course_id"]))
+
+    if req.status_code != 200:
+        return web.Response(status=500)
+
+    return web.Response(status=req.status_code, text=json.dumps(new_course),
+                        content_type="application/json")
+
+@routes.get("/api/current_step/{user_id:\\d+}")
+async def current_step(request):
+    """
+    Retrieve the current lesson / question for a user.
+
+    Returns:
+        Response: - 200 if success and the lesson's text (and picture) in body.
+                  - 205 if success and the question's text in body.
+                  - 403 if the user is not enrolled in an activity.
+                  - 404 if the user is not found.
+                  - 500 if there was an internal error.
+    """
+
+    user_id = int(request.match_info["user_id"])
+
+    (status, user) = await get_user(user_id, ["user_step", "course_id",
+                                              "user_test_started"])
+
+    if status == 404:
+        return web.Response(status=404)
+
+    try:
+        (user_step, course_id, user_test_started) = user_step_fields(user)
+    except (KeyError, TypeError):
+        return web.Response(status=500)
+
+    if user_step == 0 or course_id is None:
+        return web.Response(status=403)
+
+    # If the current step is a test question, send it.
+    if user_test_started:
+        query_payload = {"test_step_inner_id" : user_step,
+                         "course_id" : course_id}
+        req = await DB_ADAPT.get("/api/test_steps", json=query_payload)
+        if req.status_code != 200:
+            return web.Response(status=500)
+
+        try:
+            (test_step_id, test_step_text) = test_question(first_row(req))
+        except (KeyError, TypeError):
+            return web.Response(status=500)
+
+        # Mark "wait test response" for the user.
+        await SESSIONS.set("answer", user_id, [test_step_id, course_id])
+
+        return web.Response(status=205, text=f"test/{test_step_text}")
+
+    # The step is a mid question or a lesson: the number of steps and the
+    # lesson are retrieved together, the lesson being dropped if the step is
+    # the mid question.
+    query_payload = {"course_step_inner_id" : user_step,
+                     "course_id" : course_id}
+    (req, lesson_req) = await asyncio.gather(
+        DB_ADAPT.get(f"/api/course_steps/max/{course_id}"),
+        DB_ADAPT.get("/api/course_steps", json=query_payload)
+    )
+    if req.status_code != 200:
+        return web.Response(status=500)
+
+    try:
+        num_course_steps = first_row(req)["max"]
+    except (KeyError, TypeError):
+        return web.Response(status=500)
+
+    if is_mid_question(user_step, num_course_steps):
+        req = await DB_ADAPT.get(f"/api/mid_questions/{course_id}")
+        if req.status_code != 200:
+            return web.Response(status=500)
+
+        try:
+            mid_question_text = first_row(req)["mid_question_text"]
+        except (KeyError, TypeError):
+            return web.Response(status=500)
+
+        # Mark "wait mid question response" for the user.
+        await SESSIONS.set("answer", user_id, [0, course_id])
+
+        return web.Response(status=205, text=f"mid/{mid_question_text}")
+
+    # The current step is a lesson, send it.
+    if lesson_req.status_code != 200:
+        return web.Response(status=500)
+
+    try:
+        payload = lesson_payload(first_row(lesson_req))
+    except (KeyError, TypeError):
+        return web.Response(status=500)
+
+    return web.Response(status=200, text=json.dumps(payload),
+                        content_type="application/json")
+
+@routes.post("/api/next/{user_id:\\d+}")
+async def next_msg(request):
+    """
+    Set the user to the next lesson / question.
+
+    Returns:
+        Response: - 200 if success.
+                  - 403 if the user is not enrolled in an activity.
+                  - 404 if the user is not found.
+                  - 500 if there was an internal error.
+    """
+
+    user_id = int(request.match_info["user_id"])
+
+    # Clear "wait response" and the old quit command for the user, while
+    # retrieving the user.
+    (_, (status, user)) = await asyncio.gather(
+        SESSIONS.clear(user_id),
+        get_user(user_id, ["user_step", "course_id", "user_test_started"])
+    )
+
+    if status == 404:
+        return web.Response(status=404)
+
+    try:
+        (user_step, course_id, user_test_started) = user_step_fields(user)
+    except (KeyError, TypeError):
+        return web.Response(status=500)
+
+    if user_step == 0 or course_id is None:
+        return web.Response(status=403)
+
+    # Check if the user finished his course (start the user's test) or his
+    # test (unenroll the user).
+    req = await DB_ADAPT.get(max_step_path(course_id, user_test_started))
+    if req.status_code != 200:
+        return web.Response(status=500)
+
+    try:
+        max_step = first_row(req)["max"]
+    except (KeyError, TypeError):
+        return web.Response(status=500)
+
+    (query_payload, reply) = next_step_update(user_id, user_step,
+                                              user_test_started, max_step)
+    req = await DB_ADAPT.put("/api/user", json=query_payload)
+
+    if req.status_code != 200:
+        return web.Response(status=500)
+
+    if not reply:
+        return web.Response(status=200)
+
+    return web.Response(status=200, text=reply)
+
+@routes.post("/api/advance/{user_id:\\d+}")
+async def advance_msg(request):
+    """
+    Set the user to the next lesson / question and retrieve it, in a single
+    call to the database adapter. The body of the response is the same as
+    math_bot.py's.
+
+    Returns:
+        Response: - 200 if success and the new step in the body.
+                  - 403 if the user is not enrolled in an activity.
+                  - 404 if the user is not found.
+                  - 500 if there was an internal error.
+    """
+
+    user_id = int(request.match_info["user_id"])
+
+    # Clear "wait response" and the old quit command for the user, while
+    # advancing the user. The new state is saved after both are done.
+    (_, req) = await asyncio.gather(
+        SESSIONS.clear(user_id),
+        DB_ADAPT.post(f"/api/user/{user_id}/advance")
+    )
+
+    if req.status_code in (403, 404):
+        return web.Response(status=req.status_code)
+
+    if req.status_code != 200:
+        return web.Response(status=500)
+
+    try:
+        (payload, answer) = advance_payload(req.json())
+    except (json.decoder.JSONDecodeError, TypeError, KeyError):
+        return web.Response(status=500)
+
+    if answer is not None:
+        # Mark "wait test / mid question response" for the user.
+        await SESSIONS.set("answer", user_id, answer)
+
+    return web.Response(status=200, text=json.dumps(payload),
+                        content_type="application/json")
+
+@routes.get("/api/score/{user_id:\\d+}")
+async def score_msg(request):
+    """
+    Retrieve a user's score.
+
+    Returns:
+        Response: - 200 in case of success.
+                  - 404 if the user is not found.
+                  - 500 if there was an internal error.
+    """
+
+    (status, user) = await get_user(int(request.match_info["user_id"]),
+                                    ["user_score"])
+
+    if status == 404:
+        return web.Response(status=404)
+
+    try:
+        score = user["user_score"]
+    except (KeyError, TypeError):
+        return web.Response(status=500)
+
+    return web.Response(status=200, text=str(score))
+
+@routes.post("/api/cancel/{user_id:\\d+}")
+async def cancel_msg(request):
+    """
+    Cancel a user's current activity.
+
+    Returns:
+        Response: - 200 in case of success and the canceled activity in body.
+                  - 404 if the user is not found.
+                  - 500 if there was an internal error.
+    """
+
+    user_id = int(request.match_info["user_id"])
+
+    # Clear "wait response" and the old quit command for the user, while
+    # retrieving the user.
+    (_, (status, user)) = await asyncio.gather(
+        SESSIONS.clear(user_id),
+        get_user(user_id, ["course_id", "user_test_started"])
+    )
+
+    if status == 404:
+        return web.Response(status=404)
+
+    try:
+        (query_payload, reply) = cancel_update(user_id, user)
+    except (KeyError, TypeError):
+        return web.Response(status=500)
+
+    req = await DB_ADAPT.put("/api/user", json=query_payload)
+
+    if req.status_code != 200:
+        return web.Response(status=500)
+
+    return web.Response(status=200, text=reply)
+
+@routes.post("/api/quit/{user_id:\\d+}")
+async def quit_msg(request):
+    """
+    Ask for a confirmation when the command /quit is issued. After the
+    confirmation the user will be deleted from the database.
+
+    Returns:
+        Response: - 200 in case of success.
+                  - 205 if the user needs to confirm the action.
+                  - 404 if the user is not found.
+                  - 500 if there was an internal error.
+    """
+
+    user_id = int(request.match_info["user_id"])
+
+    req = await DB_ADAPT.get("/api/user", json=user_query(user_id))
+
+    if req.status_code == 404:
+        return web.Response(status=404)
+
+    if req.status_code != 200:
+        return web.Response(status=500)
+
+    if await SESSIONS.pop("quit", user_id):
+        req = await DB_ADAPT.delete(f"/api/user/{user_id}")
+        if req.status_code != 200:
+            # Let the user confirm again.
+            await SESSIONS.set("quit", user_id, True)
+            return web.Response(status=500)
+
+        await SESSIONS.clear(user_id)
+
+        return web.Response(status=200)
+
+    await SESSIONS.set("quit", user_id, True)
+
+    return web.Response(status=205)
+
+async def get_reference(test_step_id, course_id):
+    """
+    Retrieve the reference answer of a question.
+
+    Args:
+        test_step_id (int): The test step's id, 0 for the mid-course question.
+        course_id (int): The course's id.
+    Returns:
+        str: The reference answer, None if the call failed.
+    """
+
+    (path, field) = reference_query(test_step_id, course_id)
+
+    return reference_answer(await DB_ADAPT.get(path), field)
+
+@routes.post("/api/message")
+async def recv_msg(request):
+    """
+    A route for receiving messages.
+
+    Returns:
+        Response: - 200 + "hit" if the message received was the correct answer
+                  to a question.
+                  - 200 + "miss" if the message received was the wrong answer to
+                  a question.
+                  - 400 if the body is missing fields.
+                  - 410 if the message was a user deletion confirmation and the
+                  user was deleted.
+                  - 413 if the message is an answer which is too long.
+                  - 500 if there was an internal error.
+                  - 503 if the model is not warmed up yet or the conversation
+                  state could not be read or saved.
+    """
+
+    payload = await get_json(request)
+
+    is_valid = validate_json(payload, MESSAGE_SCHEMA)
+    if not is_valid:
+        return web.Response(status=400)
+
+    # An answer graded before the warm-up would wait for the model to compile.
+    # The user's state is kept, so the message can be sent again.
+    if not GRADER.ready.is_set():
+        return web.Response(status=503)
+
+    user_id = payload["user_id"]
+    msg = payload["message"]
+
+    # The pending quit command or, if there is none, the question the user
+    # has to answer, taken in one call. Taking the question also clears "wait
+    # response" for the user.
+    (kind, state) = await SESSIONS.pop_first(("quit", "answer"), user_id)
+
+    # Check if the message is a confirmation for the user's quit command.
+    if kind == "quit":
+        if confirms_quit(msg):
+            req = await DB_ADAPT.delete(f"/api/user/{user_id}")
+            if req.status_code != 200:
+                # Let the user confirm again.
+                await SESSIONS.set("quit", user_id, True)
+                return web.Response(status=500)
+
+            await SESSIONS.clear(user_id)
+
+            return web.Response(status=410)
+
+        return web.Response(status=200, text="Quit aborted!")
+
+    # Check if the message is an answer.
+    if kind != "answer":
+        return web.Response(status=200)
+
+    (test_step_id, course_id) = state
+
+    ref = await get_reference(test_step_id, course_id)
+    if ref is None:
+        return web.Response(status=500)
+
+    # The answer is padded to the length it shares with the reference, so it
+    # goes through the model once the reference is known. The reference's
+    # vector is already known, unless the reference is new.
+    try:
+        result = await grade_answer(msg, ref)
+    except InputTooLong:
+        # Let the user answer again.
+        await SESSIONS.set("answer", user_id, [test_step_id, course_id])
+        return web.Response(status=413)
+
+    if not result:
+        return web.Response(status=200, text="miss")
+
+    if test_step_id != 0:
+        req = await DB_ADAPT.put(f"/api/user/{user_id}/score")
+
+        if req.status_code != 200:
+            return web.Response(status=500)
+
+    return web.Response(status=200, text="hit")
+
+@routes.get("/api/ready")
+async def ready_msg(_request):
+    """
+    Check if the model is loaded and warmed up.
+
+    Returns:
+        Response: - 200 if the application is ready to serve requests.
+                  - 503 otherwise.
+    """
+
+    if not GRADER.ready.is_set():
+        return web.Response(status=503)
+
+    return web.Response(status=200, text="ready")
+
+@routes.get("/api/metrics")
+async def metrics_msg(_request):
+    """
+    Retrieve the inference queue's metrics (batch sizes and queue wait).
+
+    Returns:
+        Response: - 200 and the metrics in the body.
+    """
+
+    return web.Response(status=200, text=json.dumps(GRADER.queue.metrics()),
+                        content_type="application/json")
+
+@routes.get("/")
+async def default(_request):
+    """
+    A default route used for debugging.
+
+    Returns:
+        Response: - 200.
+    """
+
+    return web.Response(status=200,
+                        text=""" <html>
+                                 <body>
+                                 <h1>This is Math Bot's central application.</h1>
+                                 </body>
+                                 </html> """,
+                        content_type="text/html")
+
+async def start_client(_app):
+    """Opens the database adapter's connection pool, in the event loop."""
+
+    await DB_ADAPT.start()
+
+async def close_client(_app):
+    """Closes the database adapter's connection pool."""
+
+    await DB_ADAPT.close()
+
+async def start_preparing(_app):
+    """
+    Start preparing the model in the background, /api/ready and /api/message
+    answering 503 until it is done.
+    """
+
+    GRADER.start_preparing()
+
+def make_app():
+    """
+    Returns:
+        aiohttp.web.Application: The app, serving the routes.
+    """
+
+    app = web.Application(middlewares=[session_store_errors])
+    app.add_routes(routes)
+    app.on_startup.append(start_client)
+    app.on_startup.append(start_preparing)
+    app.on_cleanup.append(close_client)
+
+    return app
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Run Math Bot's central application, in asyncio.")
+    parser.add_argument("-d", "--debug", action="store_true",
+                    help="specify if additional debug output should be shown")
+    args = parser.parse_args()
+
+    # For logging the time until the central component is ready.
+    started = monotonic()
+    # The debugging logging module
+    LOGGER = setup_logging(__name__, args.debug)
+
+    # Keep-alive client for the database adapter, opened with the app.
+    DB_ADAPT = async_client_from_env(db_adapter_host())
+    (math_bot_addr, math_bot_port) = listen_address()
+
+    # The users' conversation state, as in math_bot.py.
+    SESSIONS = session_store_from_env(DB_ADAPT, asynchronous=True)
+
+    # The list of courses, which changes only when new content is imported.
+    COURSES_CACHE = ResponseCache(float(os.getenv("COURSES_CACHE_TTL", "60")))
+
+    # The model, the reference answers' vectors and the answers' log.
+    GRADER = load_grader(LOGGER, started)
+
+    web.run_app(make_app(), host=math_bot_addr, port=math_bot_port,
+                print=LOGGER.info)
@@ -1,7 +1,3 @@
-import nltk
-
-nltk.download('punkt')
-nltk.download('stopwords')
-nltk.download('wordnet')
-
 from .model import *
+from .embedding_store import EmbeddingStore
+from .inference_queue import InferenceQueue
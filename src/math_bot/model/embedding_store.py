@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The store of the reference answers' embeddings
+
+The reference answers are fixed, so their vectors are computed only once and
+only the user's sentence goes through the model when grading an answer. As in
+predict, the answer and the reference are padded to the same length (see
+pair_len), so a reference has a vector for every padded length it is compared
+at.
+"""
+
+import json
+import threading
+
+from .model import embed_tensors, encode, pad_len
+
+class EmbeddingStore:
+    """The normalized vectors of the reference answers, keyed by their text
+    and padded length.
+
+    Keying by text makes the store follow content changes: a changed answer is
+    simply a new key, computed on its first use.
+    """
+
+    def __init__(self, model, vocab, max_len=None):
+        """
+        Args:
+            model (trax.layers.combinators.Parallel): The Siamese model.
+            vocab (collections.defaultdict): The vocabulary used.
+            max_len (int, optional): The maximum number of words in an answer,
+                                     the padded lengths up to it are computed
+                                     by refresh. Defaults to None (only the
+                                     reference's own padded length).
+        """
+
+        self.model = model
+        self.vocab = vocab
+        self.max_len = max_len
+        # reference -> its tensor
+        self._tensors = {}
+        # (reference, padded length) -> its vector
+        self._vectors = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tensors)
+
+    def __contains__(self, reference):
+        return reference in self._tensors
+
+    def _tensor(self, reference):
+        """Encodes a reference, once."""
+
+        tensor = self._tensors.get(reference)
+        if tensor is None:
+            tensor = encode(reference, self.vocab)
+
+            with self._lock:
+                self._tensors[reference] = tensor
+
+        return tensor
+
+    def length(self, reference):
+        """
+        Args:
+            reference (str): The reference answer.
+
+        Returns:
+            int: The number of words of the reference.
+        """
+
+        return len(self._tensor(reference))
+
+    def max_length(self):
+        """
+        Returns:
+            int: The number of words of the longest reference, 0 if there are
+                 none.
+        """
+
+        with self._lock:
+            tensors = list(self._tensors.values())
+
+        return max(map(len, tensors), default=0)
+
+    def refresh(self, references):
+        """Recomputes the store for a set of references, dropping old ones.
+
+        Every reference is embedded at its own padded length and at the longer
+        ones an answer can have.
+
+        Args:
+            references (iterable): The reference answers (str).
+        """
+
+        references = list(dict.fromkeys(references))
+        tensors = {reference: encode(reference, self.vocab)
+                   for reference in references}
+
+        keys = []
+        for (reference, tensor) in tensors.items():
+            length = pad_len(len(tensor))
+            keys.append((reference, length))
+            while self.max_len is not None and length < pad_len(self.max_len):
+                length *= 2
+                keys.append((reference, length))
+
+        vectors = embed_tensors([tensors[reference] for (reference, _) in keys],
+                                self.model, self.vocab["<PAD>"],
+                                [length for (_, length) in keys]) \
+                  if keys else []
+
+        with self._lock:
+            self._tensors = tensors
+            self._vectors = dict(zip(keys, vectors))
+
+    def refresh_from_file(self, data_file):
+        """Recomputes the store using the answers from a courses data file.
+
+        Args:
+            data_file (str): The path to the data file (e.g. courses.json).
+        """
+
+        with open(data_file, "r", encoding="utf-8") as fin:
+            courses_data = json.load(fin)
+
+        references = [q["mid_question_ans"]
+                      for q in courses_data.get("mid_questions", [])]
+        references += [q["test_step_ans"]
+                       for q in courses_data.get("test_steps", [])]
+
+        self.refresh(references)
+
+    def get(self, reference, length=None):
+        """Retrieves the vector of a reference, computing it if it is missing.
+
+        Args:
+            reference (str): The reference answer.
+            length (int, optional): The padded length (see pair_len). Defaults
+                                    to None (the reference's own).
+
+        Returns:
+            numpy.ndarray: The normalized vector.
+        """
+
+        tensor = self._tensor(reference)
+        if length is None:
+            length = pad_len(len(tensor))
+
+        vec = self._vectors.get((reference, length))
+        if vec is None:
+            vec = embed_tensors([tensor], self.model, self.vocab["<PAD>"],
+                                [length])[0]
+
+            with self._lock:
+                self._vectors[(reference, length)] = vec
+
+        return vec
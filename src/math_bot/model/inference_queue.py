@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The micro-batching inference queue
+
+Concurrent grading requests are collected for a short window (or until the
+batch is full) and sent through the model together. Every answer is padded to
+the length it shares with its reference (see pair_len), as in predict, so the
+batch does not change its similarity.
+"""
+
+import queue
+import threading
+
+from concurrent.futures import Future
+from time import monotonic
+
+import numpy as np
+
+from .embedding_store import EmbeddingStore
+from .model import embed_tensors, encode, pair_len
+
+class InferenceQueue:
+    # pylint: disable=too-many-instance-attributes
+    """Collects answers from concurrent requests and grades them in batches.
+    """
+
+    def __init__(self, model, vocab, window=0.005, max_batch=32, max_len=None,
+                 truncate=True, store=None):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        """
+        Args:
+            model (trax.layers.combinators.Parallel): The Siamese model.
+            vocab (collections.defaultdict): The vocabulary used.
+            window (float, optional): How long (seconds) to wait for more
+                                      requests after the first one. Defaults
+                                      to 0.005.
+            max_batch (int, optional): The maximum batch size. Defaults to 32.
+            max_len (int, optional): The maximum number of words in a
+                                     sentence. Defaults to None (no limit).
+            truncate (bool, optional): If longer sentences should be truncated
+                                       or rejected. Defaults to True.
+            store (EmbeddingStore, optional): The references' vectors.
+                                              Defaults to None (a new store).
+        """
+
+        self.model = model
+        self.vocab = vocab
+        self.window = window
+        self.max_batch = max_batch
+        self.max_len = max_len
+        self.truncate = truncate
+        self.store = store if store is not None else \
+                     EmbeddingStore(model, vocab, max_len)
+
+        self._requests = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "items": 0,
+            "max_batch_size": 0,
+            "batch_sizes": {},
+            "wait_total": 0.0,
+            "wait_max": 0.0
+        }
+
+    def _start(self):
+        """Starts the worker thread, if it is not running."""
+
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run,
+                                                name="inference-queue",
+                                                daemon=True)
+                self._worker.start()
+
+    def _collect(self):
+        """Waits for a batch of requests.
+
+        Returns:
+            list: The requests, as (tensor, padded length, reference, future,
+                  enqueue time) tuples.
+        """
+
+        batch = [self._requests.get()]
+        deadline = monotonic() + self.window
+
+        while len(batch) < self.max_batch:
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(self._requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _record(self, batch, now):
+        """Updates the batch size and queue wait metrics."""
+
+        waits = [now - enqueued for (_, _, _, _, enqueued) in batch]
+
+        with self._stats_lock:
+            stats = self._stats
+            size = len(batch)
+            stats["batches"] += 1
+            stats["items"] += size
+            stats["max_batch_size"] = max(stats["max_batch_size"], size)
+            stats["batch_sizes"][size] = stats["batch_sizes"].get(size, 0) + 1
+            stats["wait_total"] += sum(waits)
+            stats["wait_max"] = max(stats["wait_max"], *waits)
+
+    def _run(self):
+        """The worker loop: collect a batch, run the model, send the results.
+        """
+
+        while True:
+            batch = self._collect()
+            self._record(batch, monotonic())
+
+            try:
+                vectors = embed_tensors(
+                    [tensor for (tensor, _, _, _, _) in batch],
+                    self.model, self.vocab["<PAD>"],
+                    [length for (_, length, _, _, _) in batch])
+            except Exception as err:  # pylint: disable=broad-except
+                for (_, _, _, future, _) in batch:
+                    future.set_exception(err)
+                continue
+
+            for (_, length, reference, future, _), vec in zip(batch, vectors):
+                try:
+                    ref_vec = self.store.get(reference, length)
+                except Exception as err:  # pylint: disable=broad-except
+                    future.set_exception(err)
+                    continue
+
+                future.set_result(float(np.dot(vec, ref_vec.T)))
+
+    def submit(self, sentence, reference):
+        """Adds an answer to the queue.
+
+        Args:
+            sentence (str): The input sentence.
+            reference (str): The reference answer.
+
+        Raises:
+            InputTooLong: If the sentence is too long and it is not truncated.
+
+        Returns:
+            concurrent.futures.Future: The future cosine similarity.
+        """
+
+        tensor = encode(sentence, self.vocab, self.max_len, self.truncate)
+        length = pair_len(len(tensor), self.store.length(reference))
+
+        self._start()
+
+        future = Future()
+        self._requests.put((tensor, length, reference, future, monotonic()))
+
+        return future
+
+    def similarity(self, sentence, reference, timeout=None):
+        """Compares a sentence to a reference.
+
+        Args:
+            sentence (str): The input sentence.
+            reference (str): The reference answer.
+            timeout (float, optional): How long to wait for the result.
+                                       Defaults to None (no limit).
+
+        Raises:
+            InputTooLong: If the sentence is too long and it is not truncated.
+
+        Returns:
+            float: The cosine similarity of the two sentences.
+        """
+
+        return self.submit(sentence, reference).result(timeout)
+
+    def metrics(self):
+        """Reports the batch size and queue wait metrics.
+
+        Returns:
+            dict: The metrics.
+        """
+
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["batch_sizes"] = dict(self._stats["batch_sizes"])
+
+        batches = stats["batches"]
+        stats["avg_batch_size"] = stats["items"] / batches if batches else 0
+        stats["avg_wait"] = stats["wait_total"] / stats["items"] \
+                            if stats["items"] else 0
+        stats["queue_depth"] = self._requests.qsize()
+
+        return stats
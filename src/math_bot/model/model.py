@@ -13,21 +13,17 @@ are changed with regard to the coding style conventions.
 """
 
 import json
+import os
 import random as rnd
-import re
 
 from collections import defaultdict
 
-import nltk
 import numpy as np
-import textcleaner as tc
 
-from trax import layers as tl
-from trax.fastmath import numpy as fastnp
+from .tokenizer import tokenize
 
-nltk.download('punkt')
-nltk.download('stopwords')
-nltk.download('wordnet')
+class InputTooLong(ValueError):
+    """Raised when a sentence is longer than the supported length."""
 
 def siamese(vocab_size, d_model=128):
     """Returns a Siamese model.
@@ -41,6 +37,11 @@ def siamese(vocab_size, d_model=128):
         trax.layers.combinators.Parallel: A Siamese model.
     """
 
+    # trax (and JAX) are only imported when a trax model is needed.
+    # pylint: disable=import-outside-toplevel
+    from trax import layers as tl
+    from trax.fastmath import numpy as fastnp
+
     def normalize(vec):  # normalizes the vectors to have L2 norm 1
         return vec / fastnp.sqrt(fastnp.sum(vec * vec, axis=-1, keepdims=True))
 
@@ -55,24 +56,72 @@ def siamese(vocab_size, d_model=128):
     model = tl.Parallel(s_processor, s_processor)
     return model
 
-def data_loader(vocab_path, model_path):
+def encoder(model):
+    """Returns one branch of the Siamese model.
+
+    Both branches of the model share the same weights, so a single one is
+    enough for turning sentences into vectors.
+
+    Args:
+        model (trax.layers.combinators.Parallel): The Siamese model.
+
+    Returns:
+        trax.layers.combinators.Serial: The sentence processor.
+    """
+
+    return model.sublayers[0]
+
+def vocab_loader(vocab_path):
+    """Loads the vocabulary from a file.
+
+    Args:
+        vocab_path (str): The path to the vocabulary file. If the compiled
+                          vocabulary (en_vocab.bin for en_vocab.txt) exists,
+                          it is memory-mapped instead (see vocabulary).
+
+    Returns:
+        defaultdict or vocabulary.CompactVocab: The vocabulary.
+    """
+
+    compiled_path = os.path.splitext(vocab_path)[0] + ".bin"
+    if os.path.exists(compiled_path):
+        # pylint: disable=import-outside-toplevel
+        from .vocabulary import CompactVocab
+        return CompactVocab(compiled_path)
+
+    with open(vocab_path, "r", encoding="utf-8") as fin:
+        vocab_dict = json.load(fin)
+
+    return defaultdict(lambda: 0, vocab_dict)
+
+def data_loader(vocab_path, model_path, engine="trax"):
     """Loads the vocabulary and the model from files.
 
     Args:
-        vocab_path (str): The path to the vocabulary file.
+        vocab_path (str): The path to the vocabulary file (see vocab_loader).
         model_path (str): The path to the model file.
+        engine (str, optional): "trax" or "numpy" (see numpy_engine, trax is
+                                not imported). Defaults to "trax".
+
+    Raises:
+        ValueError: If the engine is unknown.
 
     Returns:
         (defaultdict, trax.layers.combinators.Parallel): A tuple containing the
                                                vocabulary and the Siamese model.
     """
 
-    with open(vocab_path, "r") as fin:
-        vocab_dict = json.load(fin)
+    vocab = vocab_loader(vocab_path)
 
-    vocab = defaultdict(lambda: 0, vocab_dict)
-    model = siamese(len(vocab), 256)
-    model.init_from_file(model_path)
+    if engine == "numpy":
+        # pylint: disable=import-outside-toplevel
+        from .numpy_engine import load
+        model = load(model_path)
+    elif engine == "trax":
+        model = siamese(len(vocab), 256)
+        model.init_from_file(model_path)
+    else:
+        raise ValueError(f"Unknown model engine {engine}")
 
     return (vocab, model)
 
@@ -85,35 +134,7 @@ def data_tokenizer(sentence):
         list: The transformed input sentence.
     """
 
-    if sentence == "":
-        return ""
-
-    sentence = tc.lower_all(sentence)[0]
-
-    # Change tabs to spaces
-    sentence = re.sub(r"\t+_+", " ", sentence)
-    # Change short forms
-    sentence = re.sub(r"\'ve", " have", sentence)
-    sentence = re.sub(r"(can\'t|can not)", "cannot", sentence)
-    sentence = re.sub(r"n\'t", " not", sentence)
-    sentence = re.sub(r"I\'m", "I am", sentence)
-    sentence = re.sub(r" m ", " am ", sentence)
-    sentence = re.sub(r"(\'re| r )", " are ", sentence)
-    sentence = re.sub(r"\'d", " would ", sentence)
-    sentence = re.sub(r"\'ll", " will ", sentence)
-    sentence = re.sub(r"(\d+)(k)", r"\g<1>000", sentence)
-    # Make word separations
-    sentence = re.sub(r"(\+|-|\*|\/|\^|\.)", " $1 ", sentence)
-    # Remove irrelevant stuff, nonprintable characters and spaces
-    sentence = re.sub(r"(\'s|\'S|\'|\"|,|[^ -~]+)", "", sentence)
-    sentence = tc.strip_all(sentence)[0]
-    # Remove dot (encoded by textcleaner with $1), if necessary
-    sentence = re.sub(r" *\$1 *$", "", sentence)
-
-    if sentence == "":
-        return ""
-
-    return tc.token_it(tc.lemming(tc.stemming(sentence)))[0]
+    return tokenize(sentence)
 
 def data_gen(sentences1, sentences2, batch_size, pad=1, shuffle=False):
     """Generator function that yields batches of data
@@ -187,6 +208,143 @@ def data_gen(sentences1, sentences2, batch_size, pad=1, shuffle=False):
             # reset the batches
             input1, input2 = [], []
 
+def pad_len(length):
+    """Computes the padded length of a tensor (the next power of 2).
+
+    Args:
+        length (int): The length of the tensor.
+
+    Returns:
+        int: The padded length.
+    """
+
+    return 2 ** int(np.ceil(np.log2(max(length, 1))))
+
+def encode(sentence, vocab, max_len=None, truncate=True):
+    """Function for turning a sentence into a tensor (list of word ids).
+
+    Args:
+        sentence (str): The input sentence.
+        vocab (collections.defaultdict): The vocabulary used.
+        max_len (int, optional): The maximum number of words. Defaults to None
+                                 (no limit).
+        truncate (bool, optional): If longer sentences should be truncated or
+                                   rejected. Defaults to True.
+
+    Raises:
+        InputTooLong: If the sentence is too long and it is not truncated.
+
+    Returns:
+        list: The encoded sentence.
+    """
+
+    tensor = [vocab[word] for word in data_tokenizer(sentence)]
+
+    if max_len is not None and len(tensor) > max_len:
+        if not truncate:
+            raise InputTooLong(f"{len(tensor)} words, {max_len} allowed")
+
+        tensor = tensor[:max_len]
+
+    return tensor
+
+def pair_len(length1, length2):
+    """Computes the padded length of a pair of tensors compared to each other.
+    Both are padded to the same length, as data_gen (and predict) does, since
+    the mean of the LSTM outputs includes the pads.
+
+    Args:
+        length1 (int): The length of the first tensor.
+        length2 (int): The length of the second tensor.
+
+    Returns:
+        int: The padded length.
+    """
+
+    return pad_len(max(length1, length2))
+
+def embed_tensors(tensors, model, pad=1, lengths=None):
+    """Function for turning encoded sentences into normalized vectors.
+
+    The tensors are grouped by their padded length and the model is run once
+    for every padded length. The batches are padded to a power of 2, too, so
+    only a few input shapes ever get compiled.
+
+    Args:
+        tensors (list): List of encoded sentences (list of word ids).
+        model (trax.layers.combinators.Parallel): The Siamese model.
+        pad (int, optional): Pad character from the vocab. Defaults to 1.
+        lengths (list, optional): The padded length of every tensor (see
+                                  pair_len). Defaults to None (pad_len of the
+                                  tensor's own length).
+
+    Returns:
+        numpy.ndarray: The vectors, one row for each tensor.
+    """
+
+    s_processor = encoder(model)
+
+    if lengths is None:
+        lengths = [pad_len(len(tensor)) for tensor in tensors]
+
+    buckets = defaultdict(list)
+    for idx, length in enumerate(lengths):
+        buckets[length].append(idx)
+
+    vectors = [None] * len(tensors)
+    for max_len, indexes in buckets.items():
+        batch = [tensors[idx] + [pad] * (max_len - len(tensors[idx]))
+                 for idx in indexes]
+        batch += [[pad] * max_len] * (pad_len(len(batch)) - len(batch))
+        for idx, vec in zip(indexes, np.asarray(s_processor(np.array(batch)))):
+            vectors[idx] = vec
+
+    return np.array(vectors)
+
+def warm_up(model, max_len, max_batch=1, pad=1):
+    """Runs the model on every supported input shape, so the compilation of
+    the model does not happen while serving requests.
+
+    Args:
+        model (trax.layers.combinators.Parallel): The Siamese model.
+        max_len (int): The maximum number of words in a sentence.
+        max_batch (int, optional): The maximum batch size. Defaults to 1.
+        pad (int, optional): Pad character from the vocab. Defaults to 1.
+
+    Returns:
+        int: The number of input shapes.
+    """
+
+    s_processor = encoder(model)
+    num_shapes = 0
+
+    length = 1
+    while length <= pad_len(max_len):
+        batch_size = 1
+        while batch_size <= pad_len(max_batch):
+            s_processor(np.full((batch_size, length), pad))
+            num_shapes += 1
+            batch_size *= 2
+        length *= 2
+
+    return num_shapes
+
+def embed(sentences, model, vocab):
+    """Function for turning sentences into normalized vectors.
+
+    Args:
+        sentences (list): List of sentences (str).
+        model (trax.layers.combinators.Parallel): The Siamese model.
+        vocab (collections.defaultdict): The vocabulary used.
+
+    Returns:
+        numpy.ndarray: The vectors, one row for each sentence.
+    """
+
+    tensors = [encode(sentence, vocab) for sentence in sentences]
+
+    return embed_tensors(tensors, model, vocab["<PAD>"])
+
 def predict(sentences, threshold, model, vocab, data_generator=data_gen):
     """Function for predicting if two sentences are duplicates.
 
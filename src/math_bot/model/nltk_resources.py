@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The NLTK resources needed by the tokenizer
+
+The resources are downloaded when the image is built, to the directory named
+by NLTK_DATA, and NLTK loads them from there on their first use, so starting
+the central component never touches the network. Downloading them (from
+src/math_bot):
+    NLTK_DATA=/tmp/nltk_data python -m model.nltk_resources download
+Checking that they are all installed, without loading them:
+    python -m model.nltk_resources check
+Measuring the time until the tokenizer is ready (importing the model package
+and tokenizing the first sentence, in a new process):
+    python -m model.nltk_resources time
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from argparse import ArgumentParser
+
+import nltk
+
+# The resources, by their name for nltk.download, and their path for
+# nltk.data.find. punkt is used by word_tokenize, wordnet (and, since NLTK
+# 3.6.6, omw-1.4) by WordNetLemmatizer and stopwords by textcleaner, which
+# loads them when imported by reference_tokenize.
+NLTK_RESOURCES = {
+    "punkt": "tokenizers/punkt",
+    "wordnet": "corpora/wordnet",
+    "omw-1.4": "corpora/omw-1.4",
+    "stopwords": "corpora/stopwords"
+}
+
+def missing_resources():
+    """
+    Returns:
+        list: The names of the resources which are not installed. Nothing is
+              loaded or downloaded.
+    """
+
+    missing = []
+    for (name, path) in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            # The corpora may be installed as zip files only.
+            try:
+                nltk.data.find(f"{path}.zip")
+            except LookupError:
+                missing.append(name)
+
+    return missing
+
+def download(directory=None):
+    """Download the resources.
+
+    Args:
+        directory (str, optional): Where to download them. Defaults to None
+                                   (NLTK_DATA, or NLTK's default directory).
+    Raises:
+        ValueError: If a resource cannot be downloaded.
+    """
+
+    directory = directory or os.getenv("NLTK_DATA")
+
+    for name in NLTK_RESOURCES:
+        if not nltk.download(name, download_dir=directory, quiet=True,
+                             raise_on_error=True):
+            raise ValueError(f"Cannot download {name}")
+
+def time_to_ready(sentence):
+    """
+    Measure, in a new process, how long importing the model package and
+    tokenizing the first sentence (which loads the resources) take.
+
+    Args:
+        sentence (str): The sentence.
+    Returns:
+        dict: The seconds of both steps.
+    """
+
+    script = (
+        "import json, sys, timeit\n"
+        "start = timeit.default_timer()\n"
+        "import model\n"
+        "imported = timeit.default_timer()\n"
+        "model.data_tokenizer(sys.argv[1])\n"
+        "print(json.dumps({\n"
+        "    'import_seconds': round(imported - start, 3),\n"
+        "    'first_tokenize_seconds':\n"
+        "        round(timeit.default_timer() - imported, 3)}))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", script, sentence],
+                            check=True, capture_output=True, text=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Manage the NLTK resources of the "
+                                        "tokenizer.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    download_parser = subparsers.add_parser(
+        "download", help="download the resources (at build time)")
+    download_parser.add_argument("directory", nargs="?", default=None,
+                                 help="the directory (default: NLTK_DATA)")
+    subparsers.add_parser("check", help="check that they are installed")
+    time_parser = subparsers.add_parser(
+        "time", help="measure the time until the tokenizer is ready")
+    time_parser.add_argument("--sentence",
+                             default="The sum of the angles is 180 degrees.")
+
+    args = parser.parse_args()
+
+    if args.command == "download":
+        download(args.directory)
+    elif args.command == "check":
+        MISSING = missing_resources()
+        if MISSING:
+            print(f"Missing NLTK resources: {', '.join(MISSING)}")
+            sys.exit(1)
+        print("All NLTK resources are installed")
+    else:
+        print(json.dumps(time_to_ready(args.sentence)))
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The NumPy inference engine of the Siamese model
+
+The same forward pass as model.siamese (Embedding, LSTM, Mean, Normalize),
+written with NumPy only, so serving does not import trax and JAX. The input
+projection of the LSTM is computed for every word of the batch with a single
+matrix product, only the recurrent part runs word by word. The padding words
+go through the LSTM and into the mean, as in trax, so the vectors are the same.
+
+The weights are read from trax's checkpoint without trax, or from a .npz file
+exported once (from src/math_bot):
+    python -m model.numpy_engine export model/trax_model/model.pkl.gz \\
+        model/trax_model/model.npz
+The engine is compared to trax (which must be installed) on the courses'
+answers and benchmarked (latency, memory, import and load time) with:
+    python -m model.numpy_engine parity
+    python -m model.numpy_engine benchmark
+"""
+
+import gzip
+import io
+import json
+import os
+import pickle
+import resource
+import subprocess
+import sys
+import timeit
+
+from argparse import ArgumentParser
+from functools import partial
+
+import numpy as np
+
+class _Placeholder:
+    # pylint: disable=too-few-public-methods
+    """Stands for the trax objects of a checkpoint (e.g. the input signature),
+    which are not needed for inference.
+    """
+
+    def __init__(self, *_args, **_kwargs):
+        pass
+
+    def __setstate__(self, _state):
+        pass
+
+class _CheckpointUnpickler(pickle.Unpickler):
+    """Unpickles a trax checkpoint without importing trax or JAX."""
+
+    def find_class(self, module, name):
+        if module.split(".")[0] in ("numpy", "collections", "builtins"):
+            return super().find_class(module, name)
+
+        return _Placeholder
+
+def _unpickle(data):
+    """
+    Returns:
+        The object of a pickle, the trax objects replaced by placeholders.
+    """
+
+    return _CheckpointUnpickler(io.BytesIO(data)).load()
+
+def _from_bits(weights):
+    """
+    Returns:
+        list: The weights as float32 arrays, the bfloat16 ones (stored by trax
+              as (uint16 bits, "bfloat16")) converted.
+    """
+
+    arrays = []
+    for weight in weights:
+        if isinstance(weight, tuple):
+            (bits, _) = weight
+            weight = (np.asarray(bits, dtype=np.uint32) << 16).view(np.float32)
+        arrays.append(np.asarray(weight, dtype=np.float32))
+
+    return arrays
+
+def read_checkpoint(path):
+    """
+    Read the Siamese model's weights from a trax checkpoint (model.pkl.gz and,
+    for the sharded ones, model.pkl.gz.shard<N>).
+
+    Args:
+        path (str): The path of the checkpoint.
+    Raises:
+        ValueError: If the weights are not those of the Siamese model.
+    Returns:
+        dict: The weights: "embedding" (vocabulary size x d_model), "lstm_w"
+              (2 * d_model x 4 * d_model) and "lstm_b" (4 * d_model).
+    """
+
+    with gzip.open(path, "rb") as fin:
+        checkpoint = _unpickle(fin.read())
+
+    flat_weights = checkpoint["flat_weights"]
+    if isinstance(flat_weights, int):
+        # The number of shards, each a (non-compressed) pickled list.
+        shards = flat_weights
+        flat_weights = []
+        for shard in range(shards):
+            with open(f"{path}.shard{shard}", "rb") as fin:
+                flat_weights += _unpickle(fin.read())
+
+    # Both branches share the weights, only the first one's are stored.
+    flat_weights = _from_bits(flat_weights)
+    if len(flat_weights) != 3:
+        raise ValueError(f"{len(flat_weights)} weights, expected 3")
+
+    embedding = flat_weights[0]
+    lstm_w = flat_weights[1]
+    lstm_b = flat_weights[2]
+    d_model = embedding.shape[1]
+    if lstm_w.shape != (2 * d_model, 4 * d_model) or \
+       lstm_b.shape != (4 * d_model, ):
+        raise ValueError(f"Unexpected shapes {embedding.shape}, "
+                         f"{lstm_w.shape}, {lstm_b.shape}")
+
+    return {"embedding": embedding, "lstm_w": lstm_w, "lstm_b": lstm_b}
+
+def export(checkpoint_path, npz_path):
+    """Write the weights of a trax checkpoint to a .npz file.
+
+    Args:
+        checkpoint_path (str): The path of the checkpoint.
+        npz_path (str): The path of the .npz file.
+    """
+
+    np.savez(npz_path, **read_checkpoint(checkpoint_path))
+
+def sigmoid(vec):
+    """The logistic function, computed without overflow."""
+
+    return 0.5 * (np.tanh(0.5 * vec) + 1)
+
+class NumpyEncoder:
+    # pylint: disable=too-few-public-methods
+    """One branch of the Siamese model: turns encoded sentences (a batch of
+    word ids, padded to the same length) into normalized vectors.
+    """
+
+    def __init__(self, embedding, lstm_w, lstm_b):
+        """
+        Args:
+            embedding (numpy.ndarray): The embedding of every word id.
+            lstm_w (numpy.ndarray): The LSTM's kernel, the input's rows first,
+                                    then the hidden state's.
+            lstm_b (numpy.ndarray): The LSTM's bias.
+        """
+
+        self.d_model = embedding.shape[1]
+        self.embedding = embedding
+        self.w_input = np.ascontiguousarray(lstm_w[:self.d_model])
+        self.w_hidden = np.ascontiguousarray(lstm_w[self.d_model:])
+        self.bias = lstm_b
+
+    def __call__(self, tokens):
+        """
+        Args:
+            tokens (numpy.ndarray): The word ids, of shape (batch, length).
+        Returns:
+            numpy.ndarray: The normalized vectors, of shape (batch, d_model).
+        """
+
+        tokens = np.asarray(tokens)
+        (batch, length) = tokens.shape
+        units = self.d_model
+
+        # The gates' input part, for every word at once, as (length, batch,
+        # 4 * d_model). The ids past the embedding are clipped, as by JAX.
+        gates_x = np.take(self.embedding, tokens.T, axis=0, mode="clip") @ \
+                  self.w_input + self.bias
+
+        cell = np.zeros((batch, units), dtype=np.float32)
+        hidden = np.zeros((batch, units), dtype=np.float32)
+        total = np.zeros((batch, units), dtype=np.float32)
+
+        for step in range(length):
+            gates = gates_x[step] + hidden @ self.w_hidden
+
+            # The input gate, the new input, the forget and output gates.
+            cell = cell * sigmoid(gates[:, 2 * units:3 * units]) + \
+                   sigmoid(gates[:, :units]) * \
+                   np.tanh(gates[:, units:2 * units])
+            hidden = np.tanh(cell) * sigmoid(gates[:, 3 * units:])
+            total += hidden
+
+        vec = total / length
+
+        return vec / np.sqrt(np.sum(vec * vec, axis=-1, keepdims=True))
+
+class NumpySiamese:
+    # pylint: disable=too-few-public-methods
+    """The Siamese model, with the interface of the trax model used by the
+    rest of the package: model((s1, s2)) and its branches in sublayers.
+    """
+
+    def __init__(self, embedding, lstm_w, lstm_b):
+        """
+        Args:
+            embedding (numpy.ndarray): The embedding of every word id.
+            lstm_w (numpy.ndarray): The LSTM's kernel.
+            lstm_b (numpy.ndarray): The LSTM's bias.
+        """
+
+        processor = NumpyEncoder(embedding, lstm_w, lstm_b)
+        self.sublayers = [processor, processor]
+
+    def __call__(self, inputs):
+        """
+        Args:
+            inputs (tuple): The two batches of word ids.
+        Returns:
+            tuple: The two batches of normalized vectors.
+        """
+
+        return tuple(processor(tokens)
+                     for (processor, tokens) in zip(self.sublayers, inputs))
+
+def load(model_path):
+    """
+    Load the Siamese model for the NumPy engine.
+
+    Args:
+        model_path (str): A .npz file or a trax checkpoint. For a checkpoint,
+                          the .npz file next to it (model.npz for
+                          model.pkl.gz) is used if it exists.
+    Returns:
+        NumpySiamese: The model.
+    """
+
+    npz_path = model_path
+    if not model_path.endswith(".npz"):
+        npz_path = os.path.join(os.path.dirname(model_path),
+                                os.path.basename(model_path).split(".")[0] +
+                                ".npz")
+
+    if os.path.exists(npz_path):
+        with np.load(npz_path) as weights:
+            weights = {name: weights[name].astype(np.float32)
+                       for name in weights.files}
+    else:
+        weights = read_checkpoint(model_path)
+
+    return NumpySiamese(**weights)
+
+def parity(vocab_path, model_path, data_file):
+    """
+    Compare the NumPy engine to trax on the courses' answers, as single
+    sentences and as pairs through model((s1, s2)).
+
+    Returns:
+        dict: The largest differences of the vectors and of the similarities.
+    """
+
+    # pylint: disable=import-outside-toplevel,too-many-locals
+    from .model import data_loader, embed_tensors, encode
+
+    (vocab, trax_model) = data_loader(vocab_path, model_path, engine="trax")
+    numpy_model = load(model_path)
+
+    with open(data_file, "r", encoding="utf-8") as fin:
+        courses_data = json.load(fin)
+    sentences = [q["mid_question_ans"]
+                 for q in courses_data.get("mid_questions", [])]
+    sentences += [q["test_step_ans"]
+                  for q in courses_data.get("test_steps", [])]
+    sentences += [step["course_step_text"]
+                  for step in courses_data.get("course_steps", [])]
+
+    tensors = [encode(sentence, vocab, 64) for sentence in sentences]
+    pad = vocab["<PAD>"]
+    trax_vectors = embed_tensors(tensors, trax_model, pad)
+    numpy_vectors = embed_tensors(tensors, numpy_model, pad)
+
+    # The pairs, as trax's model((s1, s2)) computes them.
+    length = max(len(tensor) for tensor in tensors)
+    batch = np.array([tensor + [pad] * (length - len(tensor))
+                      for tensor in tensors])
+    (trax1, trax2) = trax_model((batch, batch[::-1]))
+    (numpy1, numpy2) = numpy_model((batch, batch[::-1]))
+
+    return {
+        "sentences": len(sentences),
+        "max_vector_diff": float(np.max(np.abs(trax_vectors -
+                                               numpy_vectors))),
+        "max_pair_diff": float(max(np.max(np.abs(np.asarray(trax1) - numpy1)),
+                                   np.max(np.abs(np.asarray(trax2) -
+                                                 numpy2)))),
+        "max_similarity_diff": float(np.max(np.abs(
+            np.sum(np.asarray(trax1) * np.asarray(trax2), axis=-1) -
+            np.sum(numpy1 * numpy2, axis=-1))))
+    }
+
+def measure_load(engine, vocab_path, model_path):
+    """
+    Load the model with an engine, in this process.
+
+    Returns:
+        dict: The import and load time and the peak memory (RSS) of the
+              process.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    start = timeit.default_timer()
+    from . import model as model_module
+    imported = timeit.default_timer()
+    (vocab, model) = model_module.data_loader(vocab_path, model_path,
+                                              engine=engine)
+    model_module.embed(["warm up"], model, vocab)
+    loaded = timeit.default_timer()
+
+    return {"engine": engine,
+            "import_seconds": round(imported - start, 3),
+            "load_seconds": round(loaded - imported, 3),
+            "max_rss_mb": round(resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+def benchmark(engines, vocab_path, model_path, batches, length, number):
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """
+    Benchmark the engines, each in a new process: the time to import the
+    model package and to load the model, the peak memory and the latency of
+    embedding batches of sentences.
+
+    Returns:
+        list: The results of every engine.
+    """
+
+    results = []
+    for engine in engines:
+        output = subprocess.run(
+            [sys.executable, "-m", "model.numpy_engine", "measure", engine,
+             "--vocab", vocab_path, "--model", model_path,
+             "--batches", *map(str, batches), "--length", str(length),
+             "--number", str(number)],
+            check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    return results
+
+def measure(engine, vocab_path, model_path, batches, length, number):
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """
+    Measure an engine in this process (see benchmark).
+
+    Returns:
+        dict: The results.
+    """
+
+    # pylint: disable=import-outside-toplevel,too-many-locals
+    result = measure_load(engine, vocab_path, model_path)
+    from .model import data_loader, encoder
+
+    (vocab, model) = data_loader(vocab_path, model_path, engine=engine)
+    processor = encoder(model)
+    rng = np.random.default_rng(0)
+
+    for batch in batches:
+        tokens = rng.integers(2, len(vocab), size=(batch, length))
+        # The first run compiles the shape, for trax.
+        processor(tokens)
+        seconds = timeit.timeit(partial(processor, tokens),
+                                number=number) / number
+        result[f"batch_{batch}_ms"] = round(seconds * 1000, 3)
+
+    result["max_rss_mb"] = round(resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    return result
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Export, check and benchmark the "
+                                        "NumPy inference engine.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser(
+        "export", help="write the weights of a checkpoint to a .npz file")
+    export_parser.add_argument("checkpoint", nargs="?",
+                               default="model/trax_model/model.pkl.gz")
+    export_parser.add_argument("npz", nargs="?",
+                               default="model/trax_model/model.npz")
+
+    for command in ("parity", "benchmark", "measure"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("--vocab", default="model/data/en_vocab.txt")
+        subparser.add_argument("--model",
+                               default="model/trax_model/model.pkl.gz")
+        if command == "parity":
+            subparser.add_argument("--data", default="../../courses.json")
+        else:
+            if command == "measure":
+                subparser.add_argument("engine")
+            else:
+                subparser.add_argument("--engines", nargs="+",
+                                       default=["trax", "numpy"])
+            subparser.add_argument("--batches", type=int, nargs="+",
+                                   default=[1, 8, 32])
+            subparser.add_argument("--length", type=int, default=16)
+            subparser.add_argument("--number", type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export(args.checkpoint, args.npz)
+    elif args.command == "parity":
+        print(json.dumps(parity(args.vocab, args.model, args.data)))
+    elif args.command == "benchmark":
+        for report in benchmark(args.engines, args.vocab, args.model,
+                                args.batches, args.length, args.number):
+            print(json.dumps(report))
+    else:
+        print(json.dumps(measure(args.engine, args.vocab, args.model,
+                                 args.batches, args.length, args.number)))
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - Re-scoring the logged answers
+
+Grades the answers of the logs written by the central component (the CSV
+user_input.csv, or a worker's user_input-<pid>.csv, and the rotated, gzip
+compressed ones) again, with another model or other thresholds, and compares
+the result to the logged prediction.
+The logs are read in chunks: a process pool tokenizes the next chunks while
+the model embeds the current one. As when grading, an answer and its
+reference are padded to their shared length (see pair_len) and the similarity
+is the dot product of their vectors. Every reference (at every padded length)
+and every distinct answer of a chunk is embedded once, in batches of sentences
+of similar length (see embed_tensors). Example, from src/math_bot:
+    python -m model.rescore ../../logs/user_input*.csv* \\
+        --model model/trax_model/model.pkl.gz --engine numpy \\
+        --thresholds 0.6 0.7 --output rescored.csv
+It writes a row for every answer (the similarity and the prediction for every
+threshold) and prints the statistics (how many predictions agree with the
+logged ones, for every threshold) as JSON.
+"""
+
+import csv
+import gzip
+import json
+import os
+import timeit
+
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .model import data_loader, embed_tensors, encode, pair_len, \
+                   vocab_loader
+
+# The vocabulary of a tokenizing process, loaded once.
+_VOCAB = None
+# The tensors of the references already seen by a tokenizing process.
+_REF_TENSORS = {}
+
+def read_rows(paths):
+    """
+    Read the graded answers of logs, skipping their headers and the malformed
+    rows.
+
+    Args:
+        paths (list): The logs, the ones ending in .gz being compressed.
+    Yields:
+        tuple: The answer, the reference and the logged prediction (None if
+               it was not logged).
+    """
+
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+
+        with opener(path, "rt", newline="", encoding="utf-8") as fin:
+            for row in csv.reader(fin):
+                if len(row) < 2 or row[0].strip() == "message":
+                    continue
+
+                prediction = None
+                if len(row) > 2 and row[2].strip() in ("0", "1"):
+                    prediction = int(row[2])
+
+                yield (row[0], row[1], prediction)
+
+def chunked(rows, size):
+    """
+    Yields:
+        list: The rows, size at a time.
+    """
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+def _init_tokenizer(vocab_path):
+    """Loads the vocabulary of a tokenizing process."""
+
+    global _VOCAB  # pylint: disable=global-statement
+    _VOCAB = vocab_loader(vocab_path)
+
+def _encode_chunk(chunk, max_len):
+    """
+    Encode the answers and the references of a chunk, as the central component
+    does: the answers are truncated to max_len words, the references are not.
+
+    Returns:
+        tuple: The answers' tensors and a dict of the references' tensors.
+    """
+
+    answers = [encode(message, _VOCAB, max_len) for (message, _, _) in chunk]
+
+    references = {}
+    for (_, reference, _) in chunk:
+        if reference not in references:
+            if reference not in _REF_TENSORS:
+                _REF_TENSORS[reference] = encode(reference, _VOCAB)
+            references[reference] = _REF_TENSORS[reference]
+
+    return (answers, references)
+
+def embed_batched(tensors, lengths, model, pad, batch_size):
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """
+    Embed tensors, padded to the given lengths, in batches of at most
+    batch_size, of similar lengths.
+
+    Returns:
+        numpy.ndarray: The vectors, one row for each tensor.
+    """
+
+    order = sorted(range(len(tensors)), key=lambda idx: lengths[idx])
+    vectors = [None] * len(tensors)
+
+    for start in range(0, len(order), batch_size):
+        indexes = order[start:start + batch_size]
+        for idx, vec in zip(indexes,
+                            embed_tensors([tensors[idx] for idx in indexes],
+                                          model, pad,
+                                          [lengths[idx] for idx in indexes])):
+            vectors[idx] = vec
+
+    return np.array(vectors)
+
+class Rescorer:
+    # pylint: disable=too-many-instance-attributes
+    """Grades the chunks of answers and keeps the statistics."""
+
+    def __init__(self, model, pad, thresholds, writer, batch_size=256):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        """
+        Args:
+            model: The Siamese model.
+            pad (int): The id of <PAD>.
+            thresholds (list): The thresholds of a hit.
+            writer: The csv.writer of the output, None for none.
+            batch_size (int, optional): The maximum number of sentences run
+                                        through the model at once. Defaults
+                                        to 256.
+        """
+
+        self.model = model
+        self.pad = pad
+        self.thresholds = thresholds
+        self.writer = writer
+        self.batch_size = batch_size
+
+        # (reference, padded length) -> its vector
+        self._ref_vectors = {}
+        self.rows = 0
+        self.logged = 0
+        self.unique_answers = 0
+        self.similarity_total = 0.0
+        self.stats = {threshold: {"hits": 0, "agree": 0, "logged_hit_new_miss":
+                                  0, "logged_miss_new_hit": 0}
+                      for threshold in thresholds}
+
+    def header(self):
+        """
+        Returns:
+            list: The columns of the output.
+        """
+
+        return ["message", "reference", "logged_prediction", "similarity"] + \
+               [f"prediction_{threshold}" for threshold in self.thresholds]
+
+    def grade(self, chunk, answers, references):
+        """Grades a chunk of rows, given their tensors (see _encode_chunk)."""
+
+        # Every answer is padded to the length it shares with its reference.
+        keys = [(reference, pair_len(len(tensor), len(references[reference])))
+                for (tensor, (_, reference, _)) in zip(answers, chunk)]
+
+        new_refs = [key for key in dict.fromkeys(keys)
+                    if key not in self._ref_vectors]
+        if new_refs:
+            vectors = embed_batched([references[ref] for (ref, _) in new_refs],
+                                    [length for (_, length) in new_refs],
+                                    self.model, self.pad, self.batch_size)
+            self._ref_vectors.update(zip(new_refs, vectors))
+
+        # Every distinct answer of the chunk is embedded once for every
+        # padded length.
+        unique = {}
+        indexes = [unique.setdefault((tuple(tensor), length), len(unique))
+                   for (tensor, (_, length)) in zip(answers, keys)]
+        answer_vectors = embed_batched([list(tensor)
+                                        for (tensor, _) in unique],
+                                       [length for (_, length) in unique],
+                                       self.model, self.pad, self.batch_size)
+        ref_vectors = np.array([self._ref_vectors[key] for key in keys])
+        similarities = np.sum(answer_vectors[indexes] * ref_vectors, axis=-1)
+
+        self.unique_answers += len(unique)
+        self._record(chunk, similarities)
+
+    def _record(self, chunk, similarities):
+        """Updates the statistics and writes the graded rows."""
+
+        self.rows += len(chunk)
+        self.similarity_total += float(np.sum(similarities))
+
+        for ((message, reference, logged), sim) in zip(chunk, similarities):
+            predictions = [int(sim > threshold)
+                           for threshold in self.thresholds]
+
+            if logged is not None:
+                self.logged += 1
+            for (threshold, prediction) in zip(self.thresholds, predictions):
+                stats = self.stats[threshold]
+                stats["hits"] += prediction
+                if logged is None:
+                    continue
+                if prediction == logged:
+                    stats["agree"] += 1
+                elif logged:
+                    stats["logged_hit_new_miss"] += 1
+                else:
+                    stats["logged_miss_new_hit"] += 1
+
+            if self.writer is not None:
+                self.writer.writerow(
+                    [message, reference, "" if logged is None else logged,
+                     f"{sim:.6f}"] + predictions)
+
+    def report(self):
+        """
+        Returns:
+            dict: The statistics, the agreement being the share of the logged
+                  predictions which are the same.
+        """
+
+        thresholds = {}
+        for (threshold, stats) in self.stats.items():
+            thresholds[str(threshold)] = {
+                **stats,
+                "agreement": round(stats["agree"] / self.logged, 4)
+                             if self.logged else None
+            }
+
+        return {"rows": self.rows,
+                "logged_predictions": self.logged,
+                "unique_answers": self.unique_answers,
+                "unique_references": len({reference for (reference, _)
+                                          in self._ref_vectors}),
+                "mean_similarity": round(self.similarity_total / self.rows, 4)
+                                   if self.rows else None,
+                "thresholds": thresholds}
+
+def rescore(args):
+    """
+    Re-score the logs given on the command line.
+
+    Returns:
+        dict: The statistics, with the duration and the rows per second.
+    """
+
+    start = timeit.default_timer()
+    (vocab, model) = data_loader(args.vocab, args.model, args.engine)
+
+    out_file = None
+    writer = None
+    if args.output:
+        # pylint: disable=consider-using-with
+        out_file = open(args.output, "w", newline="", encoding="utf-8")
+        writer = csv.writer(out_file)
+
+    rescorer = Rescorer(model, vocab["<PAD>"], args.thresholds, writer,
+                        args.batch_size)
+    if writer is not None:
+        writer.writerow(rescorer.header())
+
+    chunks = chunked(read_rows(args.logs), args.chunk_size)
+
+    if args.workers:
+        with ProcessPoolExecutor(args.workers, initializer=_init_tokenizer,
+                                 initargs=(args.vocab, )) as pool:
+            # At most two chunks per process are read ahead.
+            pending = deque()
+            for chunk in chunks:
+                pending.append(
+                    (chunk, pool.submit(_encode_chunk, chunk, args.max_len)))
+                if len(pending) > 2 * args.workers:
+                    (chunk, future) = pending.popleft()
+                    rescorer.grade(chunk, *future.result())
+            while pending:
+                (chunk, future) = pending.popleft()
+                rescorer.grade(chunk, *future.result())
+    else:
+        _init_tokenizer(args.vocab)
+        for chunk in chunks:
+            rescorer.grade(chunk, *_encode_chunk(chunk, args.max_len))
+
+    if out_file is not None:
+        out_file.close()
+
+    report = rescorer.report()
+    report["seconds"] = round(timeit.default_timer() - start, 2)
+    report["rows_per_second"] = round(report["rows"] / report["seconds"]) \
+                                if report["seconds"] else None
+
+    return report
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Grade the logged answers again, with "
+                                        "another model or thresholds.")
+    parser.add_argument("logs", nargs="+",
+                        help="the logs (user_input*.csv, .csv.gz)")
+    parser.add_argument("--vocab", default="model/data/en_vocab.txt")
+    parser.add_argument("--model", default="model/trax_model/model.pkl.gz")
+    parser.add_argument("--engine", choices=["trax", "numpy"],
+                        default="trax")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.6],
+                        help="the thresholds of a hit (default: 0.6)")
+    parser.add_argument("--output", default=None,
+                        help="the CSV of the graded rows (default: none)")
+    parser.add_argument("--workers", type=int,
+                        default=max(1, (os.cpu_count() or 2) - 1),
+                        help="the tokenizing processes, 0 for none")
+    parser.add_argument("--chunk-size", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--max-len", type=int,
+                        default=int(os.getenv("MAX_SENTENCE_LEN", "64")),
+                        help="the answers' maximum number of words")
+
+    print(json.dumps(rescore(parser.parse_args()), indent=1))
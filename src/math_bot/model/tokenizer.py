@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The sentence tokenizer
+
+The tokenizer gives the same output as the original textcleaner based one (kept
+as reference_tokenize, which fails on sentences having nothing left after
+cleaning), but the patterns are compiled once, independent contraction rules
+are expanded in a single pass and the stemming and lemmatization results of
+every word are cached.
+
+Parity check against the reference implementation, on the logged answers:
+    python -m model.tokenizer ../../logs/user_input.csv
+"""
+
+import csv
+import re
+import sys
+
+from functools import lru_cache
+from time import perf_counter
+
+from nltk.stem import SnowballStemmer, WordNetLemmatizer
+from nltk.tokenize import word_tokenize
+
+# Change tabs to spaces
+TABS_RE = re.compile(r"\t+_+")
+# Change short forms. The rules are applied in the original order; the ones
+# grouped together cannot create or destroy each other's matches, so a single
+# pass over the sentence gives the same result as one pass for every rule.
+SHORT_FORMS_RE = re.compile(r"\'ve|can\'t|can not|n\'t")
+SHORT_FORMS = {"'ve": " have", "can't": "cannot", "can not": "cannot",
+               "n't": " not"}
+AM_RE = re.compile(r" m ")
+ARE_RE = re.compile(r"(\'re| r )")
+WOULD_WILL_RE = re.compile(r"\'d|\'ll")
+WOULD_WILL = {"'d": " would ", "'ll": " will "}
+THOUSANDS_RE = re.compile(r"(\d+)(k)")
+# Make word separations
+OPERATORS_RE = re.compile(r"(\+|-|\*|\/|\^|\.)")
+# Remove irrelevant stuff, nonprintable characters and spaces
+IRRELEVANT_RE = re.compile(r"(\'s|\'S|\'|\"|,|[^ -~]+)")
+SPACES_RE = re.compile(r"\s+")
+# Remove dot (encoded by textcleaner with $1), if necessary
+END_DOT_RE = re.compile(r" *\$1 *$")
+
+STEMMER = SnowballStemmer("english")
+LEMMATIZER = WordNetLemmatizer()
+
+@lru_cache(maxsize=65536)
+def normalize_word(word):
+    """Stems and lemmatizes a word. The results are cached.
+
+    Args:
+        word (str): The input word.
+    Returns:
+        str: The normalized word.
+    """
+
+    return LEMMATIZER.lemmatize(STEMMER.stem(word))
+
+def clean(sentence):
+    """Cleans a sentence, before splitting it into words.
+
+    Args:
+        sentence (str): The input sentence.
+    Returns:
+        str: The cleaned sentence.
+    """
+
+    # Only the first line is used, as textcleaner does.
+    sentence = sentence.lower().split("\n", 1)[0]
+
+    sentence = TABS_RE.sub(" ", sentence)
+    sentence = SHORT_FORMS_RE.sub(lambda m: SHORT_FORMS[m.group(0)], sentence)
+    sentence = AM_RE.sub(" am ", sentence)
+    sentence = ARE_RE.sub(" are ", sentence)
+    sentence = WOULD_WILL_RE.sub(lambda m: WOULD_WILL[m.group(0)], sentence)
+    sentence = THOUSANDS_RE.sub(r"\g<1>000", sentence)
+    sentence = OPERATORS_RE.sub(" $1 ", sentence)
+    sentence = IRRELEVANT_RE.sub("", sentence)
+    sentence = SPACES_RE.sub(" ", sentence.strip(".\n"))
+
+    return END_DOT_RE.sub("", sentence)
+
+def tokenize(sentence):
+    """Tokenizer function - cleans and tokenizes the data
+
+    Args:
+        sentence (str): The input sentence.
+    Returns:
+        list: The transformed input sentence.
+    """
+
+    if sentence == "":
+        return ""
+
+    sentence = clean(sentence)
+
+    if sentence == "":
+        return ""
+
+    return word_tokenize(" ".join(map(normalize_word, sentence.split())))
+
+def reference_tokenize(sentence):
+    """The original tokenizer, kept for checking the parity of tokenize.
+
+    Args:
+        sentence (str): The input sentence.
+    Returns:
+        list: The transformed input sentence.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import textcleaner as tc
+
+    if sentence == "":
+        return ""
+
+    sentence = tc.lower_all(sentence)[0]
+
+    # Change tabs to spaces
+    sentence = re.sub(r"\t+_+", " ", sentence)
+    # Change short forms
+    sentence = re.sub(r"\'ve", " have", sentence)
+    sentence = re.sub(r"(can\'t|can not)", "cannot", sentence)
+    sentence = re.sub(r"n\'t", " not", sentence)
+    sentence = re.sub(r"I\'m", "I am", sentence)
+    sentence = re.sub(r" m ", " am ", sentence)
+    sentence = re.sub(r"(\'re| r )", " are ", sentence)
+    sentence = re.sub(r"\'d", " would ", sentence)
+    sentence = re.sub(r"\'ll", " will ", sentence)
+    sentence = re.sub(r"(\d+)(k)", r"\g<1>000", sentence)
+    # Make word separations
+    sentence = re.sub(r"(\+|-|\*|\/|\^|\.)", " $1 ", sentence)
+    # Remove irrelevant stuff, nonprintable characters and spaces
+    sentence = re.sub(r"(\'s|\'S|\'|\"|,|[^ -~]+)", "", sentence)
+    sentence = tc.strip_all(sentence)[0]
+    # Remove dot (encoded by textcleaner with $1), if necessary
+    sentence = re.sub(r" *\$1 *$", "", sentence)
+
+    if sentence == "":
+        return ""
+
+    return tc.token_it(tc.lemming(tc.stemming(sentence)))[0]
+
+def check_parity(paths):
+    """Compares tokenize to reference_tokenize on the logged answers.
+
+    Args:
+        paths (list): The paths to the CSV logs (message, reference, ...).
+    Returns:
+        int: The number of sentences tokenized differently.
+    """
+
+    sentences = []
+    for path in paths:
+        with open(path, "r", newline="", encoding="utf-8") as fin:
+            for row in csv.reader(fin):
+                sentences += row[:2]
+
+    start = perf_counter()
+    expected = []
+    for sentence in sentences:
+        try:
+            expected.append(reference_tokenize(sentence))
+        except IndexError:
+            # textcleaner fails on sentences which are cleaned to nothing
+            # before stripping, tokenize returns "" for them.
+            expected.append("")
+    reference_time = perf_counter() - start
+
+    start = perf_counter()
+    actual = [tokenize(sentence) for sentence in sentences]
+    tokenize_time = perf_counter() - start
+
+    mismatches = 0
+    for sentence, exp, act in zip(sentences, expected, actual):
+        if exp != act:
+            mismatches += 1
+            print(f"Mismatch for {sentence!r}: {exp} != {act}")
+
+    print(f"{len(sentences)} sentences, {mismatches} mismatches")
+    print(f"reference: {reference_time:.3f}s, tokenize: {tokenize_time:.3f}s")
+
+    return mismatches
+
+if __name__ == "__main__":
+    sys.exit(1 if check_parity(sys.argv[1:]) else 0)
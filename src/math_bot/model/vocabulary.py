@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The compiled, memory-mapped vocabulary
+
+en_vocab.txt is a JSON object mapping every word to its id, which takes a
+large dict of str objects in every process. It is compiled once into a binary
+file which is memory-mapped, so the processes share its pages and nothing is
+built when loading it. The file holds, after the header:
+    - an open addressing hash table (CRC-32 of the word, linear probing) of
+      uint32 slots, each 0 (empty) or the index of an entry plus 1;
+    - the entries' ids (int32), the CRC-32 of their words (uint32) and the
+      offsets of their words (uint32, one more than the entries) in the
+      string table, the entries being sorted by word;
+    - the string table, the UTF-8 words one after the other.
+A word is found by hashing it and comparing it to the words of a few slots
+having the same CRC-32, so a lookup takes O(len(word)). Unknown words get the id 0, as with the
+defaultdict used before.
+
+Compiling en_vocab.txt (to en_vocab.bin, which data_loader uses when it
+exists) and comparing the memory and lookup time to the dict, from
+src/math_bot:
+    python -m model.vocabulary compile
+    python -m model.vocabulary benchmark
+"""
+
+import json
+import mmap
+import struct
+import subprocess
+import sys
+import timeit
+import zlib
+
+from argparse import ArgumentParser
+
+import numpy as np
+
+# The file's signature and format version.
+MAGIC = b"MBVOCAB2"
+# The magic, then the number of words, the number of slots and the length of
+# the string table.
+HEADER = struct.Struct("<8sIII")
+# The id of the words which are not in the vocabulary.
+UNKNOWN_ID = 0
+
+def compile_vocab(vocab_path, out_path):
+    # pylint: disable=too-many-locals
+    """Compile a JSON vocabulary into the memory-mapped format.
+
+    Args:
+        vocab_path (str): The JSON file, e.g. en_vocab.txt.
+        out_path (str): The compiled file, e.g. en_vocab.bin.
+    Returns:
+        int: The number of words.
+    """
+
+    with open(vocab_path, "r", encoding="utf-8") as fin:
+        vocab_dict = json.load(fin)
+
+    words = sorted(vocab_dict)
+    encoded = [word.encode("utf-8") for word in words]
+    ids = np.array([vocab_dict[word] for word in words], dtype="<i4")
+    hashes = np.array([zlib.crc32(word) for word in encoded], dtype="<u4")
+    offsets = np.zeros(len(words) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(word) for word in encoded])
+
+    # At most half of the slots are used, so the probes stay short.
+    num_slots = 1
+    while num_slots < 2 * len(words):
+        num_slots *= 2
+    mask = num_slots - 1
+
+    table = np.zeros(num_slots, dtype="<u4")
+    for (index, word_hash) in enumerate(hashes.tolist()):
+        slot = word_hash & mask
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = index + 1
+
+    blob = b"".join(encoded)
+
+    with open(out_path, "wb") as fout:
+        fout.write(HEADER.pack(MAGIC, len(words), num_slots, len(blob)))
+        fout.write(table.tobytes())
+        fout.write(ids.tobytes())
+        fout.write(hashes.tobytes())
+        fout.write(offsets.tobytes())
+        fout.write(blob)
+
+    return len(words)
+
+class CompactVocab:
+    # pylint: disable=too-many-instance-attributes
+    """A compiled vocabulary, memory-mapped, used like the defaultdict
+    returned by data_loader before: vocab[word] is the word's id, 0 if the
+    word is unknown (nothing is added), and len(vocab) is the number of words.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The compiled file.
+        Raises:
+            ValueError: If the file is not a compiled vocabulary.
+        """
+
+        with open(path, "rb") as fin:
+            self._map = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, self._count, num_slots, blob_len) = \
+            HEADER.unpack_from(self._map)
+        if magic != MAGIC or num_slots & (num_slots - 1):
+            raise ValueError(f"{path} is not a compiled vocabulary")
+
+        start = HEADER.size
+        ids_start = start + 4 * num_slots
+        hashes_start = ids_start + 4 * self._count
+        offsets_start = hashes_start + 4 * self._count
+        self._blob_start = offsets_start + 4 * (self._count + 1)
+        if len(self._map) != self._blob_start + blob_len:
+            raise ValueError(f"{path} is truncated")
+
+        # Views of the mapped file, nothing is copied.
+        view = memoryview(self._map)
+        self._table = view[start:ids_start].cast("I")
+        self._ids = view[ids_start:hashes_start].cast("i")
+        self._hashes = view[hashes_start:offsets_start].cast("I")
+        self._offsets = view[offsets_start:self._blob_start].cast("I")
+        self._mask = num_slots - 1
+
+    def __len__(self):
+        return self._count
+
+    def _index(self, word):
+        """
+        Returns:
+            int: The index of a word's entry, -1 if it is unknown.
+        """
+
+        word_bytes = word.encode("utf-8")
+        (table, hashes, mask) = (self._table, self._hashes, self._mask)
+        word_hash = zlib.crc32(word_bytes)
+        slot = word_hash & mask
+
+        while True:
+            entry = table[slot]
+            if entry == 0:
+                return -1
+
+            # The words are only compared when their hashes are the same.
+            index = entry - 1
+            if hashes[index] == word_hash and \
+               self._map[self._blob_start + self._offsets[index]:
+                         self._blob_start + self._offsets[entry]] == \
+               word_bytes:
+                return index
+
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, word):
+        index = self._index(word)
+
+        return UNKNOWN_ID if index < 0 else self._ids[index]
+
+    def __contains__(self, word):
+        return self._index(word) >= 0
+
+    def get(self, word, default=None):
+        """
+        Returns:
+            int: A word's id, default if it is unknown.
+        """
+
+        index = self._index(word)
+
+        return default if index < 0 else self._ids[index]
+
+    def encode(self, tokens):
+        """
+        Args:
+            tokens (list): The words.
+        Returns:
+            numpy.ndarray: Their ids (int32), 0 for the unknown ones.
+        """
+
+        return np.fromiter((self[word] for word in tokens), dtype=np.int32,
+                           count=len(tokens))
+
+def _measure(kind, vocab_path, compiled_path, number):
+    """
+    Load a vocabulary in this process and time the lookup of every word of the
+    vocabulary and of as many unknown words.
+
+    Returns:
+        dict: The load time, the memory allocated by Python and the lookup
+              times.
+    """
+
+    # pylint: disable=import-outside-toplevel,too-many-locals
+    import tracemalloc
+    from collections import defaultdict
+
+    with open(vocab_path, "r", encoding="utf-8") as fin:
+        known = list(json.load(fin))
+    unknown = [f"{word}#unknown" for word in known]
+
+    tracemalloc.start()
+    start = timeit.default_timer()
+    if kind == "dict":
+        with open(vocab_path, "r", encoding="utf-8") as fin:
+            vocab = defaultdict(lambda: UNKNOWN_ID, json.load(fin))
+    else:
+        vocab = CompactVocab(compiled_path)
+    loaded = timeit.default_timer()
+    (allocated, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {"vocabulary": kind,
+              "load_ms": round((loaded - start) * 1000, 2),
+              "python_heap_mb": round(allocated / 2 ** 20, 2)}
+
+    for (name, words) in (("known", known), ("unknown", unknown)):
+        def lookup(words=words):
+            return [vocab[word] for word in words]
+
+        # The ids must be the same for both vocabularies.
+        result[f"{name}_checksum"] = sum(lookup())
+        seconds = timeit.timeit(lookup, number=number)
+        result[f"{name}_lookup_ns"] = round(seconds / number / len(words) *
+                                            1e9, 1)
+
+    return result
+
+def benchmark(vocab_path, compiled_path, number):
+    """
+    Compare the dict and the compiled vocabulary, each in a new process (see
+    _measure).
+
+    Returns:
+        list: The results of both.
+    """
+
+    results = []
+    for kind in ("dict", "compiled"):
+        output = subprocess.run(
+            [sys.executable, "-m", "model.vocabulary", "measure", kind,
+             "--vocab", vocab_path, "--compiled", compiled_path,
+             "--number", str(number)],
+            check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    return results
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compile and benchmark the "
+                                        "vocabulary.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for command in ("compile", "benchmark", "measure"):
+        subparser = subparsers.add_parser(command)
+        if command == "measure":
+            subparser.add_argument("kind", choices=["dict", "compiled"])
+        subparser.add_argument("--vocab", default="model/data/en_vocab.txt")
+        subparser.add_argument("--compiled",
+                               default="model/data/en_vocab.bin")
+        if command != "compile":
+            subparser.add_argument("--number", type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        print(f"{compile_vocab(args.vocab, args.compiled)} words compiled")
+    elif args.command == "benchmark":
+        for report in benchmark(args.vocab, args.compiled, args.number):
+            print(json.dumps(report))
+    else:
+        print(json.dumps(_measure(args.kind, args.vocab, args.compiled,
+                                  args.number)))
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The store of the users' conversation state
+
+The state (the question a user has to answer, the pending quit confirmation)
+expires, so users who abandon a conversation do not keep it forever. It is
+kept in memory, for a single process, or in the database, through the database
+adapter, so that several processes or replicas can serve the same users.
+"""
+
+import os
+import threading
+
+from collections import OrderedDict
+from time import monotonic
+
+class SessionStoreError(Exception):
+    """A call to the shared session store failed."""
+
+def pop_first_result(req):
+    """
+    Read the database adapter's reply to a pop_first call.
+
+    Raises:
+        SessionStoreError: If the call failed.
+    Returns:
+        tuple: The kind and the state, (None, None) if there is none.
+    """
+
+    if req.status_code == 404:
+        return (None, None)
+
+    if req.status_code != 200:
+        raise SessionStoreError(f"Reading state failed: {req.status_code}")
+
+    result = req.json()
+
+    return (result["kind"], result["value"])
+
+class MemorySessionStore:
+    """Conversation state kept in the process' memory, with a TTL and an LRU
+    limit of the number of users.
+    """
+
+    def __init__(self, ttl=86400, max_users=100000):
+        """
+        Args:
+            ttl (float, optional): How long (seconds) the state is kept.
+                                   Defaults to 86400.
+            max_users (int, optional): The maximum number of users having
+                                       state, the least recently updated ones
+                                       are dropped. Defaults to 100000.
+        """
+
+        self.ttl = ttl
+        self.max_users = max_users
+        # user_id -> {kind: (expiration time, value)}
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set(self, kind, user_id, value):
+        """Saves a piece of a user's state, replacing the old one.
+
+        Args:
+            kind (str): The kind of state, e.g. "answer".
+            user_id (int): The user's id.
+            value: The state, a JSON serializable value.
+        """
+
+        with self._lock:
+            self._users.setdefault(user_id, {})[kind] = \
+                (monotonic() + self.ttl, value)
+            self._users.move_to_end(user_id)
+
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def pop(self, kind, user_id):
+        """Removes a piece of a user's state and returns it.
+
+        Args:
+            kind (str): The kind of state, e.g. "answer".
+            user_id (int): The user's id.
+        Returns:
+            The state, None if there is none or it expired.
+        """
+
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None:
+                return None
+
+            (expires, value) = state.pop(kind, (0, None))
+            if not state:
+                del self._users[user_id]
+
+        if expires < monotonic():
+            return None
+
+        return value
+
+    def pop_first(self, kinds, user_id):
+        """Removes the first piece of a user's state, in the order of kinds,
+        and returns it. The expired state of these kinds is removed too.
+
+        Args:
+            kinds (tuple): The kinds of state, e.g. ("quit", "answer").
+            user_id (int): The user's id.
+        Returns:
+            tuple: The kind and the state, (None, None) if there is none.
+        """
+
+        now = monotonic()
+        found = (None, None)
+
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None:
+                return found
+
+            for kind in kinds:
+                (expires, _) = state.get(kind, (0, None))
+                if expires < now:
+                    state.pop(kind, None)
+                elif found[0] is None:
+                    found = (kind, state.pop(kind)[1])
+
+            if not state:
+                del self._users[user_id]
+
+        return found
+
+    def clear(self, user_id):
+        """Removes the whole state of a user.
+
+        Args:
+            user_id (int): The user's id.
+        """
+
+        with self._lock:
+            self._users.pop(user_id, None)
+
+class DatabaseSessionStore:
+    """Conversation state kept in the database's "sessions" table and shared
+    by every process using the same database adapter.
+    """
+
+    def __init__(self, client, ttl=86400):
+        """
+        Args:
+            client (common.http_client.ServiceClient): The database adapter's
+                                                       client.
+            ttl (float, optional): How long (seconds) the state is kept.
+                                   Defaults to 86400.
+        """
+
+        self.client = client
+        self.ttl = ttl
+
+    def set(self, kind, user_id, value):
+        """Saves a piece of a user's state, replacing the old one.
+
+        Args:
+            kind (str): The kind of state, e.g. "answer".
+            user_id (int): The user's id.
+            value: The state, a JSON serializable value.
+        Raises:
+            SessionStoreError: If the state could not be saved.
+        """
+
+        req = self.client.put(f"/api/session/{kind}/{user_id}",
+                              json={"value": value, "ttl": self.ttl})
+
+        if req.status_code != 200:
+            raise SessionStoreError(f"Saving state failed: {req.status_code}")
+
+    def pop(self, kind, user_id):
+        """Removes a piece of a user's state and returns it. Only one of the
+        concurrent calls gets the state.
+
+        Args:
+            kind (str): The kind of state, e.g. "answer".
+            user_id (int): The user's id.
+        Raises:
+            SessionStoreError: If the state could not be read.
+        Returns:
+            The state, None if there is none or it expired.
+        """
+
+        req = self.client.delete(f"/api/session/{kind}/{user_id}")
+
+        if req.status_code == 404:
+            return None
+
+        if req.status_code != 200:
+            raise SessionStoreError(f"Reading state failed: {req.status_code}")
+
+        return req.json()
+
+    def pop_first(self, kinds, user_id):
+        """Removes the first piece of a user's state, in the order of kinds,
+        and returns it, in one call to the database adapter. Only one of the
+        concurrent calls gets the state.
+
+        Args:
+            kinds (tuple): The kinds of state, e.g. ("quit", "answer").
+            user_id (int): The user's id.
+        Raises:
+            SessionStoreError: If the state could not be read.
+        Returns:
+            tuple: The kind and the state, (None, None) if there is none.
+        """
+
+        req = self.client.post(f"/api/session/{user_id}/pop",
+                               json={"kinds": list(kinds)})
+
+        return pop_first_result(req)
+
+    def clear(self, user_id):
+        """Removes the whole state of a user.
+
+        Args:
+            user_id (int): The user's id.
+        Raises:
+            SessionStoreError: If the state could not be removed.
+        """
+
+        req = self.client.delete(f"/api/session/{user_id}")
+
+        if req.status_code != 200:
+            raise SessionStoreError(f"Clearing state failed: {req.status_code}")
+
+class AsyncMemorySessionStore:
+    """MemorySessionStore for asyncio apps. The calls never wait, the methods
+    are coroutines only to be used as AsyncDatabaseSessionStore's.
+    """
+
+    def __init__(self, ttl=86400, max_users=100000):
+        """
+        Args:
+            ttl (float, optional): How long (seconds) the state is kept.
+                                   Defaults to 86400.
+            max_users (int, optional): The maximum number of users having
+                                       state. Defaults to 100000.
+        """
+
+        self.store = MemorySessionStore(ttl, max_users)
+
+    async def set(self, kind, user_id, value):
+        """See MemorySessionStore.set."""
+
+        self.store.set(kind, user_id, value)
+
+    async def pop(self, kind, user_id):
+        """See MemorySessionStore.pop."""
+
+        return self.store.pop(kind, user_id)
+
+    async def pop_first(self, kinds, user_id):
+        """See MemorySessionStore.pop_first."""
+
+        return self.store.pop_first(kinds, user_id)
+
+    async def clear(self, user_id):
+        """See MemorySessionStore.clear."""
+
+        self.store.clear(user_id)
+
+class AsyncDatabaseSessionStore:
+    """DatabaseSessionStore for asyncio apps."""
+
+    def __init__(self, client, ttl=86400):
+        """
+        Args:
+            client (common.async_http_client.AsyncServiceClient): The database
+                                                                  adapter's
+                                                                  client.
+            ttl (float, optional): How long (seconds) the state is kept.
+                                   Defaults to 86400.
+        """
+
+        self.client = client
+        self.ttl = ttl
+
+    async def set(self, kind, user_id, value):
+        """See DatabaseSessionStore.set."""
+
+        req = await self.client.put(f"/api/session/{kind}/{user_id}",
+                                    json={"value": value, "ttl": self.ttl})
+
+        if req.status_code != 200:
+            raise SessionStoreError(f"Saving state failed: {req.status_code}")
+
+    async def pop(self, kind, user_id):
+        """See DatabaseSessionStore.pop."""
+
+        req = await self.client.delete(f"/api/session/{kind}/{user_id}")
+
+        if req.status_code == 404:
+            return None
+
+        if req.status_code != 200:
+            raise SessionStoreError(f"Reading state failed: {req.status_code}")
+
+        return req.json()
+
+    async def pop_first(self, kinds, user_id):
+        """See DatabaseSessionStore.pop_first."""
+
+        req = await self.client.post(f"/api/session/{user_id}/pop",
+                                     json={"kinds": list(kinds)})
+
+        return pop_first_result(req)
+
+    async def clear(self, user_id):
+        """See DatabaseSessionStore.clear."""
+
+        req = await self.client.delete(f"/api/session/{user_id}")
+
+        if req.status_code != 200:
+            raise SessionStoreError(f"Clearing state failed: {req.status_code}")
+
+def session_store_from_env(db_client, asynchronous=False):
+    """Creates the session store selected by SESSION_BACKEND ("memory" or
+    "database"), configured by SESSION_TTL and SESSION_MAX_USERS.
+
+    Args:
+        db_client (common.http_client.ServiceClient): The database adapter's
+                                                      client (an
+                                                      AsyncServiceClient if
+                                                      asynchronous).
+        asynchronous (bool, optional): If the store is used by an asyncio app.
+                                       Defaults to False.
+    Returns:
+        MemorySessionStore or DatabaseSessionStore: The store (their async
+                                                    variants if asynchronous).
+    """
+
+    backend = os.getenv("SESSION_BACKEND", "memory")
+    ttl = float(os.getenv("SESSION_TTL", "86400"))
+
+    if backend == "database":
+        if asynchronous:
+            return AsyncDatabaseSessionStore(db_client, ttl)
+        return DatabaseSessionStore(db_client, ttl)
+
+    if backend != "memory":
+        raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+
+    max_users = int(os.getenv("SESSION_MAX_USERS", "100000"))
+    if asynchronous:
+        return AsyncMemorySessionStore(ttl, max_users)
+    return MemorySessionStore(ttl, max_users)
@@ -0,0 +1,51 @@
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - The tests' configuration
+
+The components import their modules from their own directories, as when run
+in their containers, and the common package from src.
+"""
+
+import os
+import sys
+
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                   "src")
+for directory in ("", "database_adapter", "frontend_adapter", "math_bot"):
+    sys.path.insert(0, os.path.join(SRC, directory))
+
+@pytest.fixture(name="tiny_model")
+def fixture_tiny_model(monkeypatch):
+    """A Siamese model with small random weights and a vocabulary of 40 words
+    (w0, ..., w39), the sentences being split on spaces.
+
+    Returns:
+        tuple: The vocabulary and the model (NumpySiamese).
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from model import model as model_module
+    from model.numpy_engine import NumpySiamese
+
+    monkeypatch.setattr(model_module, "data_tokenizer", str.split)
+
+    rng = np.random.default_rng(3)
+    (vocab_size, d_model) = (40, 8)
+    vocab = defaultdict(int, {f"w{idx}": idx for idx in range(vocab_size)})
+    vocab["<PAD>"] = 1
+
+    model = NumpySiamese(
+        rng.normal(size=(vocab_size, d_model)).astype(np.float32),
+        (rng.normal(size=(2 * d_model, 4 * d_model)) * 0.3).astype(np.float32),
+        rng.normal(size=(4 * d_model, )).astype(np.float32))
+
+    return (vocab, model)
@@ -0,0 +1,143 @@
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - Tests of the frontend adapter's webhook mode and bounded
+dispatch, against the fake Telegram Bot API server
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer
+from time import monotonic, sleep
+
+import pytest
+import requests
+
+from fake_telegram import FakeTelegram, make_handler
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                   "src")
+TOKEN = "123:test"
+# The first line of the reply to /help.
+HELP_REPLY = "I am MathBot"
+
+def free_port():
+    """
+    Returns:
+        int: A port nothing listens on.
+    """
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@contextmanager
+def adapter(tmp_path, **env):
+    """Runs the fake Bot API server and the frontend adapter, configured by
+    env, until the adapter sets its webhook or starts polling.
+
+    Yields:
+        FakeTelegram: The fake's state.
+    """
+
+    fake = FakeTelegram()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(fake))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    environ = dict(os.environ, PYTHONPATH=SRC, API_TOKEN=TOKEN,
+                   TELEGRAM_BASE_URL=f"http://127.0.0.1:"
+                                     f"{server.server_port}/bot",
+                   MEDIA_CACHE_FILE=str(tmp_path / "file_ids.json"),
+                   IMAGES_DIR=str(tmp_path), SEND_GLOBAL_RATE="1000",
+                   SEND_CHAT_RATE="1000", SEND_CHAT_BURST="1000", **env)
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, os.path.join(SRC, "frontend_adapter",
+                                      "frontend_adapter.py")],
+        env=environ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        assert fake.wait_adapter(timeout=30)
+        yield fake
+    finally:
+        process.terminate()
+        process.wait(30)
+        server.shutdown()
+
+def send_help(fake, users, messages, concurrency):
+    """Sends /help from several users, at once, and waits until all of them
+    are answered (the replies of a user may be merged into one message).
+
+    Returns:
+        list: The number of /help replies every user got.
+    """
+
+    def send(user_id):
+        with requests.Session() as session:
+            for _ in range(messages):
+                fake.deliver(fake.new_update(user_id, "/help"), session)
+
+    user_ids = range(1000, 1000 + users)
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(send, user_ids))
+
+    def answered():
+        with fake.cond:
+            replies = list(fake.replies)
+
+        return [sum(text.count(HELP_REPLY)
+                    for (chat_id, text) in replies if chat_id == user_id)
+                for user_id in user_ids]
+
+    deadline = monotonic() + 60
+    while sum(answered()) < users * messages and monotonic() < deadline:
+        sleep(0.05)
+
+    return answered()
+
+@pytest.mark.parametrize("mode", ["webhook", "polling"])
+def test_every_update_is_answered(tmp_path, mode):
+    """The updates are received through the webhook (which Telegram is told
+    to use, with the token in its path) or by long polling, and every one is
+    answered."""
+
+    env = {}
+    if mode == "webhook":
+        port = free_port()
+        env = {"WEBHOOK_URL": f"http://127.0.0.1:{port}",
+               "WEBHOOK_ADDR": "127.0.0.1", "WEBHOOK_PORT": str(port)}
+
+    with adapter(tmp_path, **env) as fake:
+        if mode == "webhook":
+            assert fake.webhook_url == f"http://127.0.0.1:{port}/{TOKEN}"
+
+        assert send_help(fake, users=10, messages=3, concurrency=5) == [3] * 10
+
+        if mode == "webhook":
+            assert fake.counts["getUpdates"] == 0
+            assert fake.counts["rejected"] == 0
+        else:
+            assert fake.counts["getUpdates"] > 0
+
+def test_full_queues_reject_webhook_updates(tmp_path):
+    """With full queues, the webhook rejects the updates instead of queueing
+    them without a bound, and the updates delivered again are answered."""
+
+    port = free_port()
+    env = {"WEBHOOK_URL": f"http://127.0.0.1:{port}",
+           "WEBHOOK_ADDR": "127.0.0.1", "WEBHOOK_PORT": str(port),
+           "DISPATCHER_WORKERS": "1", "SHARD_QUEUE_SIZE": "1",
+           "UPDATE_QUEUE_SIZE": "1"}
+
+    with adapter(tmp_path, **env) as fake:
+        assert send_help(fake, users=40, messages=5, concurrency=40) == \
+               [5] * 40
+        assert fake.counts["rejected"] > 0
@@ -0,0 +1,82 @@
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - Tests of the micro-batching inference queue
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from model import EmbeddingStore, InferenceQueue
+from model.model import data_gen
+
+MAX_LEN = 16
+
+def predict_similarity(answer, reference, model, vocab):
+    """The similarity computed as predict does: both sentences are padded by
+    data_gen and go through the model together.
+    """
+
+    answer_tensor = [vocab[word] for word in answer.split()][:MAX_LEN]
+    ref_tensor = [vocab[word] for word in reference.split()]
+    (input1, input2) = next(data_gen([answer_tensor], [ref_tensor], 1,
+                                     vocab["<PAD>"]))
+    (vec1, vec2) = model((input1, input2))
+
+    return float(np.dot(vec1[0], vec2[0].T))
+
+def sentences(rng, lengths):
+    """Random sentences of the vocabulary's words."""
+
+    return [" ".join(f"w{idx}" for idx in rng.integers(2, 40, length))
+            for length in lengths]
+
+def test_batched_similarity_matches_predict(tiny_model):
+    """Concurrent answers, batched together, get the similarities predict
+    gives them, whatever the lengths of the answers and references."""
+
+    (vocab, model) = tiny_model
+    rng = np.random.default_rng(0)
+    references = sentences(rng, [1, 3, 5, 9, 20, 70])
+    pairs = list(zip(sentences(rng, rng.integers(1, 30, 200)),
+                     rng.choice(references, 200)))
+
+    # Some references are embedded on their first use only.
+    store = EmbeddingStore(model, vocab, MAX_LEN)
+    store.refresh(references[:4])
+    infer_queue = InferenceQueue(model, vocab, window=0.01, max_len=MAX_LEN,
+                                 store=store)
+
+    with ThreadPoolExecutor(16) as executor:
+        batched = list(executor.map(
+            lambda pair: infer_queue.similarity(*pair, timeout=10), pairs))
+
+    expected = [predict_similarity(answer, reference, model, vocab)
+                for (answer, reference) in pairs]
+    assert np.allclose(batched, expected, rtol=0, atol=1e-6)
+    assert infer_queue.metrics()["max_batch_size"] > 1
+
+    # An answer graded alone, with its reference's vector from the store.
+    (answer, reference) = pairs[0]
+    single_queue = InferenceQueue(model, vocab, window=0, max_len=MAX_LEN,
+                                  store=store)
+    assert abs(single_queue.similarity(answer, reference, timeout=10) -
+               expected[0]) < 1e-6
+    assert single_queue.metrics()["max_batch_size"] == 1
+
+def test_store_precomputes_the_answer_lengths(tiny_model):
+    """A reference is embedded at every padded length an answer can have."""
+
+    (vocab, model) = tiny_model
+    store = EmbeddingStore(model, vocab, MAX_LEN)
+    store.refresh(["w2 w3 w4", "w5 " * 40])
+
+    assert len(store) == 2
+    assert store.length("w2 w3 w4") == 3
+    # pylint: disable=protected-access
+    assert sorted(store._vectors) == [("w2 w3 w4", 4), ("w2 w3 w4", 8),
+                                      ("w2 w3 w4", 16), ("w5 " * 40, 64)]
@@ -0,0 +1,188 @@
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - Tests of the NumPy inference engine
+"""
+
+import gzip
+import pickle
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from model.numpy_engine import NumpyEncoder, NumpySiamese, export, load, \
+                               read_checkpoint
+
+D_MODEL = 8
+VOCAB_SIZE = 30
+
+def random_weights(seed=0):
+    """The weights of a small Siamese model."""
+
+    rng = np.random.default_rng(seed)
+
+    return {
+        "embedding": rng.normal(size=(VOCAB_SIZE, D_MODEL)).astype(np.float32),
+        "lstm_w": (rng.normal(size=(2 * D_MODEL, 4 * D_MODEL)) *
+                   0.3).astype(np.float32),
+        "lstm_b": rng.normal(size=(4 * D_MODEL, )).astype(np.float32)
+    }
+
+def reference_encoder(tokens, embedding, lstm_w, lstm_b):
+    """trax's Embedding, LSTM (LSTMCell: the kernel's columns are the input
+    gate, the new input, the forget gate and the output gate), Mean and
+    Normalize, one sentence and one word at a time, in float64.
+    """
+
+    # pylint: disable=too-many-locals
+
+    def sigmoid(vec):
+        return 1 / (1 + np.exp(-vec))
+
+    vectors = []
+    for sentence in tokens:
+        cell = np.zeros(D_MODEL)
+        hidden = np.zeros(D_MODEL)
+        outputs = []
+        for word in sentence:
+            gates = np.concatenate([embedding[word], hidden]) @ lstm_w + lstm_b
+            (input_gate, new_input, forget_gate, output_gate) = \
+                (gates[idx * D_MODEL:(idx + 1) * D_MODEL] for idx in range(4))
+            cell = cell * sigmoid(forget_gate) + \
+                   sigmoid(input_gate) * np.tanh(new_input)
+            hidden = np.tanh(cell) * sigmoid(output_gate)
+            outputs.append(hidden)
+
+        vec = np.mean(outputs, axis=0)
+        vectors.append(vec / np.linalg.norm(vec))
+
+    return np.array(vectors)
+
+def test_encoder_matches_reference():
+    """The vectorized encoder gives trax's vectors, the pads included."""
+
+    weights = random_weights()
+    tokens = np.random.default_rng(1).integers(0, VOCAB_SIZE, size=(5, 7))
+    tokens[:, 4:] = 1
+
+    vectors = NumpyEncoder(**weights)(tokens)
+
+    assert vectors.dtype == np.float32
+    assert np.allclose(vectors, reference_encoder(tokens, **weights),
+                       atol=1e-5)
+
+def test_gate_order():
+    """Swapping two gates' columns changes the vectors, so the reference
+    comparison checks the gate order."""
+
+    weights = random_weights()
+    tokens = np.random.default_rng(2).integers(0, VOCAB_SIZE, size=(3, 6))
+    expected = reference_encoder(tokens, **weights)
+
+    for (first, second) in ((0, 2), (1, 3), (2, 3)):
+        swapped = dict(weights)
+        for name in ("lstm_w", "lstm_b"):
+            gates = np.split(weights[name], 4, axis=-1)
+            (gates[first], gates[second]) = (gates[second], gates[first])
+            swapped[name] = np.concatenate(gates, axis=-1)
+
+        assert not np.allclose(NumpyEncoder(**swapped)(tokens), expected,
+                               atol=1e-3)
+
+def test_siamese_branches_share_weights():
+    """model((s1, s2)) embeds both batches with the same encoder."""
+
+    weights = random_weights()
+    tokens = np.random.default_rng(3).integers(0, VOCAB_SIZE, size=(4, 5))
+    model = NumpySiamese(**weights)
+
+    (vec1, vec2) = model((tokens, tokens[::-1]))
+
+    assert np.array_equal(vec1, model.sublayers[0](tokens))
+    assert np.array_equal(vec2, vec1[::-1])
+
+def test_siamese_matches_trax():
+    """The same weights, copied into trax's siamese(), give the same vectors
+    through model((s1, s2)), the pads included."""
+
+    # pylint: disable=import-outside-toplevel
+    trax = pytest.importorskip("trax")
+    from trax import layers as tl
+    from model.model import siamese
+
+    weights = random_weights()
+    tokens = np.random.default_rng(5).integers(0, VOCAB_SIZE, size=(4, 9))
+    tokens[1:, 6:] = 1
+    inputs = (tokens, tokens[::-1])
+
+    trax_model = siamese(VOCAB_SIZE, D_MODEL)
+    trax_model.init(trax.shapes.signature(inputs))
+
+    # As in a checkpoint: the first branch's weights, in trax's order.
+    (flat_weights, _) = tl.flatten_weights_and_state(trax_model.weights,
+                                                     trax_model.state)
+    assert [weight.shape for weight in flat_weights] == \
+           [weights[name].shape for name in ("embedding", "lstm_w", "lstm_b")]
+    (trax_model.weights, _) = tl.unflatten_weights_and_state(
+        [weights["embedding"], weights["lstm_w"], weights["lstm_b"]], [],
+        (trax_model.weights, trax_model.state), weights_only=True)
+
+    trax_vectors = trax_model(inputs)
+    numpy_vectors = NumpySiamese(**weights)(inputs)
+
+    for (trax_vec, numpy_vec) in zip(trax_vectors, numpy_vectors):
+        assert np.allclose(np.asarray(trax_vec), numpy_vec, atol=1e-5)
+
+def test_sharded_bfloat16_checkpoint(tmp_path, monkeypatch):
+    """A sharded checkpoint, having trax objects and bfloat16 weights, is read
+    without trax, and the .npz exported from it gives the same model."""
+
+    weights = random_weights()
+    # The embedding, stored as bfloat16: the upper 16 bits of the float32s.
+    bits = (weights["embedding"].view(np.uint32) >> 16).astype(np.uint16)
+    bits[0, :3] = (0x3F80, 0xC000, 0x0000)
+
+    # A trax object, pickled by reference to its module.
+    trax_shapes = types.ModuleType("trax.shapes")
+    signature = type("ShapeDtype", (), {"__module__": "trax.shapes"})
+    trax_shapes.ShapeDtype = signature
+    monkeypatch.setitem(sys.modules, "trax", types.ModuleType("trax"))
+    monkeypatch.setitem(sys.modules, "trax.shapes", trax_shapes)
+
+    checkpoint = str(tmp_path / "model.pkl.gz")
+    with gzip.open(checkpoint, "wb") as fout:
+        pickle.dump({"flat_weights": 2, "input_signature": signature(),
+                     "step": 100}, fout)
+    with open(f"{checkpoint}.shard0", "wb") as fout:
+        pickle.dump([(bits, "bfloat16")], fout)
+    with open(f"{checkpoint}.shard1", "wb") as fout:
+        pickle.dump([weights["lstm_w"], weights["lstm_b"]], fout)
+
+    monkeypatch.delitem(sys.modules, "trax")
+    monkeypatch.delitem(sys.modules, "trax.shapes")
+
+    read = read_checkpoint(checkpoint)
+
+    embedding = (bits.astype(np.uint32) << 16).view(np.float32)
+    assert read["embedding"].dtype == np.float32
+    assert np.array_equal(read["embedding"], embedding)
+    assert list(read["embedding"][0, :3]) == [1.0, -2.0, 0.0]
+    # Truncating to bfloat16 keeps 8 bits of the mantissa.
+    assert np.allclose(read["embedding"][1:], weights["embedding"][1:],
+                       rtol=2 ** -7)
+    assert np.array_equal(read["lstm_w"], weights["lstm_w"])
+    assert np.array_equal(read["lstm_b"], weights["lstm_b"])
+
+    # Without model.npz, the checkpoint is read.
+    tokens = np.random.default_rng(4).integers(0, VOCAB_SIZE, size=(2, 6))
+    expected = NumpyEncoder(**read)(tokens)
+    assert np.array_equal(load(checkpoint).sublayers[0](tokens), expected)
+
+    export(checkpoint, str(tmp_path / "model.npz"))
+    (tmp_path / "model.pkl.gz.shard0").unlink()
+    assert np.array_equal(load(checkpoint).sublayers[0](tokens), expected)
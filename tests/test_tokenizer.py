@@ -0,0 +1,76 @@
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - Tests of the tokenizer's parity with the textcleaner based
+one
+"""
+
+import csv
+
+import pytest
+
+from model.nltk_resources import missing_resources
+from model.tokenizer import check_parity, reference_tokenize, tokenize
+
+pytestmark = pytest.mark.skipif(
+    bool(missing_resources()),
+    reason="the NLTK resources are not installed (python -m "
+           "model.nltk_resources download)")
+
+CORPUS = [
+    "The sum of the angles of a triangle is 180 degrees.",
+    "I'm sure it's 5k, they're wrong",
+    "You can't divide by zero, we'd get infinity and we'll fail",
+    "I can not tell, I haven't learned it",
+    "x^2 + 2*x - 3/4 = 0.5",
+    "a/b/c...",
+    "Numbers: 10k 200k 3K",
+    "The derivative\t__of x is 1",
+    "\"Quoted\" words, commas, and 'single' ones",
+    "Running cats are studying the equations",
+    "m r u ok? i m fine, they r here",
+    "Ünïcödé characters é and ∑ symbols",
+    "THE ANSWER IS FORTY-TWO.",
+    "first line\nsecond line",
+    "...",
+    ".",
+    "$1",
+    "-",
+    " ",
+    "a",
+    "ab.",
+    "",
+]
+
+# textcleaner fails on the sentences cleaned to nothing before stripping.
+INDEX_ERROR_CASES = ["'", ",", "é", "\"\"", "'s", "'''", "\n", "\nabc", "é'"]
+
+@pytest.mark.parametrize("sentence", CORPUS)
+def test_tokenize_matches_reference(sentence):
+    """tokenize gives the same tokens as the textcleaner based tokenizer."""
+
+    assert tokenize(sentence) == reference_tokenize(sentence)
+
+@pytest.mark.parametrize("sentence", INDEX_ERROR_CASES)
+def test_tokenize_where_reference_fails(sentence):
+    """tokenize returns "" where the textcleaner based tokenizer fails."""
+
+    with pytest.raises(IndexError):
+        reference_tokenize(sentence)
+
+    assert tokenize(sentence) == ""
+
+def test_check_parity(tmp_path):
+    """check_parity reads the logs and finds no mismatch."""
+
+    log = tmp_path / "user_input.csv"
+    with open(log, "w", newline="", encoding="utf-8") as fout:
+        writer = csv.writer(fout)
+        writer.writerow(["message", "reference", "prediction"])
+        for sentence in CORPUS + INDEX_ERROR_CASES:
+            writer.writerow([sentence, CORPUS[0], 1])
+
+    assert check_parity([str(log)]) == 0
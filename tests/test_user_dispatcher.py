@@ -0,0 +1,105 @@
+"""
+Alin Georgescu
+University Politehnica of Bucharest
+Faculty of Automatic Control and Computers
+Computer Engeneering Department
+
+Math Bot (C) 2021 - Tests of the per-user dispatch of the Telegram updates
+"""
+
+import random
+import threading
+
+from time import sleep
+
+from user_dispatcher import ShardedExecutor, load_test
+
+def test_every_key_runs_in_order():
+    """The functions of a key run one at a time, in the submission order."""
+
+    executor = ShardedExecutor(4, queue_size=1000)
+    rng = random.Random(0)
+    lock = threading.Lock()
+    (running, order, overlaps) = (set(), {}, [])
+
+    def task(key, seq, delay):
+        with lock:
+            if key in running:
+                overlaps.append((key, seq))
+            running.add(key)
+            order.setdefault(key, []).append(seq)
+
+        sleep(delay)
+
+        with lock:
+            running.discard(key)
+
+    for seq in range(20):
+        for key in range(10):
+            executor.submit(key, task, key, seq, rng.random() * 0.002)
+
+    executor.join()
+    executor.stop()
+
+    assert not overlaps
+    assert order == {key: list(range(20)) for key in range(10)}
+
+def test_different_shards_run_concurrently():
+    """The functions of keys on different shards run at the same time: each
+    waits for the other at a barrier, which would time out if they ran one
+    after the other."""
+
+    executor = ShardedExecutor(2)
+    barrier = threading.Barrier(2, timeout=5)
+    passed = []
+
+    def task(key):
+        barrier.wait()
+        passed.append(key)
+
+    # The keys 0 and 1 are on different shards.
+    executor.submit(0, task, 0)
+    executor.submit(1, task, 1)
+    executor.join()
+    executor.stop()
+
+    assert sorted(passed) == [0, 1]
+    assert not barrier.broken
+
+def test_submit_waits_for_a_full_queue():
+    """submit waits while the key's shard has queue_size functions waiting."""
+
+    executor = ShardedExecutor(1, queue_size=1)
+    (started, release) = (threading.Event(), threading.Event())
+    done = []
+
+    def block():
+        started.set()
+        release.wait()
+
+    # The first function runs, the second one fills the queue.
+    executor.submit(0, block)
+    assert started.wait(5)
+    executor.submit(0, done.append, 1)
+
+    submitter = threading.Thread(target=executor.submit,
+                                 args=(0, done.append, 2))
+    submitter.start()
+    submitter.join(0.1)
+    assert submitter.is_alive()
+
+    release.set()
+    submitter.join(5)
+    executor.join()
+    executor.stop()
+
+    assert done == [1, 2]
+
+def test_user_dispatcher_keeps_every_users_order():
+    """The Telegram updates of every user are handled in order, one at a
+    time, by the dispatcher's shards."""
+
+    result = load_test(workers=4, users=20, messages=5, latency=0.001)
+
+    assert result["messages"] == 100
+    assert result["order_violations"] == 0